@@ -0,0 +1,189 @@
+"""
+Migration of the legacy ``activities`` collection to the compact schema.
+
+``CompactActivity`` stores activities in ``activities_v2`` with short keys
+and encoded values (see ``fields``). ``Activity`` is ``CompactActivity``
+when ``OCTOFIT_COMPACT_ACTIVITIES`` is on and ``LegacyActivity`` otherwise.
+The switch is rolled out in order:
+
+1. Deploy with ``OCTOFIT_COMPACT_ACTIVITIES`` off. The API keeps reading
+   and writing ``activities``, and ``mirror`` copies every activity write
+   (API, admin, bulk and buffered ingestion) to ``activities_v2``.
+2. Run ``migrate_activities``. It copies the legacy documents across in
+   ``_id`` order, a batch at a time, recording the last copied ``_id`` in
+   ``schema_migrations`` so an interrupted run resumes where it stopped.
+   Documents the mirror already wrote only hit duplicate keys, and copies
+   of documents deleted while their batch was in flight are removed
+   again. Renames are propagated to both collections meanwhile, and the
+   run ends by reconciling the compact copies' user names.
+3. Once it reports the migration finished, turn ``OCTOFIT_COMPACT_ACTIVITIES``
+   on everywhere and run ``migrate_activities`` once more to pick up
+   stragglers and renames from processes not yet switched.
+4. ``migrate_activities --drop-legacy`` then removes ``activities``.
+
+The leaderboard and rollups count the same activities in either schema, so
+they need no rebuild. Distances are stored to the metre: the API rejects
+finer values in both schemas, and legacy documents written before that
+check are rounded by the copy.
+"""
+import time
+
+from django.conf import settings
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from .documents import database
+from .fields import encode_document
+from .jobs import utcnow
+from .models import CompactActivity, LegacyActivity
+from .propagation import COMPACT_ACTIVITY_COPIES, reconcile_users
+
+LEGACY_COLLECTION = LegacyActivity._meta.db_table
+STATE_COLLECTION = 'schema_migrations'
+MIGRATION = 'activities_v2'
+DUPLICATE_KEY = 11000
+
+
+def convert(document):
+    """The compact ``activities_v2`` document for a legacy ``activities`` one."""
+    fields = {field.name for field in CompactActivity._meta.concrete_fields}
+    return encode_document(CompactActivity, {name: value for name, value in document.items() if name in fields})
+
+
+def mirror(instances=(), deleted=()):
+    """
+    Apply writes to the legacy collection to ``activities_v2`` as well:
+    upsert the compact form of the saved ``instances`` and delete the
+    ``deleted`` ones. A no-op once the compact schema is in use.
+    """
+    if settings.OCTOFIT_COMPACT_ACTIVITIES:
+        return
+    operations = [
+        ReplaceOne({'_id': instance._id}, convert({
+            field.name: getattr(instance, field.attname) for field in LegacyActivity._meta.concrete_fields
+        }), upsert=True)
+        for instance in instances
+    ]
+    operations += [DeleteOne({'_id': instance._id}) for instance in deleted]
+    if operations:
+        CompactActivity.objects.mongo_bulk_write(operations, ordered=False)
+
+
+def migration_state():
+    return database()[STATE_COLLECTION].find_one({'_id': MIGRATION}) or {
+        'last_id': None, 'copied': 0, 'finished_at': None,
+    }
+
+
+def copy_batch(after, batch_size):
+    """
+    Copy up to ``batch_size`` legacy documents with ``_id`` above ``after``.
+    Returns ``(last _id, documents read, documents inserted)``; the last
+    ``_id`` is None when nothing is left.
+    """
+    legacy = database()[LEGACY_COLLECTION]
+    query = {} if after is None else {'_id': {'$gt': after}}
+    batch = list(legacy.find(query).sort('_id', 1).limit(batch_size))
+    if not batch:
+        return None, 0, 0
+    inserted = len(batch)
+    try:
+        CompactActivity.objects.mongo_insert_many([convert(document) for document in batch], ordered=False)
+    except BulkWriteError as exc:
+        errors = exc.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        inserted -= len(errors)
+    # A delete between our read and insert was mirrored before the copy
+    # existed; drop copies whose legacy document is gone
+    ids = [document['_id'] for document in batch]
+    kept = {document['_id'] for document in legacy.find({'_id': {'$in': ids}}, {'_id': 1})}
+    gone = [_id for _id in ids if _id not in kept]
+    if gone:
+        CompactActivity.objects.mongo_delete_many({'_id': {'$in': gone}})
+    return batch[-1]['_id'], len(batch), inserted
+
+
+def migrate(batch_size=5000, pause=0.0, max_batches=None, progress=None):
+    """
+    Copy the legacy activities not copied yet, then reconcile the copies'
+    user names, and return the migration state. ``pause`` seconds between
+    batches limits the load on a live database; ``max_batches`` stops early
+    (the next run resumes).
+    """
+    states = database()[STATE_COLLECTION]
+    state = migration_state()
+    last_id = state['last_id']
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batch_last_id, read, inserted = copy_batch(last_id, batch_size)
+        if batch_last_id is None:
+            # Renames that raced the copy; required before the switch, not left to reconcile_users
+            reconcile_users(copies=COMPACT_ACTIVITY_COPIES, team_rollups=False)
+            states.update_one({'_id': MIGRATION}, {'$set': {'finished_at': utcnow()}}, upsert=True)
+            break
+        last_id = batch_last_id
+        states.update_one(
+            {'_id': MIGRATION},
+            {
+                '$set': {'last_id': last_id, 'updated_at': utcnow(), 'finished_at': None},
+                '$inc': {'read': read, 'copied': inserted},
+                '$setOnInsert': {'started_at': utcnow()},
+            },
+            upsert=True,
+        )
+        batches += 1
+        if progress is not None:
+            progress(states.find_one({'_id': MIGRATION}))
+        if pause:
+            time.sleep(pause)
+    return migration_state()
+
+
+def collection_stats(name):
+    """Size figures for collection ``name``, or None if it does not exist."""
+    db = database()
+    if name not in db.list_collection_names(filter={'name': name}):
+        return None
+    stats = db.command('collStats', name)
+    return {
+        'documents': stats.get('count', 0),
+        'data_bytes': stats.get('size', 0),
+        'storage_bytes': stats.get('storageSize', 0),
+        'index_bytes': stats.get('totalIndexSize', 0),
+    }
+
+
+def storage_report():
+    """
+    Legacy and compact collection sizes, per document and in total, with
+    the compact format's saving per document for each figure.
+    """
+    report = {}
+    for label, name in (('legacy', LEGACY_COLLECTION), ('compact', CompactActivity._meta.db_table)):
+        stats = collection_stats(name)
+        if stats is not None:
+            documents = stats['documents']
+            stats['per_document'] = {
+                key: stats[key] / documents if documents else 0.0
+                for key in ('data_bytes', 'storage_bytes', 'index_bytes')
+            }
+        report[label] = stats
+    legacy, compact = report['legacy'], report['compact']
+    if legacy and compact and legacy['documents'] and compact['documents']:
+        report['saving'] = {
+            key: 1 - compact['per_document'][key] / legacy['per_document'][key]
+            if legacy['per_document'][key] else 0.0
+            for key in ('data_bytes', 'storage_bytes', 'index_bytes')
+        }
+    return report
+
+
+def drop_legacy():
+    """Drop the legacy collection once the migration has finished and the API reads the compact one."""
+    state = migration_state()
+    if state['finished_at'] is None:
+        raise ValueError('The migration has not finished; run it to completion first.')
+    if not settings.OCTOFIT_COMPACT_ACTIVITIES:
+        raise ValueError('Activities are still read from the legacy collection; turn on OCTOFIT_COMPACT_ACTIVITIES first.')
+    database().drop_collection(LEGACY_COLLECTION)
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .fields import EncodedField
+from .ingest import apply_activity_changes
+from .models import User, Team, Activity, Leaderboard, Workout, ActivityRollup, LeaderboardWindow, Job
 
 
 @admin.register(User)
@@ -31,6 +33,29 @@ class ActivityAdmin(admin.ModelAdmin):
     ordering = ('-date',)
     readonly_fields = ('date',)
 
+    def get_search_fields(self, request):
+        """Search compactly stored fields by exact value; their stored form has no substrings to match."""
+        return tuple(
+            f'{name}__exact' if isinstance(self.model._meta.get_field(name), EncodedField) else name
+            for name in self.search_fields
+        )
+
+    # Admin writes update the leaderboard, rollups and windows like API writes do
+
+    def save_model(self, request, obj, form, change):
+        previous = self.model.objects.get(pk=obj.pk) if change else None
+        super().save_model(request, obj, form, change)
+        apply_activity_changes(added=[obj], removed=[previous] if previous is not None else [])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        apply_activity_changes(removed=[obj])
+
+    def delete_queryset(self, request, queryset):
+        removed = list(queryset)
+        super().delete_queryset(request, queryset)
+        apply_activity_changes(removed=removed)
+
 
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
@@ -41,6 +66,15 @@ class LeaderboardAdmin(admin.ModelAdmin):
     ordering = ('rank',)
 
 
+@admin.register(LeaderboardWindow)
+class LeaderboardWindowAdmin(admin.ModelAdmin):
+    """Admin interface for LeaderboardWindow model"""
+    list_display = ('window', 'rank', 'user_name', 'team', 'total_calories', 'total_activities')
+    list_filter = ('window',)
+    search_fields = ('user_name', 'team', 'user_id')
+    ordering = ('window', 'rank')
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     """Admin interface for Workout model"""
@@ -48,3 +82,21 @@ class WorkoutAdmin(admin.ModelAdmin):
     list_filter = ('difficulty', 'category')
     search_fields = ('name', 'description', 'category', 'recommended_for')
     ordering = ('name',)
+
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    """Admin interface for ActivityRollup model"""
+    list_display = ('scope', 'key', 'period', 'bucket', 'calories_burned', 'duration', 'activities')
+    list_filter = ('scope', 'period')
+    search_fields = ('key',)
+    ordering = ('-bucket',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin interface for Job model"""
+    list_display = ('name', 'status', 'triggers', 'attempts', 'created_at', 'finished_at', 'worker')
+    list_filter = ('status', 'name')
+    search_fields = ('key', 'error')
+    ordering = ('-created_at',)
@@ -0,0 +1,40 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from pymongo import monitoring
+        from . import checks  # noqa: F401 - registers the system checks
+        from .activity_migration import mirror
+        from .cache import CACHED_MODELS, bump_version
+        from .metrics import MongoCommandListener, install_djongo_wrapper
+        from .models import LegacyActivity
+        from .objectcache import MODELS, evict
+
+        # Registered before djongo opens its MongoClient, which picks it up
+        monitoring.register(MongoCommandListener())
+        connection_created.connect(install_djongo_wrapper, weak=False)
+
+        def invalidate(sender, **kwargs):
+            bump_version(sender)
+
+        # Only models behind cached responses; job and bookkeeping saves must not flush them
+        for model in CACHED_MODELS:
+            post_save.connect(invalidate, sender=model, weak=False)
+            post_delete.connect(invalidate, sender=model, weak=False)
+        for model in MODELS:
+            post_save.connect(evict, sender=model, weak=False)
+            post_delete.connect(evict, sender=model, weak=False)
+
+        def mirror_save(sender, instance, **kwargs):
+            mirror(instances=[instance])
+
+        def mirror_delete(sender, instance, **kwargs):
+            mirror(deleted=[instance])
+
+        post_save.connect(mirror_save, sender=LegacyActivity, weak=False)
+        post_delete.connect(mirror_delete, sender=LegacyActivity, weak=False)
@@ -0,0 +1,56 @@
+"""
+Async read endpoints for the leaderboard, activities and workouts.
+
+``/api/async/<resource>/`` and ``/api/async/<resource>/<id>/`` answer exactly
+like the synchronous list and retrieve endpoints (pagination, ``?window=``,
+response caching and conditional requests included), from async views.
+
+The blocking part of a request, the viewset's Mongo reads and rendering,
+runs on a bounded thread pool; while it waits, the request holds no thread,
+so one ASGI process keeps hundreds of requests in flight. The pool also
+bounds Mongo connections: djongo opens a MongoClient per thread, and sync
+views under ASGI would get a fresh thread, and client, per request.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executor = None
+
+
+def get_executor():
+    """The shared read pool, sized by ``OCTOFIT_ASYNC_READ_THREADS``."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.OCTOFIT_ASYNC_READ_THREADS, thread_name_prefix='octofit-read'
+        )
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Await ``func`` on the read pool, in the caller's context."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def async_read_view(viewset, action):
+    """Serve ``viewset``'s ``action`` for GET/HEAD as an async view."""
+    view = viewset.as_view({'get': action})
+
+    def respond(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+
+    async def async_view(request, *args, **kwargs):
+        return await run_blocking(respond, request, *args, **kwargs)
+
+    async_view.__name__ = f'{viewset.__name__}_{action}'
+    async_view.csrf_exempt = True
+    return async_view
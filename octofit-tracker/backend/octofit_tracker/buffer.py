@@ -0,0 +1,222 @@
+"""
+Write coalescing for single-activity POSTs.
+
+With ``OCTOFIT_INGEST_BUFFERED`` on, ``ActivityViewSet.create`` validates
+the activity and hands it to the process's ``ActivityBuffer``, which
+builds its document (stamping its id and date) and queues it instead of
+inserting it; the view answers 202 Accepted. A
+daemon thread writes the buffer with ``insert_activities`` once
+``OCTOFIT_INGEST_BATCH_SIZE`` activities are waiting or the oldest has
+waited ``OCTOFIT_INGEST_FLUSH_MS``, so a burst of POSTs costs one
+``insert_many`` and one leaderboard/rollup update per batch.
+
+The buffer holds at most ``OCTOFIT_INGEST_MAX_PENDING`` activities; a POST
+that finds it full waits up to ``OCTOFIT_INGEST_BLOCK_SECONDS`` for room and
+is then refused with 429 and ``Retry-After``. Whatever is still buffered is
+written when the process exits normally (including on SIGTERM from
+gunicorn or uvicorn); a killed process loses it, which is the trade-off
+the 202 announces.
+
+A batch whose insert fails goes back to the front of the buffer and is
+retried after ``OCTOFIT_INGEST_RETRY_SECONDS``, doubling up to
+``OCTOFIT_INGEST_RETRY_MAX_SECONDS``; meanwhile the buffer fills and
+POSTs get backpressure. If the database is still unreachable
+``OCTOFIT_INGEST_EXIT_RETRY_SECONDS`` into the exit flush, the remaining
+activities are spilled as Extended JSON lines to a file in
+``OCTOFIT_INGEST_SPILL_DIR``; load it with ``mongoimport`` and rebuild the
+leaderboard and rollups. A failure updating the aggregates after the
+insert queues those rebuilds instead.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from bson import json_util
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+from .ingest import apply_activity_changes, to_document, write_documents
+from .jobs import enqueue
+from .models import Activity
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Throttled):
+    default_detail = 'Activity ingestion is saturated.'
+    default_code = 'buffer_full'
+
+
+class ActivityBuffer:
+    """A bounded queue of validated activities, written in batches by a daemon thread."""
+
+    def __init__(self):
+        self.pending = []  # (enqueued at, activity, document, failed attempts)
+        self.failures = 0  # consecutive failed writes
+        self.retry_at = 0  # monotonic time before which no write is attempted
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)  # signalled when a write may be due
+        self.room = threading.Condition(self.lock)  # signalled when a batch leaves
+        self.write_lock = threading.Lock()
+        self.thread = None
+
+    def add(self, activity):
+        """Queue ``activity``, waiting for room; raise ``BufferFull`` on timeout."""
+        document = to_document(activity)
+        deadline = time.monotonic() + settings.OCTOFIT_INGEST_BLOCK_SECONDS
+        with self.lock:
+            while len(self.pending) >= settings.OCTOFIT_INGEST_MAX_PENDING:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFull(wait=1)
+                self.room.wait(remaining)
+            self.pending.append((time.monotonic(), activity, document, 0))
+            if len(self.pending) == 1 or len(self.pending) >= settings.OCTOFIT_INGEST_BATCH_SIZE:
+                self.ready.notify()
+        self.start()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                atexit.register(self.flush)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.loop, name='octofit-ingest', daemon=True)
+                self.thread.start()
+
+    def wait_time(self):
+        """Seconds until the buffer is due for a write: 0 if now, None if empty."""
+        if not self.pending:
+            return None
+        if self.retry_at > time.monotonic():
+            return self.retry_at - time.monotonic()
+        if len(self.pending) >= settings.OCTOFIT_INGEST_BATCH_SIZE:
+            return 0
+        due = self.pending[0][0] + settings.OCTOFIT_INGEST_FLUSH_MS / 1000
+        return max(due - time.monotonic(), 0)
+
+    def take(self):
+        """Remove and return the next batch; call with the lock held."""
+        size = settings.OCTOFIT_INGEST_BATCH_SIZE
+        batch = self.pending[:size]
+        del self.pending[:size]
+        self.room.notify_all()
+        return batch
+
+    def loop(self):
+        while True:
+            with self.lock:
+                wait = self.wait_time()
+                while wait != 0:
+                    self.ready.wait(wait)
+                    wait = self.wait_time()
+                batch = self.take()
+            self.write(batch)
+
+    def take_all(self):
+        """Remove and return everything buffered; call with the lock held."""
+        batch, self.pending = self.pending, []
+        self.room.notify_all()
+        return batch
+
+    def requeue(self, batch):
+        """Put a batch whose write failed back in front and back off."""
+        with self.lock:
+            self.pending[:0] = [(queued, activity, document, attempts + 1)
+                                for queued, activity, document, attempts in batch]
+            self.failures += 1
+            self.retry_at = time.monotonic() + self.backoff()
+
+    def backoff(self):
+        return min(settings.OCTOFIT_INGEST_RETRY_SECONDS * 2 ** (self.failures - 1),
+                   settings.OCTOFIT_INGEST_RETRY_MAX_SECONDS)
+
+    def write(self, batch):
+        """Write a batch; return the count written, or None if it was requeued."""
+        activities = [activity for _, activity, _, _ in batch]
+        with self.write_lock:
+            try:
+                inserted, failures = write_documents(
+                    activities, [document for _, _, document, _ in batch],
+                    retried=any(attempts for _, _, _, attempts in batch),
+                )
+            except Exception:
+                logger.exception('Could not write %d buffered activities; will retry', len(batch))
+                self.requeue(batch)
+                return None
+            with self.lock:
+                self.failures = 0
+                self.retry_at = 0
+            try:
+                apply_activity_changes(added=inserted)
+            except Exception:
+                logger.exception('Could not update aggregates for %d buffered activities', len(inserted))
+                self.schedule_repair()
+        for position, message in failures.items():
+            logger.error('Buffered activity %s rejected: %s', activities[position]._id, message)
+        return len(inserted)
+
+    def schedule_repair(self):
+        for name in ('rebuild_leaderboard', 'rebuild_rollups'):
+            try:
+                enqueue(name)
+            except Exception:
+                logger.exception('Could not enqueue %s', name)
+
+    def spill(self, batch):
+        """Save activities that could not be written to a file; return its path."""
+        directory = Path(settings.OCTOFIT_INGEST_SPILL_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{Activity._meta.db_table}-{os.getpid()}-{time.time_ns()}.json'
+        with open(path, 'w') as spill:
+            for _, _, document, _ in batch:
+                spill.write(json_util.dumps(document, json_options=json_util.CANONICAL_JSON_OPTIONS) + '\n')
+            spill.flush()
+            os.fsync(spill.fileno())
+        logger.critical('Spilled %d unwritten activities to %s', len(batch), path)
+        return path
+
+    def flush(self):
+        """
+        Write everything buffered now, in this thread, retrying failed
+        batches; return the count written. Whatever is still unwritten after
+        ``OCTOFIT_INGEST_EXIT_RETRY_SECONDS`` is spilled to a file.
+        """
+        deadline = time.monotonic() + settings.OCTOFIT_INGEST_EXIT_RETRY_SECONDS
+        written = 0
+        while True:
+            with self.lock:
+                batch = self.take()
+            if not batch:
+                # Let a batch the flusher thread already took finish first
+                with self.write_lock:
+                    pass
+                with self.lock:
+                    if not self.pending:
+                        return written
+                continue
+            count = self.write(batch)
+            if count is not None:
+                written += count
+                continue
+            if time.monotonic() >= deadline:
+                with self.lock:
+                    self.spill(self.take_all())
+                    self.failures = 0
+                    self.retry_at = 0
+                return written
+            time.sleep(self.backoff())
+
+
+_buffer = ActivityBuffer()
+
+
+def get_buffer():
+    """This process's activity buffer."""
+    return _buffer
@@ -0,0 +1,139 @@
+"""
+Response caching for read-heavy endpoints.
+
+Each cached model has a version stamp in the ``cache_versions`` collection,
+so every process sees the same one whatever Django cache backend holds the
+responses. Every write through the ORM (API or admin) or the native Mongo
+write paths calls ``bump_version``, which makes all cached responses built
+from the previous version unreachable. The stamp's write time, taken from
+the Mongo server's clock, doubles as ``Last-Modified``, and an ETag of the
+rendered body lets clients revalidate with a 304.
+
+Reads take the stamps from the Django cache first, so a cache hit costs no
+database round trip. ``bump_version`` stores the new stamp there as it
+writes it; with a per-process backend other processes see it once their
+copy expires, after ``OCTOFIT_CACHE_VERSION_TIMEOUT`` seconds.
+
+Only non-HTML responses are cached: the browsable API page embeds the
+signed-in user and a CSRF token.
+"""
+import calendar
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from pymongo import ReturnDocument
+
+from .documents import database
+from .models import User, Team, Leaderboard, Workout, ActivityRollup
+
+VERSION_COLLECTION = 'cache_versions'
+RESPONSE_KEY = 'octofit:response:{}:{}'
+VERSION_KEY = 'octofit:version:{}'
+# Every model a CachedResponseMixin viewset's cache_models lists; ORM writes to these bump
+CACHED_MODELS = (User, Team, Leaderboard, Workout, ActivityRollup)
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _stamp(document):
+    return document['version'], calendar.timegm(document['modified'].utctimetuple())
+
+
+def bump_version(model):
+    """Invalidate every cached response that depends on ``model``."""
+    label = _label(model)
+    document = database()[VERSION_COLLECTION].find_one_and_update(
+        {'_id': label},
+        {'$inc': {'version': 1}, '$currentDate': {'modified': True}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    cache.set(VERSION_KEY.format(label), _stamp(document), settings.OCTOFIT_CACHE_VERSION_TIMEOUT)
+
+
+def get_versions(models):
+    """
+    Return ``(version, modified)`` for each of ``models``, in order: a write
+    counter and the last write's time as a Unix timestamp. Stamps missing
+    from the Django cache are read with one query. Models never written
+    start at version 0.
+    """
+    labels = [_label(model) for model in models]
+    keys = {label: VERSION_KEY.format(label) for label in labels}
+    cached = cache.get_many(keys.values())
+    stamps = {label: cached[key] for label, key in keys.items() if key in cached}
+    missing = [label for label in labels if label not in stamps]
+    if missing:
+        versions = database()[VERSION_COLLECTION]
+        found = {document['_id']: document for document in versions.find({'_id': {'$in': missing}})}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for label in missing:
+            if label not in found:
+                found[label] = versions.find_one_and_update(
+                    {'_id': label}, {'$setOnInsert': {'version': 0, 'modified': now}},
+                    upsert=True, return_document=ReturnDocument.AFTER,
+                )
+            stamps[label] = _stamp(found[label])
+            # add, not set: a bump_version since our read has already stored a newer stamp
+            cache.add(keys[label], stamps[label], settings.OCTOFIT_CACHE_VERSION_TIMEOUT)
+    return [stamps[label] for label in labels]
+
+
+def get_version(model):
+    """Return the model's current ``(version, modified)`` stamp."""
+    return get_versions([model])[0]
+
+
+class CachedResponseMixin:
+    """
+    Serve ``GET``/``HEAD`` responses of a viewset from the cache.
+
+    ``cache_models`` lists the models whose writes invalidate the cached
+    responses; it defaults to the viewset queryset's model.
+    """
+    cache_models = None
+
+    def get_cache_models(self):
+        return self.cache_models or (self.queryset.model,)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        versions = get_versions(self.get_cache_models())
+        last_modified = max(modified for _, modified in versions)
+        variant = hashlib.md5(
+            f'{versions}|{request.get_full_path()}|{request.META.get("HTTP_ACCEPT", "")}'.encode()
+        ).hexdigest()
+        key = RESPONSE_KEY.format(self.basename, variant)
+
+        entry = cache.get(key)
+        if entry is None:
+            response = super().dispatch(request, *args, **kwargs)
+            media_type = getattr(response, 'accepted_media_type', '') or ''
+            if response.status_code != 200 or media_type.startswith('text/html'):
+                return response
+            response.render()
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': '"{}"'.format(hashlib.md5(response.content).hexdigest()),
+            }
+            cache.set(key, entry, settings.OCTOFIT_RESPONSE_CACHE_TIMEOUT)
+
+        response = get_conditional_response(
+            request, etag=entry['etag'], last_modified=last_modified
+        )
+        if response is None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept',))
+        return response
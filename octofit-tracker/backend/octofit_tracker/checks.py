@@ -0,0 +1,30 @@
+"""
+System checks.
+
+The aggregations behind the leaderboards, windows, team aggregates and
+profile summaries use ``$setWindowFields``, ``$documentNumber``,
+``$unionWith`` and ``$merge`` into the same database, which need MongoDB
+5.0 or later. Tagged ``database``, the check runs on ``migrate`` and
+``check --database default``, not on every command.
+"""
+from django.core.checks import Error, Tags, register
+from django.db import connections
+
+MIN_MONGODB_VERSION = (5, 0)
+
+
+@register(Tags.database)
+def check_mongodb_version(app_configs, databases=None, **kwargs):
+    errors = []
+    for alias in databases or ():
+        connection = connections[alias]
+        if connection.vendor != 'djongo':
+            continue
+        version = connection.cursor().db_conn.client.server_info()['versionArray']
+        if tuple(version[:2]) < MIN_MONGODB_VERSION:
+            errors.append(Error(
+                f'MongoDB {".".join(map(str, version[:3]))} is too old for database "{alias}".',
+                hint=f'OctoFit needs MongoDB {".".join(map(str, MIN_MONGODB_VERSION))} or later.',
+                id='octofit_tracker.E001',
+            ))
+    return errors
@@ -0,0 +1,164 @@
+"""
+Native pymongo read path.
+
+``DocumentQuery`` issues ``find()`` calls with a projection and sort instead
+of going through djongo's SQL translation, and yields raw documents. It
+implements the slice of the QuerySet API that DRF's paginators use
+(``filter``, ``order_by``, ``count`` and slicing), so the existing pagination
+classes work on it unchanged.
+"""
+import datetime
+
+from bson.errors import InvalidId
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import Http404
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .fields import EncodedField
+
+LOOKUP_OPERATORS = {
+    'lt': '$lt',
+    'lte': '$lte',
+    'gt': '$gt',
+    'gte': '$gte',
+    'in': '$in',
+}
+
+
+def database(using=DEFAULT_DB_ALIAS):
+    """The pymongo database djongo is connected to."""
+    return connections[using].cursor().db_conn
+
+
+class DocumentQuery:
+    """A lazy, chainable ``find()`` on a model's collection."""
+
+    def __init__(self, model, conditions=(), projection=None, sort=None):
+        self.model = model
+        self.conditions = list(conditions)
+        self.projection = projection
+        self.sort = list(sort if sort is not None else self._field_sort(model._meta.ordering))
+
+    def _clone(self, **changes):
+        params = {
+            'conditions': self.conditions,
+            'projection': self.projection,
+            'sort': self.sort,
+        }
+        params.update(changes)
+        return type(self)(self.model, **params)
+
+    def _field_sort(self, names):
+        sort = []
+        for name in names:
+            descending = name.startswith('-')
+            sort.append((self.model._meta.get_field(name.lstrip('-')).column, -1 if descending else 1))
+        return sort
+
+    def _to_db(self, field, value):
+        if isinstance(value, (list, tuple)):
+            return [self._to_db(field, item) for item in value]
+        value = field.to_python(value)
+        if isinstance(field, EncodedField):
+            return field.encode(value)
+        if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+            value = timezone.make_naive(value, datetime.timezone.utc)
+        return value
+
+    @property
+    def filter_document(self):
+        if not self.conditions:
+            return {}
+        if len(self.conditions) == 1:
+            return self.conditions[0]
+        return {'$and': self.conditions}
+
+    @property
+    def ordered(self):
+        return bool(self.sort)
+
+    def filter(self, **lookups):
+        conditions = list(self.conditions)
+        for lookup, value in lookups.items():
+            name, _, operator = lookup.partition('__')
+            field = self.model._meta.pk if name == 'pk' else self.model._meta.get_field(name)
+            value = self._to_db(field, value)
+            if operator:
+                value = {LOOKUP_OPERATORS[operator]: value}
+            conditions.append({field.column: value})
+        return self._clone(conditions=conditions)
+
+    def order_by(self, *names):
+        return self._clone(sort=self._field_sort(names))
+
+    def count(self):
+        return self.model.objects.mongo_count_documents(self.filter_document)
+
+    def get(self, **lookups):
+        for document in self.filter(**lookups)._find(limit=1):
+            return document
+        raise self.model.DoesNotExist()
+
+    def _find(self, skip=0, limit=0):
+        projection = self.projection
+        if projection is not None:
+            # Keyset paginators read the sort keys back from each document
+            projection = dict(projection, **{column: 1 for column, _ in self.sort})
+        return self.model.objects.mongo_find(
+            self.filter_document, projection,
+            sort=self.sort or None, skip=skip, limit=limit,
+        )
+
+    def __iter__(self):
+        return iter(self._find())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = key.start or 0
+            if key.stop is None:
+                return list(self._find(skip=start))
+            if key.stop <= start:
+                return []
+            return list(self._find(skip=start, limit=key.stop - start))
+        for item in self._find(skip=key, limit=1):
+            return item
+        raise IndexError(key)
+
+
+class DocumentReadMixin:
+    """
+    Serve ``list`` and ``retrieve`` from raw documents.
+
+    ``document_serializer_class`` renders a document in the same shape as
+    the viewset's model serializer. Writes still go through the ORM.
+    """
+    document_serializer_class = None
+
+    def get_document_serializer_class(self):
+        return self.document_serializer_class
+
+    def get_document_query(self):
+        serializer_class = self.get_document_serializer_class()
+        return DocumentQuery(self.queryset.model, projection=serializer_class.projection())
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.get_document_serializer_class()
+        query = self.get_document_query()
+        page = self.paginate_queryset(query)
+        if page is not None:
+            serializer = serializer_class(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = serializer_class(query, many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            document = self.get_document_query().get(pk=self.kwargs[lookup_url_kwarg])
+        except (self.queryset.model.DoesNotExist, InvalidId, TypeError):
+            raise Http404
+        return Response(self.get_document_serializer_class()(document).data)
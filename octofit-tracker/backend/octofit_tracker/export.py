@@ -0,0 +1,71 @@
+"""
+Streaming activity export.
+
+Rows are read from a server-side Mongo cursor and rendered one at a time,
+so memory stays flat however many activities are exported. The API action
+and the ``export_activities`` command share these generators.
+"""
+import csv
+
+from django.core.exceptions import ValidationError
+
+from .documents import DocumentQuery
+from .models import Activity
+from .renderers import FastJSONRenderer
+from .serializers import ActivityDocumentSerializer
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def export_query(user_id=None, date_from=None, date_to=None):
+    """
+    Activities to export, oldest first. ``date_from`` is inclusive and
+    ``date_to`` exclusive; both accept ISO 8601 dates or datetimes.
+    """
+    query = DocumentQuery(Activity, projection=ActivityDocumentSerializer.projection())
+    lookups = {}
+    if user_id:
+        lookups['user_id'] = user_id
+    if date_from:
+        lookups['date__gte'] = date_from
+    if date_to:
+        lookups['date__lt'] = date_to
+    try:
+        query = query.filter(**lookups)
+    except ValidationError as exc:
+        raise ValueError(' '.join(exc.messages))
+    return query.order_by('date', '_id')
+
+
+def iter_ndjson(documents):
+    serializer = ActivityDocumentSerializer()
+    renderer = FastJSONRenderer()
+    for document in documents:
+        yield renderer.render(serializer.to_representation(document)) + b'\n'
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(documents):
+    serializer = ActivityDocumentSerializer()
+    columns = [name for name, _, _ in serializer.field_plan()]
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns).encode()
+    for document in documents:
+        row = serializer.to_representation(document)
+        yield writer.writerow(['' if row[c] is None else row[c] for c in columns]).encode()
+
+
+def iter_export(output, documents):
+    if output == 'csv':
+        return iter_csv(documents)
+    return iter_ndjson(documents)
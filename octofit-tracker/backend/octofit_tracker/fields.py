@@ -0,0 +1,149 @@
+"""
+Model fields with a compact storage encoding.
+
+Each keeps the Python (and API) value of the field it extends but stores a
+smaller BSON value: an ObjectId instead of its 24-character hex string, an
+integer code instead of a known string, an integer instead of a fixed-point
+float. The ORM converts through ``get_prep_value``/``from_db_value``; code
+that reads or writes raw documents goes through ``encode``/``decode``, and
+aggregations through ``decoded``.
+"""
+from bson import ObjectId
+from django.core.exceptions import ValidationError
+from django.utils.deconstruct import deconstructible
+from djongo import models
+
+
+class EncodedField:
+    """
+    Mixin for fields whose stored value differs from the Python value.
+    Subclasses override ``decode`` and ``decode_expression``; the defaults
+    pass values through unchanged.
+    """
+
+    def encode(self, value):
+        return value if value is None else self.get_prep_value(value)
+
+    def decode(self, value):
+        return value
+
+    def decode_expression(self, path):
+        """Aggregation expression turning the stored value at ``path`` into the Python value."""
+        return path
+
+    def from_db_value(self, value, expression, connection):
+        return self.decode(value)
+
+
+class ObjectIdReferenceField(EncodedField, models.CharField):
+    """A string id, stored as an ObjectId when it is the hex form of one."""
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if isinstance(value, str) and ObjectId.is_valid(value) and value == value.lower():
+            return ObjectId(value)
+        return value
+
+    def decode(self, value):
+        return value if value is None else str(value)
+
+    def to_python(self, value):
+        return self.decode(value) if isinstance(value, ObjectId) else super().to_python(value)
+
+    def decode_expression(self, path):
+        return {'$toString': path}
+
+
+class CodedCharField(EncodedField, models.CharField):
+    """
+    A string stored as its index in ``codes`` when it is one of them, as
+    itself otherwise. ``codes`` may only ever be appended to.
+    """
+
+    def __init__(self, *args, codes=(), **kwargs):
+        self.codes = tuple(codes)
+        self.code_of = {value: code for code, value in enumerate(self.codes)}
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['codes'] = self.codes
+        return name, path, args, kwargs
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return self.code_of.get(value, value)
+
+    def decode(self, value):
+        if not isinstance(value, int):
+            return value
+        if not 0 <= value < len(self.codes):
+            raise ValueError(f'Unknown {self.name} code {value}; codes may only be appended to')
+        return self.codes[value]
+
+    def to_python(self, value):
+        return self.decode(value) if isinstance(value, int) else super().to_python(value)
+
+    def decode_expression(self, path):
+        return {'$cond': [{'$isNumber': path}, {'$arrayElemAt': [list(self.codes), path]}, path]}
+
+
+@deconstructible
+class FixedPointValidator:
+    """Reject floats finer than ``1 / scale``, which a ``FixedPointField`` would round."""
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def __call__(self, value):
+        if value is not None and round(value * self.scale) / self.scale != value:
+            raise ValidationError(
+                f'Ensure this value has no more precision than {1 / self.scale:g}.', code='precision',
+            )
+
+    def __eq__(self, other):
+        return isinstance(other, FixedPointValidator) and other.scale == self.scale
+
+
+class FixedPointField(EncodedField, models.FloatField):
+    """
+    A float stored as an integer count of ``1 / scale`` units. Values are
+    validated to that precision, since storing rounds anything finer.
+    """
+
+    def __init__(self, *args, scale=1000, **kwargs):
+        self.scale = scale
+        super().__init__(*args, **kwargs)
+        if FixedPointValidator(scale) not in self._validators:  # deconstruct() passes it back in
+            self._validators.append(FixedPointValidator(scale))
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['scale'] = self.scale
+        return name, path, args, kwargs
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return value if value is None else round(value * self.scale)
+
+    def decode(self, value):
+        return value if value is None else value / self.scale
+
+    def decode_expression(self, path):
+        return {'$divide': [path, self.scale]}
+
+
+def decoded(model, name):
+    """Aggregation expression for the Python value of ``model``'s field ``name``."""
+    field = model._meta.get_field(name)
+    path = '$' + field.column
+    return field.decode_expression(path) if isinstance(field, EncodedField) else path
+
+
+def encode_document(model, values):
+    """Map ``values`` by field name to the document ``model`` stores."""
+    document = {}
+    for name, value in values.items():
+        field = model._meta.get_field(name)
+        document[field.column] = field.encode(value) if isinstance(field, EncodedField) else value
+    return document
@@ -0,0 +1,57 @@
+"""
+Activity list filters.
+
+Query parameters become ``DocumentQuery`` lookups shaped for the compound
+indexes on ``activities``, all of which end in the feed order ``(date,
+_id)``: ``user_id`` and ``activity_type`` are equality prefixes of
+``activities_user_date`` and ``activities_type_date``, and ``date_from`` and
+``date_to`` bound their ``date`` key (or ``activities_feed`` alone). Every
+combination is therefore an index scan already in page order.
+
+Duration and calorie bounds need ``user_id``: ``activities_user_date``
+carries ``activity_type``, ``duration`` and ``calories_burned`` after its
+sort keys, so they are checked on the index entries and only matching
+documents are fetched. Without a user they would filter the whole feed.
+"""
+from rest_framework.exceptions import ValidationError
+
+EXACT_FILTERS = ('user_id', 'activity_type')
+RANGE_FILTERS = {
+    'date_from': 'date__gte',
+    'date_to': 'date__lt',
+    'min_duration': 'duration__gte',
+    'max_duration': 'duration__lte',
+    'min_calories': 'calories_burned__gte',
+    'max_calories': 'calories_burned__lte',
+}
+# Only bounded per user; see the module docstring
+USER_RANGE_LOOKUPS = ('duration__gte', 'duration__lte', 'calories_burned__gte', 'calories_burned__lte')
+
+
+def activity_lookups(params):
+    """
+    Map query ``params`` to lookups. ``date_from`` is inclusive and
+    ``date_to`` exclusive; duration and calorie bounds are inclusive
+    integers and need ``user_id``.
+    """
+    lookups = {}
+    errors = {}
+    for param in EXACT_FILTERS:
+        if params.get(param):
+            lookups[param] = params[param]
+    for param, lookup in RANGE_FILTERS.items():
+        value = params.get(param)
+        if not value:
+            continue
+        if not param.startswith('date'):
+            try:
+                value = int(value)
+            except ValueError:
+                errors[param] = ['A valid integer is required.']
+                continue
+        lookups[lookup] = value
+    if 'user_id' not in lookups and any(lookup in lookups for lookup in USER_RANGE_LOOKUPS):
+        errors['user_id'] = ['Required with duration and calorie ranges.']
+    if errors:
+        raise ValidationError(errors)
+    return lookups
@@ -0,0 +1,95 @@
+"""
+Activity ingestion and derived aggregates.
+
+``insert_activities`` writes many activities with one ``insert_many`` round
+trip instead of one djongo-translated INSERT each. ``apply_activity_changes``
+folds added and removed activities into one leaderboard delta per user and
+one rollup upsert per bucket; every activity write path (API, bulk and
+buffered ingestion, ``ActivityAdmin``) goes through it.
+"""
+from collections import defaultdict
+
+from bson import ObjectId
+from django.db import connections
+from pymongo.errors import BulkWriteError
+
+from .activity_migration import mirror
+from .leaderboard import apply_activity_delta
+from .models import Activity
+from .rollups import apply_rollup_deltas
+from .windows import invalidate_windows
+
+DUPLICATE_KEY = 11000
+
+
+def to_document(instance):
+    """Build the Mongo document djongo would store for ``instance``."""
+    connection = connections[Activity.objects.db]
+    if instance._id is None:
+        instance._id = ObjectId()
+    document = {}
+    for field in Activity._meta.concrete_fields:
+        value = field.pre_save(instance, True)
+        document[field.column] = field.get_db_prep_save(value, connection)
+    return document
+
+
+def write_documents(instances, documents=None, retried=False):
+    """
+    Insert ``instances`` in one unordered ``insert_many``, without touching
+    the aggregates. ``documents`` are their ``to_document`` results, if
+    already built. When ``retried``, a duplicate key means an earlier,
+    failed attempt already wrote that document (its ``_id`` was assigned
+    up front), so it counts as inserted.
+
+    Returns ``(inserted, failures)`` where ``failures`` maps the position of
+    each rejected instance to the server's error message.
+    """
+    if documents is None:
+        documents = [to_document(instance) for instance in instances]
+    failures = {}
+    try:
+        Activity.objects.mongo_insert_many(documents, ordered=False)
+    except BulkWriteError as exc:
+        for error in exc.details.get('writeErrors', []):
+            if not (retried and error.get('code') == DUPLICATE_KEY):
+                failures[error['index']] = error.get('errmsg', 'Write failed')
+    inserted = [
+        instance for index, instance in enumerate(instances) if index not in failures
+    ]
+    mirror(instances=inserted)
+    return inserted, failures
+
+
+def insert_activities(instances, documents=None):
+    """
+    Insert ``instances`` with ``write_documents`` and update the leaderboard
+    and rollups for those that were written.
+
+    Returns ``(inserted, failures)`` as ``write_documents`` does.
+    """
+    if not instances:
+        return [], {}
+    inserted, failures = write_documents(instances, documents)
+    apply_activity_changes(added=inserted)
+    return inserted, failures
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Update the leaderboard and rollups for added and removed activities."""
+    changes = [(activity, -1) for activity in removed] + [(activity, 1) for activity in added]
+    apply_leaderboard_deltas(changes)
+    apply_rollup_deltas(changes)
+    invalidate_windows(activity.date for activity, _ in changes)
+
+
+def apply_leaderboard_deltas(changes):
+    """Fold ``(activity, sign)`` pairs into one leaderboard update per user."""
+    totals = defaultdict(lambda: [None, 0, 0])
+    for activity, sign in changes:
+        entry = totals[activity.user_id]
+        entry[0] = activity.user_name
+        entry[1] += sign * activity.calories_burned
+        entry[2] += sign
+    for user_id, (user_name, calories, count) in totals.items():
+        apply_activity_delta(user_id, user_name, calories, count)
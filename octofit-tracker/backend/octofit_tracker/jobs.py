@@ -0,0 +1,237 @@
+"""
+Background jobs with a persistent queue in Mongo and no external broker.
+
+Jobs are documents in ``jobs``. ``enqueue`` coalesces: while a job with the
+same name and arguments is still pending, further triggers only bump its
+``triggers`` count, so a burst of writes schedules one run, due ``delay``
+seconds after the first trigger. A trigger that arrives while the job runs
+queues exactly one follow-up run.
+
+Runners claim due jobs with an atomic ``find_one_and_update``, so every
+process can run one (``JobRunner``, started on the first in-process
+``enqueue``) or a dedicated ``manage.py jobs --work`` process can take them
+all. Two enqueues racing on an empty key may both insert, so handlers must
+be idempotent. Jobs left running by a dead process are requeued after
+``OCTOFIT_JOB_TIMEOUT_SECONDS``.
+"""
+import datetime
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from .leaderboard import rebuild_leaderboard, rerank_leaderboard
+from .models import Job
+from .propagation import propagate_user
+from .rollups import rebuild_rollups, repair_team_rollups
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, SUCCEEDED, FAILED = 'pending', 'running', 'succeeded', 'failed'
+STATUSES = (PENDING, RUNNING, SUCCEEDED, FAILED)
+REQUEUE_INTERVAL = 60
+
+# name -> callable taking the job's args as keyword arguments
+HANDLERS = {
+    'rebuild_leaderboard': rebuild_leaderboard,
+    'rerank_leaderboard': rerank_leaderboard,
+    'rebuild_rollups': rebuild_rollups,
+    'repair_team_rollups': repair_team_rollups,
+    'propagate_user': propagate_user,
+}
+
+
+def register(name, handler):
+    """Make ``handler`` runnable as job ``name``."""
+    HANDLERS[name] = handler
+    return handler
+
+
+def utcnow():
+    """Now as the naive UTC datetime djongo stores, at Mongo's precision."""
+    moment = timezone.make_naive(timezone.now(), datetime.timezone.utc)
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+
+
+def job_key(name, args):
+    """Name plus canonical JSON of ``args``, so distinct arguments never share a key."""
+    return f'{name} {json.dumps(args, sort_keys=True, separators=(",", ":"))}'
+
+
+def check_args(name, args):
+    """Raise ``TypeError`` unless job ``name``'s handler accepts keyword ``args``."""
+    try:
+        inspect.signature(HANDLERS[name]).bind(**args)
+    except TypeError as exc:
+        raise TypeError(f'Invalid arguments for job {name}: {exc}')
+
+
+def enqueue(name, args=None, delay=None):
+    """
+    Schedule job ``name`` with keyword ``args``, or coalesce into its
+    pending run. Returns the pending job's document. Raises ``ValueError``
+    for an unknown job and ``TypeError`` for arguments its handler does
+    not take.
+    """
+    if name not in HANDLERS:
+        raise ValueError(f'Unknown job: {name}')
+    args = args or {}
+    check_args(name, args)
+    if delay is None:
+        delay = settings.OCTOFIT_JOB_DEBOUNCE_SECONDS
+    moment = utcnow()
+    key = job_key(name, args)
+    document = Job.objects.mongo_find_one_and_update(
+        {'key': key, 'status': PENDING},
+        {
+            '$inc': {'triggers': 1},
+            '$setOnInsert': {
+                'name': name,
+                'key': key,
+                'args': args,
+                'attempts': 0,
+                'run_after': moment + datetime.timedelta(seconds=delay),
+                'created_at': moment,
+                'started_at': None,
+                'finished_at': None,
+                'worker': '',
+                'result': None,
+                'error': '',
+            },
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if settings.OCTOFIT_JOBS_IN_PROCESS:
+        get_runner().start()
+    return document
+
+
+def claim(worker):
+    """Mark the oldest due pending job as running by ``worker`` and return it."""
+    moment = utcnow()
+    return Job.objects.mongo_find_one_and_update(
+        {'status': PENDING, 'run_after': {'$lte': moment}},
+        {'$set': {'status': RUNNING, 'started_at': moment, 'worker': worker}, '$inc': {'attempts': 1}},
+        sort=[('run_after', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def execute(document):
+    """
+    Run a claimed job and record its outcome. A failure is retried with
+    backoff unless a newer trigger already queued a run of the same key.
+    """
+    try:
+        handler = HANDLERS.get(document['name'])
+        if handler is None:
+            raise LookupError(f'No handler registered for job {document["name"]}')
+        result = handler(**document['args'])
+    except Exception:
+        logger.exception('Job %s failed', document['key'])
+        update = {'error': traceback.format_exc(), 'finished_at': utcnow()}
+        follow_up = Job.objects.mongo_find_one({'key': document['key'], 'status': PENDING}, {'_id': 1})
+        if document['attempts'] < settings.OCTOFIT_JOB_MAX_ATTEMPTS and follow_up is None:
+            retry_at = utcnow() + datetime.timedelta(seconds=30 * 2 ** (document['attempts'] - 1))
+            update.update(status=PENDING, run_after=retry_at)
+        else:
+            update['status'] = FAILED
+        Job.objects.mongo_update_one({'_id': document['_id']}, {'$set': update})
+        return False
+    Job.objects.mongo_update_one({'_id': document['_id']}, {'$set': {
+        'status': SUCCEEDED, 'result': result, 'error': '', 'finished_at': utcnow(),
+    }})
+    return True
+
+
+def requeue_stale(timeout=None):
+    """Return jobs stuck running for longer than ``timeout`` seconds to the queue."""
+    if timeout is None:
+        timeout = settings.OCTOFIT_JOB_TIMEOUT_SECONDS
+    moment = utcnow()
+    result = Job.objects.mongo_update_many(
+        {'status': RUNNING, 'started_at': {'$lt': moment - datetime.timedelta(seconds=timeout)}},
+        {'$set': {'status': PENDING, 'run_after': moment}},
+    )
+    return result.modified_count
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_pending(worker=None):
+    """Run every due job in this thread until none is left; return the count."""
+    worker = worker or worker_name()
+    count = 0
+    while True:
+        document = claim(worker)
+        if document is None:
+            return count
+        execute(document)
+        count += 1
+
+
+class JobRunner:
+    """Claims due jobs from a daemon thread and runs them on a thread pool."""
+
+    def __init__(self, workers, poll_interval):
+        self.worker = worker_name()
+        self.poll_interval = poll_interval
+        self.slots = threading.Semaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='octofit-job')
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.loop, name='octofit-job-runner', daemon=True)
+                self.thread.start()
+
+    def loop(self):
+        next_requeue = 0
+        while True:
+            self.slots.acquire()
+            try:
+                if time.monotonic() >= next_requeue:
+                    requeue_stale()
+                    next_requeue = time.monotonic() + REQUEUE_INTERVAL
+                document = claim(self.worker)
+            except Exception:
+                logger.exception('Could not claim a job')
+                document = None
+            if document is None:
+                self.slots.release()
+                time.sleep(self.poll_interval)
+                continue
+            self.executor.submit(self.run, document)
+
+    def run(self, document):
+        try:
+            execute(document)
+        finally:
+            self.slots.release()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """This process's runner, created on first use."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(settings.OCTOFIT_JOB_WORKERS, settings.OCTOFIT_JOB_POLL_SECONDS)
+        return _runner
@@ -0,0 +1,298 @@
+"""
+Leaderboard maintenance.
+
+Activity writes call ``apply_activity_delta`` so a user's totals are bumped
+with an atomic ``$inc`` and only the ranks crossed by the score change are
+shifted. ``rebuild_leaderboard`` recomputes the whole table server-side
+for scheduled or manual full refreshes.
+
+A re-rank is several writes, so concurrent ones would leave duplicate or
+skipped ranks; they are serialized across processes by a lease in
+``locks``. A write that cannot get the lease within
+``OCTOFIT_RANK_LOCK_WAIT_SECONDS`` only updates the totals and enqueues a
+``rerank_leaderboard`` job, which renumbers the entries under the lease and
+leaves the totals alone. A rebuild holds the lease
+for its whole run; writes that time out behind it leave even the totals to
+a follow-up rebuild.
+"""
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import objectcache
+from .cache import bump_version
+from .fields import decoded
+from .locks import held, lease
+from .models import User, Activity, Leaderboard
+from .serializers import LeaderboardDocumentSerializer
+
+RANK_LOCK = 'leaderboard:rank'
+RANK_LOCK_LEASE_SECONDS = 10  # a holder that died releases the lock after this
+REPAIR_DELAY_SECONDS = 5
+REBUILD_LOCK_WAIT_SECONDS = 60
+RERANK, REBUILD = 'rerank', 'rebuild'  # what the rank lock is held for
+
+
+def rank_lock(wait=None, purpose=RERANK, renew=False):
+    """
+    Hold the leaderboard re-ranking lease for ``purpose``, waiting up to
+    ``wait`` seconds (default ``OCTOFIT_RANK_LOCK_WAIT_SECONDS``) for it.
+    Yields whether it was acquired. With ``renew``, a thread renews the
+    lease while it is held, for whole-table runs that may outlast it; a
+    per-write re-rank is a few indexed commands and fits in one lease.
+    """
+    if wait is None:
+        wait = settings.OCTOFIT_RANK_LOCK_WAIT_SECONDS
+    return lease(RANK_LOCK, wait, purpose=purpose, renew=renew, seconds=RANK_LOCK_LEASE_SECONDS)
+
+
+def rebuilding():
+    """Whether a ``rebuild_leaderboard`` run holds the rank lock."""
+    return held(RANK_LOCK, purpose=REBUILD)
+
+
+def _user_details(user_id, fallback_name):
+    """Return the (name, team) to store on a new leaderboard entry."""
+    try:
+        user = objectcache.get(User, user_id)
+    except User.DoesNotExist:
+        return fallback_name, ''
+    return user.name or fallback_name, user.team or ''
+
+
+def _place_new_entry(entry_id, score):
+    """
+    Insert a freshly created entry into the ranking below equal scores.
+
+    Every entry with a lower score moves down one rank, so this costs one
+    write per such entry: O(N) at worst. New users start with a single
+    activity's calories and so usually land near the bottom, where few
+    entries are below them.
+    """
+    # Unplaced entries (rank 0, awaiting a re-rank) keep rank 0
+    Leaderboard.objects.mongo_update_many(
+        {'_id': {'$ne': entry_id}, 'rank': {'$gt': 0}, 'total_calories': {'$lt': score}},
+        {'$inc': {'rank': 1}},
+    )
+    above = Leaderboard.objects.mongo_find_one(
+        {'_id': {'$ne': entry_id}, 'rank': {'$gt': 0}, 'total_calories': {'$gte': score}},
+        {'rank': 1},
+        sort=[('rank', -1)],
+    )
+    rank = above['rank'] + 1 if above else 1
+    Leaderboard.objects.mongo_update_one({'_id': entry_id}, {'$set': {'rank': rank}})
+
+
+def _move_entry(entry_id, rank, old_score, new_score):
+    """Shift the neighbours an entry passes on its way to ``new_score``."""
+    if new_score > old_score:
+        passed = Leaderboard.objects.mongo_update_many(
+            {'rank': {'$gt': 0, '$lt': rank}, 'total_calories': {'$lt': new_score}},
+            {'$inc': {'rank': 1}},
+        ).modified_count
+        offset = -passed
+    elif new_score < old_score:
+        passed = Leaderboard.objects.mongo_update_many(
+            {'rank': {'$gt': rank}, 'total_calories': {'$gt': new_score}},
+            {'$inc': {'rank': -1}},
+        ).modified_count
+        offset = passed
+    else:
+        return
+    if offset:
+        Leaderboard.objects.mongo_update_one({'_id': entry_id}, {'$inc': {'rank': offset}})
+
+
+def apply_activity_delta(user_id, user_name, calories, activities):
+    """
+    Add ``calories`` and ``activities`` (either may be negative) to a user's
+    leaderboard entry, creating it if needed, and re-rank it locally.
+    """
+    if not calories and not activities:
+        return
+    increment = {'total_calories': calories, 'total_activities': activities}
+    with rank_lock() as locked:
+        if not locked and rebuilding():
+            # The rebuild would overwrite a $inc made now, or count this
+            # write twice; a follow-up run totals it instead.
+            _schedule_rebuild()
+            return
+        before = Leaderboard.objects.mongo_find_one_and_update(
+            {'user_id': user_id}, {'$inc': increment},
+            projection={'total_calories': 1, 'rank': 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            # Only first-time users pay for the name/team lookup
+            name, team = _user_details(user_id, user_name)
+            try:
+                before = Leaderboard.objects.mongo_find_one_and_update(
+                    {'user_id': user_id},
+                    {
+                        '$inc': increment,
+                        '$setOnInsert': {'user_name': name, 'team': team, 'rank': 0},
+                    },
+                    projection={'total_calories': 1, 'rank': 1},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE,
+                )
+            except DuplicateKeyError:
+                # A concurrent first write inserted the entry (user_id is unique)
+                before = Leaderboard.objects.mongo_find_one_and_update(
+                    {'user_id': user_id}, {'$inc': increment},
+                    projection={'total_calories': 1, 'rank': 1},
+                    return_document=ReturnDocument.BEFORE,
+                )
+        if not locked:
+            _schedule_repair()
+        elif before is None or not before['rank']:
+            # New, or inserted by a write that could not place it (rank 0)
+            entry = Leaderboard.objects.mongo_find_one({'user_id': user_id}, {'total_calories': 1})
+            _place_new_entry(entry['_id'], entry['total_calories'])
+        else:
+            old_score = before['total_calories']
+            _move_entry(before['_id'], before['rank'], old_score, old_score + calories)
+    bump_version(Leaderboard)
+
+
+def _schedule_repair():
+    """Re-rank the whole table soon, for totals updated without the lock."""
+    from .jobs import enqueue  # jobs imports this module
+
+    enqueue('rerank_leaderboard', delay=REPAIR_DELAY_SECONDS)
+
+
+def _schedule_rebuild():
+    """Run ``rebuild_leaderboard`` again once the running rebuild is done."""
+    from .jobs import enqueue  # jobs imports this module
+
+    enqueue('rebuild_leaderboard', delay=REPAIR_DELAY_SECONDS)
+
+
+def rank_with_neighbours(user_id, k):
+    """
+    Return ``(entry, above, below)`` for ``user_id`` with up to ``k``
+    neighbours on each side, or ``None`` if the user has no entry.
+
+    The maintained ``rank`` field makes this two indexed lookups, a point
+    read on ``user_id`` and a range read on ``rank``, whatever the table size.
+    """
+    projection = LeaderboardDocumentSerializer.projection()
+    entry = Leaderboard.objects.mongo_find_one({'user_id': user_id}, projection)
+    if entry is None:
+        return None
+    rank = entry['rank']
+    neighbours = Leaderboard.objects.mongo_find(
+        {'rank': {'$gte': rank - k, '$lte': rank + k}, '_id': {'$ne': entry['_id']}},
+        projection,
+        sort=[('rank', 1)],
+    )
+    above, below = [], []
+    for neighbour in neighbours:
+        (above if neighbour['rank'] <= rank else below).append(neighbour)
+    return entry, above, below
+
+
+def leaderboard_pipeline():
+    """
+    Aggregation that totals every user's activities in a single server-side
+    pass, joined with the user's current name/team and with their existing
+    leaderboard entry, whose ``_id`` and ``rank`` it carries over. Users
+    without an entry come out with no ``_id`` and rank 0.
+    """
+    return [
+        {'$group': {
+            '_id': decoded(Activity, 'user_id'),
+            'user_name': {'$last': decoded(Activity, 'user_name')},
+            'total_calories': {'$sum': decoded(Activity, 'calories_burned')},
+            'total_activities': {'$sum': 1},
+        }},
+        {'$addFields': {'user_oid': {
+            '$convert': {'input': '$_id', 'to': 'objectId', 'onError': None, 'onNull': None},
+        }}},
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'localField': 'user_oid',
+            'foreignField': '_id',
+            'as': 'user',
+        }},
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'localField': '_id',
+            'foreignField': 'user_id',
+            'pipeline': [{'$project': {'_id': 1, 'rank': 1}}],
+            'as': 'entry',
+        }},
+        {'$replaceWith': {'$mergeObjects': [
+            {
+                'user_id': '$_id',
+                'user_name': {'$ifNull': [{'$arrayElemAt': ['$user.name', 0]}, '$user_name']},
+                'team': {'$ifNull': [{'$arrayElemAt': ['$user.team', 0]}, '']},
+                'total_calories': '$total_calories',
+                'total_activities': '$total_activities',
+                'rank': 0,
+            },
+            {'$arrayElemAt': ['$entry', 0]},
+        ]}},
+    ]
+
+
+def rerank_pipeline():
+    """Aggregation that renumbers every entry by calories, in place."""
+    return [
+        {'$setWindowFields': {
+            'sortBy': {'total_calories': -1, 'user_id': 1},
+            'output': {'rank': {'$documentNumber': {}}},
+        }},
+        {'$project': {'rank': 1}},
+        {'$merge': {
+            'into': Leaderboard._meta.db_table,
+            'on': '_id',
+            'whenMatched': 'merge',
+            'whenNotMatched': 'discard',
+        }},
+    ]
+
+
+def rerank_leaderboard():
+    """
+    Renumber every entry by its current totals under the rank lock and
+    return the number of entries. The totals are not touched.
+    """
+    with rank_lock(wait=REBUILD_LOCK_WAIT_SECONDS, renew=True) as locked:
+        if not locked:
+            raise RuntimeError('The leaderboard rank lock is busy')
+        Leaderboard.objects.mongo_aggregate(rerank_pipeline(), allowDiskUse=True)
+    bump_version(Leaderboard)
+    return Leaderboard.objects.mongo_estimated_document_count()
+
+
+def rebuild_leaderboard(dry_run=False):
+    """
+    Recompute the whole leaderboard and return the number of entries.
+
+    Totals are ``$merge``d into the existing entries, so their ``_id``s stay
+    stable, and the table is then re-ranked. Entries without activities,
+    such as ones created through the API, are kept and ranked with the rest.
+    The rank lock is held throughout; writes that arrive meanwhile leave
+    their totals to a follow-up run (see ``apply_activity_delta``). A dry
+    run only counts the users with activities.
+    """
+    pipeline = leaderboard_pipeline()
+    if dry_run:
+        pipeline.append({'$count': 'entries'})
+        result = list(Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True))
+        return result[0]['entries'] if result else 0
+    pipeline.append({'$merge': {
+        'into': Leaderboard._meta.db_table,
+        'on': '_id',
+        'whenMatched': 'merge',
+        'whenNotMatched': 'insert',
+    }})
+    with rank_lock(wait=REBUILD_LOCK_WAIT_SECONDS, purpose=REBUILD, renew=True) as locked:
+        if not locked:
+            raise RuntimeError('The leaderboard rank lock is busy')
+        Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+        Leaderboard.objects.mongo_aggregate(rerank_pipeline(), allowDiskUse=True)
+    bump_version(Leaderboard)
+    return Leaderboard.objects.mongo_estimated_document_count()
@@ -0,0 +1,84 @@
+"""
+Leases in the ``locks`` collection, held across processes.
+
+A lease is a document keyed by its name with the holder's token, what it is
+held for and an expiry, so a holder that died releases it after its lease
+length. ``lease`` acquires one with an upsert that only matches a free
+(expired) document; ``held`` reports whether one is currently taken.
+"""
+import datetime
+import threading
+import time
+from contextlib import contextmanager
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from .documents import database
+
+LOCK_COLLECTION = 'locks'
+LEASE_SECONDS = 10
+
+
+def _expiry(seconds):
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+
+
+def _renew(locks, name, token, seconds, stop):
+    """Extend the lease held with ``token`` until ``stop`` is set or it is lost."""
+    while not stop.wait(seconds / 3):
+        renewed = locks.update_one({'_id': name, 'token': token}, {'$set': {'expires': _expiry(seconds)}})
+        if not renewed.matched_count:
+            return
+
+
+@contextmanager
+def lease(name, wait, purpose=None, renew=False, seconds=LEASE_SECONDS):
+    """
+    Hold lease ``name`` for ``purpose``, waiting up to ``wait`` seconds for
+    it, and yield whether it was acquired. The lease lasts ``seconds``;
+    with ``renew`` a thread extends it while it is held, for runs that may
+    outlast it.
+    """
+    locks = database()[LOCK_COLLECTION]
+    token = ObjectId()
+    deadline = time.monotonic() + wait
+    acquired = False
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            # Matches only a free (expired) lease; a held one makes the upsert collide on _id
+            locks.update_one(
+                {'_id': name, 'expires': {'$lt': now}},
+                {'$set': {'token': token, 'purpose': purpose, 'expires': _expiry(seconds)}},
+                upsert=True,
+            )
+            acquired = True
+            break
+        except DuplicateKeyError:
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.005)
+    stop = threading.Event()
+    renewer = None
+    if acquired and renew:
+        renewer = threading.Thread(
+            target=_renew, args=(locks, name, token, seconds, stop), name=f'octofit-lease-{name}', daemon=True,
+        )
+        renewer.start()
+    try:
+        yield acquired
+    finally:
+        if renewer is not None:
+            stop.set()
+            renewer.join()
+        if acquired:
+            locks.delete_one({'_id': name, 'token': token})
+
+
+def held(name, purpose=None):
+    """Whether lease ``name`` is currently held, for ``purpose`` if given."""
+    query = {'_id': name, 'expires': {'$gte': datetime.datetime.now(datetime.timezone.utc)}}
+    if purpose is not None:
+        query['purpose'] = purpose
+    return database()[LOCK_COLLECTION].find_one(query, {'_id': 1}) is not None
@@ -0,0 +1,266 @@
+import datetime
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.test import APIClient
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.synthetic import ACTIVITY_TYPES
+
+OPERATIONS = ('list', 'retrieve', 'create')
+PERCENTILES = (50, 90, 95, 99)
+COMPARED_METRICS = ('p50_ms', 'p95_ms')
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles in milliseconds and throughput for one scenario."""
+    ordered = sorted(latencies)
+    summary = {
+        'requests': len(ordered),
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+    }
+    for pct in PERCENTILES:
+        summary[f'p{pct}_ms'] = round(percentile(ordered, pct) * 1000, 3)
+    summary['max_ms'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_payload(resource, rng, n, user_ids):
+    """A valid POST body for ``resource``; ``n`` keeps unique fields unique."""
+    if resource == 'users':
+        return {'name': f'Bench User {n}', 'email': f'bench{n}@octofit.example',
+                'password': 'benchmark', 'team': None}
+    if resource == 'teams':
+        return {'name': f'Bench Team {n}', 'description': 'Created by benchmark_api'}
+    if resource == 'activities':
+        return {'user_id': rng.choice(user_ids), 'user_name': f'Bench User {n}',
+                'activity_type': rng.choice(ACTIVITY_TYPES), 'duration': rng.randint(10, 120),
+                'calories_burned': rng.randint(50, 1200),
+                'distance': round(rng.uniform(0.5, 42.2), 2)}
+    if resource == 'leaderboard':
+        return {'user_id': f'bench-{n}', 'user_name': f'Bench User {n}', 'team': '',
+                'total_calories': rng.randint(0, 10000), 'total_activities': rng.randint(0, 50),
+                'rank': 0}
+    return {'name': f'Bench Workout {n}', 'description': 'Created by benchmark_api',
+            'difficulty': rng.choice(['Easy', 'Medium', 'Hard']), 'duration': rng.randint(10, 90),
+            'category': 'Cardio', 'recommended_for': None}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark list, retrieve and create on every API viewset plus the leaderboard '
+        'recompute, and save latency percentiles and throughput as JSON. Measures the data '
+        'already in the database unless --reseed is given, which replaces all of it; only '
+        'use that against a disposable local mongod.'
+    )
+
+    RESOURCES = [
+        ('users', User),
+        ('teams', Team),
+        ('activities', Activity),
+        ('leaderboard', Leaderboard),
+        ('workouts', Workout),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users for --reseed (default: 1000)')
+        parser.add_argument('--activities-per-user', type=int, default=20,
+                            help='Mean activities per user for --reseed (default: 20)')
+        parser.add_argument('--teams', type=int, default=20, help='Synthetic teams for --reseed (default: 20)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--reseed', action='store_true',
+                            help='Replace ALL data in the configured database with a synthetic dataset first')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Timed requests per scenario (default: 200)')
+        parser.add_argument('--warmup', type=int, default=10,
+                            help='Untimed requests before each scenario (default: 10)')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Client threads issuing requests (default: 1)')
+        parser.add_argument('--recompute-runs', type=int, default=3,
+                            help='Timed leaderboard recomputes (default: 3)')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Clear the response cache before every request')
+        parser.add_argument('--output', default='benchmark.json',
+                            help='Where to write the JSON results (default: benchmark.json)')
+        parser.add_argument('--compare', help='Baseline JSON to diff against; exits non-zero on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative slowdown of p50/p95 against --compare (default: 0.25)')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read baseline {options["compare"]}: {exc}')
+
+        if options['reseed']:
+            self.stdout.write(f'Seeding {options["users"]} users (seed {options["seed"]})...')
+            call_command(
+                'populate_db', users=options['users'], teams=options['teams'],
+                activities_per_user=options['activities_per_user'], seed=options['seed'],
+                build_leaderboard=True,
+                stdout=self.stdout if options['verbosity'] > 1 else StringIO(),
+            )
+
+        rng = random.Random(options['seed'])
+        dataset = {name: model.objects.mongo_count_documents({}) for name, model in self.RESOURCES}
+        user_ids = [str(doc['_id']) for doc in User.objects.mongo_find({}, {'_id': 1}).limit(1000)]
+        results = {}
+
+        self.stdout.write(f'{"scenario":<22} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"req/s":>9}')
+        for name, model in self.RESOURCES:
+            ids = [str(doc['_id']) for doc in model.objects.mongo_find({}, {'_id': 1}).limit(1000)]
+            for operation in OPERATIONS:
+                if operation == 'retrieve' and not ids:
+                    continue
+                requests = self.build_requests(name, operation, rng, ids, user_ids,
+                                               options['warmup'] + options['requests'])
+                summary = self.run_scenario(requests, options)
+                self.report(results, f'{name}.{operation}', summary)
+
+        timings = []
+        started = time.perf_counter()
+        for _ in range(max(options['recompute_runs'], 1)):
+            run_started = time.perf_counter()
+            rebuild_leaderboard()
+            timings.append(time.perf_counter() - run_started)
+        self.report(results, 'leaderboard.recompute', summarize(timings, time.perf_counter() - started))
+
+        document = {
+            'meta': {
+                'commit': git_commit(),
+                'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': settings.DATABASES['default']['NAME'],
+                'dataset': dataset,
+                'options': {
+                    key: options[key] for key in (
+                        'users', 'activities_per_user', 'teams', 'seed', 'reseed', 'requests',
+                        'warmup', 'concurrency', 'recompute_runs', 'cold_cache',
+                    )
+                },
+            },
+            'results': results,
+        }
+        Path(options['output']).write_text(json.dumps(document, indent=2, sort_keys=True) + '\n')
+        self.stdout.write(self.style.SUCCESS(f'✓ Wrote {len(results)} scenarios to {options["output"]}'))
+
+        if baseline is not None:
+            self.compare(baseline, results, options['tolerance'])
+
+    def build_requests(self, resource, operation, rng, ids, user_ids, count):
+        """``(method, path, body)`` tuples, drawn up front so runs are reproducible."""
+        path = f'/api/{resource}/'
+        if operation == 'list':
+            return [('get', path, None)] * count
+        if operation == 'retrieve':
+            return [('get', f'{path}{rng.choice(ids)}/', None) for _ in range(count)]
+        # Unique fields must not collide with an earlier run on the same data
+        base = time.time_ns() // 1000
+        return [
+            ('post', path, create_payload(resource, rng, base + i, user_ids or ['0']))
+            for i in range(count)
+        ]
+
+    def run_scenario(self, requests, options):
+        warmup, cold = options['warmup'], options['cold_cache']
+        self.issue(APIClient(HTTP_HOST='localhost'), requests[:warmup], cold)
+        timed = requests[warmup:]
+        concurrency = min(options['concurrency'], len(timed))
+        chunks = [timed[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        if concurrency == 1:
+            latencies = self.issue(APIClient(HTTP_HOST='localhost'), timed, cold)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = [
+                    latency
+                    for chunk in pool.map(self.issue_in_thread, chunks, [cold] * concurrency)
+                    for latency in chunk
+                ]
+        return summarize(latencies, time.perf_counter() - started)
+
+    def issue_in_thread(self, requests, cold):
+        try:
+            return self.issue(APIClient(HTTP_HOST='localhost'), requests, cold)
+        finally:
+            connections.close_all()
+
+    def issue(self, client, requests, cold):
+        latencies = []
+        for method, path, body in requests:
+            if cold:
+                cache.clear()
+            started = time.perf_counter()
+            if body is None:
+                response = client.get(path)
+            else:
+                response = client.post(path, body, format='json')
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{method.upper()} {path} returned {response.status_code}: {response.content[:200]!r}'
+                )
+        return latencies
+
+    def report(self, results, scenario, summary):
+        results[scenario] = summary
+        self.stdout.write(
+            f'{scenario:<22} {summary["p50_ms"]:>9.2f} {summary["p95_ms"]:>9.2f} '
+            f'{summary["p99_ms"]:>9.2f} {summary["throughput_rps"] or 0:>9.1f}'
+        )
+
+    def compare(self, baseline, results, tolerance):
+        """Print the change against ``baseline`` and fail on slowdowns past ``tolerance``."""
+        regressions = []
+        self.stdout.write(f'\n{"scenario":<22} {"metric":<8} {"base ms":>9} {"now ms":>9} {"change":>8}')
+        for scenario, summary in results.items():
+            before = baseline.get('results', {}).get(scenario)
+            if not before:
+                continue
+            for metric in COMPARED_METRICS:
+                if not before.get(metric):
+                    continue
+                change = summary[metric] / before[metric] - 1
+                self.stdout.write(
+                    f'{scenario:<22} {metric:<8} {before[metric]:>9.2f} {summary[metric]:>9.2f} {change:>+7.0%}'
+                )
+                if change > tolerance:
+                    regressions.append(f'{scenario} {metric} {change:+.0%}')
+        if regressions:
+            raise CommandError('Regressions beyond tolerance: ' + ', '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('✓ No regressions beyond tolerance'))
@@ -0,0 +1,107 @@
+import datetime
+import random
+import time
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from octofit_tracker.fields import EncodedField
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.renderers import FastJSONRenderer
+from octofit_tracker.serializers import (
+    UserSerializer, TeamSerializer, ActivitySerializer,
+    LeaderboardSerializer, WorkoutSerializer,
+    UserCompiledSerializer, TeamCompiledSerializer, WorkoutCompiledSerializer,
+    ActivityDocumentSerializer, LeaderboardDocumentSerializer
+)
+
+
+def make_rows(model, count, rng):
+    """Build unsaved instances with realistic values; no database needed."""
+    now = timezone.now().replace(microsecond=0)
+    rows = []
+    for i in range(count):
+        created = now - datetime.timedelta(minutes=rng.randint(0, 525600), milliseconds=rng.randint(0, 999))
+        if model is User:
+            row = User(name=f'User {i}', email=f'user{i}@example.com', password='secret',
+                       team=rng.choice(['Team Marvel', 'Team DC', None]), created_at=created)
+        elif model is Team:
+            row = Team(name=f'Team {i}', description='A team of heroes', created_at=created)
+        elif model is Activity:
+            row = Activity(user_id=str(ObjectId()), user_name=f'User {i}',
+                           activity_type=rng.choice(['Running', 'Cycling', 'Yoga']),
+                           duration=rng.randint(10, 120), calories_burned=rng.randint(50, 1200),
+                           distance=rng.choice([None, round(rng.uniform(0.5, 42.2), 2)]), date=created)
+        elif model is Leaderboard:
+            row = Leaderboard(user_id=str(ObjectId()), user_name=f'User {i}', team='Team DC',
+                              total_calories=rng.randint(0, 100000), total_activities=rng.randint(0, 300),
+                              rank=i + 1)
+        else:
+            row = Workout(name=f'Workout {i}', description='Full body conditioning ' * 4,
+                          difficulty='Medium', duration=45, category='Cardio', recommended_for=None)
+        row._id = ObjectId()
+        rows.append(row)
+    return rows
+
+
+def to_document(instance):
+    """Return the document Mongo would hand back for ``instance``."""
+    document = {}
+    for field in instance._meta.concrete_fields:
+        value = getattr(instance, field.attname)
+        if isinstance(value, datetime.datetime):
+            # Mongo stores naive UTC with millisecond precision
+            value = timezone.make_naive(value, datetime.timezone.utc)
+        if isinstance(field, EncodedField):
+            value = field.encode(value)
+        document[field.column] = value
+    return document
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF ModelSerializer + JSONRenderer against the compiled serializers + orjson'
+
+    RESOURCES = [
+        ('users', User, UserSerializer, UserCompiledSerializer, False),
+        ('teams', Team, TeamSerializer, TeamCompiledSerializer, False),
+        ('activities', Activity, ActivitySerializer, ActivityDocumentSerializer, True),
+        ('leaderboard', Leaderboard, LeaderboardSerializer, LeaderboardDocumentSerializer, True),
+        ('workouts', Workout, WorkoutSerializer, WorkoutCompiledSerializer, False),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per page (default: 1000)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per variant (default: 5)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started)
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rows, repeat = options['rows'], options['repeat']
+        baseline_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+
+        self.stdout.write(f'Rendering {rows} rows per resource, best of {repeat} runs')
+        self.stdout.write(f'{"resource":<12} {"drf ms":>9} {"fast ms":>9} {"speedup":>8}')
+        for name, model, serializer_class, compiled_class, from_documents in self.RESOURCES:
+            instances = make_rows(model, rows, rng)
+            sources = [to_document(i) for i in instances] if from_documents else instances
+
+            baseline, expected = self.best_of(repeat, lambda: baseline_renderer.render(
+                serializer_class(instances, many=True).data))
+            fast, actual = self.best_of(repeat, lambda: fast_renderer.render(
+                compiled_class(sources, many=True).data))
+            if actual != expected:
+                raise CommandError(f'{name}: compiled output differs from ModelSerializer output')
+
+            self.stdout.write(
+                f'{name:<12} {baseline * 1000:>9.2f} {fast * 1000:>9.2f} {baseline / fast:>7.1f}x'
+            )
+        self.stdout.write(self.style.SUCCESS('✓ Outputs are byte-identical'))
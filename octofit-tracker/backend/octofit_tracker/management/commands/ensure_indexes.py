@@ -0,0 +1,81 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import UniqueConstraint
+from pymongo import ASCENDING, DESCENDING
+
+
+def index_specs(model):
+    """
+    Yield ``(name, keys, unique)`` for every ``Meta.indexes`` entry and
+    field-based ``UniqueConstraint`` declared on ``model``.
+    """
+    for index in model._meta.indexes:
+        keys = [
+            (model._meta.get_field(name).column, DESCENDING if order == 'DESC' else ASCENDING)
+            for name, order in index.fields_orders
+        ]
+        yield index.name, keys, False
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields:
+            keys = [(model._meta.get_field(name).column, ASCENDING) for name in constraint.fields]
+            yield constraint.name, keys, True
+
+
+class Command(BaseCommand):
+    help = 'Create or verify the MongoDB indexes declared in model Meta.indexes and constraints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify; exit with an error if any index is missing or differs',
+        )
+        parser.add_argument(
+            '--drop-drifted',
+            action='store_true',
+            help='Drop and recreate indexes whose keys differ from the declaration',
+        )
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+        problems = 0
+
+        for model in apps.get_app_config('octofit_tracker').get_models():
+            specs = list(index_specs(model))
+            if not specs:
+                continue
+            existing = model.objects.mongo_index_information()
+            self.stdout.write(f'{model._meta.db_table}:')
+
+            for name, keys, unique in specs:
+                current = existing.get(name)
+                if (
+                    current is not None
+                    and [(k, int(d)) for k, d in current['key']] == keys
+                    and current.get('unique', False) == unique
+                ):
+                    self.stdout.write(f'  ✓ {name}')
+                    continue
+
+                if current is not None:
+                    problems += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'  ! {name} has keys {current["key"]} (unique={current.get("unique", False)}), '
+                        f'expected {keys} (unique={unique})'
+                    ))
+                    if check_only or not options['drop_drifted']:
+                        continue
+                    model.objects.mongo_drop_index(name)
+                    problems -= 1
+                elif check_only:
+                    problems += 1
+                    self.stdout.write(self.style.WARNING(f'  ! {name} is missing'))
+                    continue
+
+                model.objects.mongo_create_index(keys, name=name, unique=unique, background=True)
+                self.stdout.write(self.style.SUCCESS(f'  + created {name}'))
+
+        if problems:
+            hint = '' if check_only else '; rerun with --drop-drifted to rebuild them'
+            raise CommandError(f'{problems} index(es) missing or out of date{hint}')
+        self.stdout.write(self.style.SUCCESS('✓ Indexes are in place'))
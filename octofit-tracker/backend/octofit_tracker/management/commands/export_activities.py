@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.export import EXPORT_FORMATS, export_query, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Stream activities as NDJSON or CSV to a file or stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=EXPORT_FORMATS, default='ndjson',
+                            help='Export format (default: ndjson)')
+        parser.add_argument('--user-id', help='Only export this user\'s activities')
+        parser.add_argument('--date-from', help='Inclusive lower bound (ISO 8601)')
+        parser.add_argument('--date-to', help='Exclusive upper bound (ISO 8601)')
+        parser.add_argument('--file', help='Write to this path instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            documents = export_query(options['user_id'], options['date_from'], options['date_to'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        chunks = iter_export(options['output'], documents)
+        if not options['file']:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+
+        rows = -1 if options['output'] == 'csv' else 0
+        with open(options['file'], 'wb') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
+                rows += 1
+        self.stdout.write(self.style.SUCCESS(f'✓ Exported {rows} activities to {options["file"]}'))
@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.jobs import (
+    HANDLERS, STATUSES, enqueue, requeue_stale, run_pending, worker_name
+)
+from octofit_tracker.models import Job
+
+
+class Command(BaseCommand):
+    help = 'List background jobs, enqueue one, or run them in this process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', choices=STATUSES, help='Only list jobs with this status')
+        parser.add_argument('--name', help='Only list jobs with this name')
+        parser.add_argument('--limit', type=int, default=20, help='Jobs to list (default: 20)')
+        parser.add_argument('--enqueue', metavar='NAME', help=f'Enqueue a job: {", ".join(HANDLERS)}')
+        parser.add_argument('--delay', type=float, default=0,
+                            help='Seconds before an enqueued job is due (default: 0)')
+        parser.add_argument('--work', action='store_true',
+                            help='Run due jobs until interrupted (for OCTOFIT_JOBS_IN_PROCESS = False)')
+        parser.add_argument('--once', action='store_true', help='With --work, exit when no job is due')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds between polls with --work (default: 1)')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            try:
+                document = enqueue(options['enqueue'], delay=options['delay'])
+            except (ValueError, TypeError) as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Job {document["_id"]} pending ({document["triggers"]} trigger(s))'
+            ))
+            return
+        if options['work']:
+            return self.work(options['once'], options['poll'])
+        self.list_jobs(options)
+
+    def work(self, once, poll):
+        worker = worker_name()
+        self.stdout.write(f'Running jobs as {worker}...')
+        try:
+            while True:
+                requeued = requeue_stale()
+                if requeued:
+                    self.stdout.write(f'Requeued {requeued} stale job(s)')
+                count = run_pending(worker)
+                if count:
+                    self.stdout.write(self.style.SUCCESS(f'✓ Ran {count} job(s)'))
+                if once:
+                    return
+                time.sleep(poll)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+    def list_jobs(self, options):
+        query = {}
+        if options['status']:
+            query['status'] = options['status']
+        if options['name']:
+            query['name'] = options['name']
+        jobs = Job.objects.mongo_find(query).sort('created_at', -1).limit(options['limit'])
+
+        self.stdout.write(
+            f'{"id":<24}  {"name":<20} {"status":<9} {"triggers":>8} {"attempts":>8}  '
+            f'{"created (UTC)":<19}  {"took":>8}'
+        )
+        for job in jobs:
+            took = ''
+            if job.get('started_at') and job.get('finished_at'):
+                took = f'{(job["finished_at"] - job["started_at"]).total_seconds():.2f}s'
+            self.stdout.write(
+                f'{str(job["_id"]):<24}  {job["name"]:<20} {job["status"]:<9} {job["triggers"]:>8} '
+                f'{job["attempts"]:>8}  {job["created_at"]:%Y-%m-%d %H:%M:%S}  {took:>8}'
+            )
+            if job['status'] == 'failed' and job.get('error'):
+                self.stdout.write(self.style.ERROR(f'    {job["error"].strip().splitlines()[-1]}'))
@@ -0,0 +1,84 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.activity_migration import drop_legacy, migrate, storage_report
+
+
+def human_bytes(value):
+    for unit in ('B', 'KiB', 'MiB'):
+        if value < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} GiB'
+
+
+class Command(BaseCommand):
+    help = 'Copy the legacy activities collection into the compact schema, resumably, and report the savings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Documents copied per insert_many (default: 5000)')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to limit load (default: 0)')
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches; the next run resumes')
+        parser.add_argument('--report', action='store_true',
+                            help='Only print the storage report')
+        parser.add_argument('--drop-legacy', action='store_true',
+                            help='Drop the legacy collection (only once the migration has finished)')
+
+    def handle(self, *args, **options):
+        if options['drop_legacy']:
+            try:
+                drop_legacy()
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS('✓ Dropped the legacy activities collection'))
+            return
+        if not options['report']:
+            self.run_migration(options)
+        self.print_report()
+
+    def run_migration(self, options):
+        call_command('ensure_indexes', stdout=self.stdout)
+        self.stdout.write('Migrating activities...')
+
+        def progress(state):
+            self.stdout.write(f'  {state["copied"]} copied, last _id {state["last_id"]}')
+
+        started = time.perf_counter()
+        state = migrate(options['batch_size'], options['pause'], options['max_batches'], progress)
+        elapsed = time.perf_counter() - started
+
+        if state['finished_at'] is None:
+            self.stdout.write(self.style.WARNING(
+                f'Stopped after {options["max_batches"]} batch(es) in {elapsed:.1f}s; run again to resume'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Migration finished: {state["copied"]} activities copied ({elapsed:.1f}s this run)'
+            ))
+
+    def print_report(self):
+        report = storage_report()
+        self.stdout.write(f'{"collection":<10} {"documents":>12} {"data":>12} {"storage":>12} {"indexes":>12}'
+                          f' {"data/doc":>10} {"index/doc":>10}')
+        for label in ('legacy', 'compact'):
+            stats = report[label]
+            if stats is None:
+                self.stdout.write(f'{label:<10} {"(none)":>12}')
+                continue
+            per_document = stats['per_document']
+            self.stdout.write(
+                f'{label:<10} {stats["documents"]:>12} {human_bytes(stats["data_bytes"]):>12} '
+                f'{human_bytes(stats["storage_bytes"]):>12} {human_bytes(stats["index_bytes"]):>12} '
+                f'{per_document["data_bytes"]:>8.1f} B {per_document["index_bytes"]:>8.1f} B'
+            )
+        saving = report.get('saving')
+        if saving:
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Compact format saves {saving["data_bytes"]:.0%} of document bytes, '
+                f'{saving["storage_bytes"]:.0%} of compressed storage and '
+                f'{saving["index_bytes"]:.0%} of index bytes per activity'
+            ))
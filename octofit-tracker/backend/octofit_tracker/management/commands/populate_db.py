@@ -1,13 +1,45 @@
+import itertools
+import random
+import time
+
 from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timedelta
-from bson import ObjectId
+from django.utils import timezone
+from octofit_tracker.cache import bump_version
+from octofit_tracker.documents import database
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.models import (
+    User, Team, Activity, CompactActivity, LegacyActivity, Leaderboard, Workout, ActivityRollup,
+    LeaderboardWindow
+)
+from octofit_tracker.rollups import bucket_start, rebuild_rollups
+from octofit_tracker.activity_migration import MIGRATION, STATE_COLLECTION
+from octofit_tracker.synthetic import (
+    generate_activities, generate_teams, generate_users, insert_activities_batched, insert_batched
+)
+from octofit_tracker.windows import MARKER_COLLECTION
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int,
+                            help='Generate this many synthetic users instead of the superhero dataset')
+        parser.add_argument('--activities-per-user', type=int, default=20,
+                            help='Mean activities per synthetic user (default: 20)')
+        parser.add_argument('--teams', type=int, default=20,
+                            help='Number of synthetic teams (default: 20)')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Random seed for synthetic data (default: 42)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Documents per insert_many batch (default: 5000)')
+        parser.add_argument('--build-leaderboard', action='store_true',
+                            help='Rebuild the leaderboard and rollups after a synthetic load')
+
     def handle(self, *args, **kwargs):
+        if kwargs['users']:
+            return self.populate_at_scale(kwargs)
+        
         self.stdout.write('Clearing existing data...')
         
         # Delete all existing data
@@ -16,6 +48,10 @@ class Command(BaseCommand):
         Activity.objects.all().delete()
         Leaderboard.objects.all().delete()
         Workout.objects.all().delete()
+        ActivityRollup.objects.all().delete()
+        LeaderboardWindow.objects.all().delete()
+        # Markers of the windows just deleted would keep them "materialized" and empty
+        database()[MARKER_COLLECTION].delete_many({})
         
         self.stdout.write(self.style.SUCCESS('✓ Cleared existing data'))
         
@@ -146,34 +182,30 @@ class Command(BaseCommand):
         
         # Create Leaderboard entries
         self.stdout.write('Creating leaderboard...')
-        leaderboard_data = []
-        for user in all_users:
-            user_activities = Activity.objects.filter(user_id=str(user._id))
-            total_calories = sum(a.calories_burned for a in user_activities)
-            total_activities = user_activities.count()
-            
-            leaderboard_data.append({
-                'user': user,
-                'total_calories': total_calories,
-                'total_activities': total_activities
-            })
-        
-        # Sort by total calories
-        leaderboard_data.sort(key=lambda x: x['total_calories'], reverse=True)
-        
-        for rank, data in enumerate(leaderboard_data, start=1):
-            Leaderboard.objects.create(
-                user_id=str(data['user']._id),
-                user_name=data['user'].name,
-                team=data['user'].team,
-                total_calories=data['total_calories'],
-                total_activities=data['total_activities'],
-                rank=rank
-            )
+        leaderboard_entries = rebuild_leaderboard()
+        
+        self.stdout.write(self.style.SUCCESS(f'✓ Created {leaderboard_entries} leaderboard entries'))
         
-        self.stdout.write(self.style.SUCCESS(f'✓ Created {len(leaderboard_data)} leaderboard entries'))
+        # Create activity rollups
+        self.stdout.write('Creating activity rollups...')
+        rollups = rebuild_rollups()
         
-        # Create Workouts
+        self.stdout.write(self.style.SUCCESS(f'✓ Created {rollups} activity rollups'))
+        
+        workouts = self.create_workouts()
+        
+        # Summary
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write(self.style.SUCCESS('Database populated successfully!'))
+        self.stdout.write('='*50)
+        self.stdout.write(f'Total Users: {User.objects.count()}')
+        self.stdout.write(f'Total Teams: {Team.objects.count()}')
+        self.stdout.write(f'Total Activities: {Activity.objects.count()}')
+        self.stdout.write(f'Total Leaderboard Entries: {Leaderboard.objects.count()}')
+        self.stdout.write(f'Total Workouts: {len(workouts)}')
+        self.stdout.write('='*50 + '\n')
+
+    def create_workouts(self):
         self.stdout.write('Creating workouts...')
         workouts = [
             Workout.objects.create(
@@ -227,14 +259,73 @@ class Command(BaseCommand):
         ]
         
         self.stdout.write(self.style.SUCCESS(f'✓ Created {len(workouts)} workout plans'))
-        
-        # Summary
-        self.stdout.write('\n' + '='*50)
-        self.stdout.write(self.style.SUCCESS('Database populated successfully!'))
-        self.stdout.write('='*50)
-        self.stdout.write(f'Total Users: {User.objects.count()}')
-        self.stdout.write(f'Total Teams: {Team.objects.count()}')
-        self.stdout.write(f'Total Activities: {Activity.objects.count()}')
-        self.stdout.write(f'Total Leaderboard Entries: {Leaderboard.objects.count()}')
-        self.stdout.write(f'Total Workouts: {Workout.objects.count()}')
-        self.stdout.write('='*50 + '\n')
+        return workouts
+
+    def populate_at_scale(self, options):
+        """
+        Stream a seeded synthetic dataset into Mongo with batched
+        ``insert_many`` calls, holding at most one batch of users and one
+        batch of activities in memory.
+        """
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        # Midnight UTC, so reruns on the same day with the same seed match
+        now = bucket_start(timezone.now(), 'day')
+
+        self.stdout.write('Clearing existing data...')
+        # Both activity schemas and the copy's progress, so a later migrate_activities starts over
+        cleared = (User, Team, LegacyActivity, CompactActivity, Leaderboard, Workout, ActivityRollup,
+                   LeaderboardWindow)
+        for model in cleared:
+            model.objects.mongo_delete_many({})
+        database()[MARKER_COLLECTION].delete_many({})
+        database()[STATE_COLLECTION].delete_one({'_id': MIGRATION})
+        self.stdout.write(self.style.SUCCESS('✓ Cleared existing data'))
+
+        teams = list(generate_teams(rng, options['teams']))
+        insert_batched(Team, teams, batch_size)
+        team_names = [team['name'] for team in teams]
+        self.stdout.write(self.style.SUCCESS(f'✓ Created {len(teams)} teams'))
+
+        self.stdout.write(
+            f'Generating {options["users"]} users with ~{options["activities_per_user"]} '
+            f'activities each (seed {options["seed"]})...'
+        )
+        users_total = activities_total = 0
+        started = time.perf_counter()
+        user_stream = generate_users(rng, options['users'], team_names, now)
+        while True:
+            users = list(itertools.islice(user_stream, batch_size))
+            if not users:
+                break
+            users_total += insert_batched(User, users, batch_size)
+            activities = itertools.chain.from_iterable(
+                generate_activities(rng, user, options['activities_per_user'], now)
+                for user in users
+            )
+            activities_total += insert_activities_batched(activities, batch_size)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'  {users_total} users, {activities_total} activities '
+                f'({(users_total + activities_total) / elapsed:,.0f} inserts/s)'
+            )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Inserted {users_total} users and {activities_total} activities in {elapsed:.1f}s '
+            f'({(users_total + activities_total) / max(elapsed, 1e-9):,.0f} inserts/s)'
+        ))
+
+        self.create_workouts()
+
+        if options['build_leaderboard']:
+            for label, rebuild in (('leaderboard entries', rebuild_leaderboard),
+                                   ('activity rollups', rebuild_rollups)):
+                started = time.perf_counter()
+                count = rebuild()
+                self.stdout.write(self.style.SUCCESS(
+                    f'✓ Built {count} {label} in {time.perf_counter() - started:.1f}s'
+                ))
+
+        # The raw writes above sent no signals; invalidate cached responses once
+        for model in cleared:
+            bump_version(model)
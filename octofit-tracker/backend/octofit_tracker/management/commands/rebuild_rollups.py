@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily/weekly activity rollups from scratch'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding activity rollups...')
+
+        started = time.perf_counter()
+        documents = rebuild_rollups()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Wrote {documents} rollup documents in {elapsed:.3f}s'
+        ))
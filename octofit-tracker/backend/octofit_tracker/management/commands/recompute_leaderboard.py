@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.leaderboard import rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the leaderboard collection with a single MongoDB aggregation'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Run the aggregation and report the entry count without writing',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        self.stdout.write('Recomputing leaderboard' + (' (dry run)...' if dry_run else '...'))
+
+        started = time.perf_counter()
+        entries = rebuild_leaderboard(dry_run=dry_run)
+        elapsed = time.perf_counter() - started
+
+        verb = 'Would write' if dry_run else 'Wrote'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {verb} {entries} leaderboard entries in {elapsed:.3f}s'
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.propagation import reconcile_users
+
+
+class Command(BaseCommand):
+    help = 'Find and repair user names and teams copied onto activities, leaderboard entries and team rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report stale documents without rewriting them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Users compared per aggregation (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        self.stdout.write('Reconciling denormalized user fields' + (' (dry run)...' if dry_run else '...'))
+
+        started = time.perf_counter()
+        stale = reconcile_users(batch_size=options['batch_size'], dry_run=dry_run)
+        elapsed = time.perf_counter() - started
+
+        for collection, count in stale.items():
+            self.stdout.write(f'  {collection}: {count} stale')
+        verb = 'Found' if dry_run else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {verb} {sum(stale.values())} stale documents in {elapsed:.3f}s'
+        ))
@@ -0,0 +1,287 @@
+"""
+Per-route request metrics in Prometheus text format.
+
+``MetricsMiddleware`` opens a ``RequestMetrics`` record for every request and
+attributes work done while serving it to the route (the URL name, e.g.
+``activity-list``):
+
+* Mongo commands, via pymongo command monitoring (``MongoCommandListener``);
+* djongo's SQL translation, i.e. time inside ORM query execution that was
+  not spent waiting on Mongo (``djongo_wrapper``, installed on every
+  connection as it opens);
+* serialization, i.e. the compiled serializers' ``.data`` and JSON rendering.
+
+The record lives in a context variable, so it follows the request into
+threads that carry its context (``sync_to_async`` and the async read pool).
+Histograms are kept in process memory and exposed by ``metrics_view``; each
+worker process reports its own series, along with its ``objectcache``
+counters, to staff users and to clients whose address is in
+``OCTOFIT_METRICS_ALLOWED_IPS``. Requests slower than ``OCTOFIT_SLOW_REQUEST_MS`` are logged with
+their command breakdown.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from pymongo import monitoring
+
+from . import objectcache
+
+logger = logging.getLogger('octofit_tracker.slow_requests')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+PHASES = ('mongo', 'djongo', 'serialize')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('octofit_request_metrics', default=None)
+
+
+class Histogram:
+    """A labelled Prometheus histogram; thread-safe."""
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            series = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self._series.items())
+        for label_values, (counts, count, total) in series:
+            labels = ','.join(
+                f'{name}="{escape(value)}"' for name, value in zip(self.labels, label_values)
+            )
+            prefix = labels + ',' if labels else ''
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total!r}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'octofit_request_duration_seconds', 'Request latency by route.', ('route', 'method', 'status'),
+)
+REQUEST_PHASE = Histogram(
+    'octofit_request_phase_seconds',
+    'Time per request spent in Mongo, djongo translation and serialization.', ('route', 'phase'),
+)
+MONGO_COMMAND_DURATION = Histogram(
+    'octofit_mongo_command_duration_seconds', 'Mongo command latency by route and command.',
+    ('route', 'command', 'outcome'),
+)
+REQUEST_MONGO_COMMANDS = Histogram(
+    'octofit_request_mongo_commands', 'Mongo commands issued per request.', ('route',),
+    buckets=COUNT_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_PHASE, MONGO_COMMAND_DURATION, REQUEST_MONGO_COMMANDS)
+OBJECT_CACHE_SERIES = (
+    ('hits', 'octofit_object_cache_hits_total', 'counter', 'Object cache lookups answered from memory.'),
+    ('misses', 'octofit_object_cache_misses_total', 'counter', 'Object cache lookups that went to Mongo.'),
+    ('evictions', 'octofit_object_cache_evictions_total', 'counter', 'Objects dropped to stay within the size bound.'),
+    ('size', 'octofit_object_cache_objects', 'gauge', 'Objects currently cached.'),
+)
+
+
+class RequestMetrics:
+    """What one request spent, accumulated while it is served."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.commands = []
+        self.pending = {}
+        self.depth = defaultdict(int)
+
+
+@contextmanager
+def timed(phase):
+    """Add the enclosed time to ``phase`` of the current request, if any."""
+    metrics = _current.get()
+    if metrics is None or metrics.depth[phase]:
+        yield
+        return
+    metrics.depth[phase] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.depth[phase] -= 1
+        metrics.phases[phase] += time.perf_counter() - started
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attribute each Mongo command to the request that issued it."""
+
+    def started(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            target = event.command.get(event.command_name)
+            if not isinstance(target, str):  # getMore carries a cursor id
+                target = event.command.get('collection')
+            metrics.pending[event.request_id] = target
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'error')
+
+    def _finish(self, event, outcome):
+        metrics = _current.get()
+        if metrics is None:
+            return
+        seconds = event.duration_micros / 1e6
+        target = metrics.pending.pop(event.request_id, None)
+        metrics.phases['mongo'] += seconds
+        metrics.commands.append((event.command_name, target, outcome, seconds))
+
+
+def djongo_wrapper(execute, sql, params, many, context):
+    """Count time in ORM query execution not spent waiting on Mongo as djongo's."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    mongo_before = metrics.phases['mongo']
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.phases['djongo'] += max(elapsed - (metrics.phases['mongo'] - mongo_before), 0.0)
+
+
+def install_djongo_wrapper(sender, connection, **kwargs):
+    """``connection_created`` receiver timing every connection, in any thread."""
+    if djongo_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(djongo_wrapper)
+
+
+class MetricsMiddleware:
+    """Record latency, Mongo commands and serialization time per route."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - metrics.started)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - metrics.started)
+        return response
+
+    def record(self, request, response, metrics, elapsed):
+        match = request.resolver_match
+        route = (match.view_name or match.route) if match else 'unmatched'
+        REQUEST_DURATION.observe(elapsed, route, request.method, str(response.status_code))
+        for phase, seconds in metrics.phases.items():
+            REQUEST_PHASE.observe(seconds, route, phase)
+        REQUEST_MONGO_COMMANDS.observe(len(metrics.commands), route)
+        for command, _, outcome, seconds in metrics.commands:
+            MONGO_COMMAND_DURATION.observe(seconds, route, command, outcome)
+
+        threshold = getattr(settings, 'OCTOFIT_SLOW_REQUEST_MS', None)
+        if threshold is not None and elapsed * 1000 >= threshold:
+            self.log_slow_request(request, response, route, metrics, elapsed)
+
+    def log_slow_request(self, request, response, route, metrics, elapsed):
+        slowest = sorted(metrics.commands, key=lambda command: command[3], reverse=True)[:10]
+        logger.warning(
+            'Slow request %s %s (%s) %d in %.1fms: mongo %.1fms over %d commands, '
+            'djongo %.1fms, serialize %.1fms; slowest commands: %s',
+            request.method, request.get_full_path(), route, response.status_code, elapsed * 1000,
+            metrics.phases['mongo'] * 1000, len(metrics.commands),
+            metrics.phases['djongo'] * 1000, metrics.phases['serialize'] * 1000,
+            ', '.join(
+                f'{command} {target or "-"} {seconds * 1000:.1f}ms'
+                + ('' if outcome == 'ok' else ' (failed)')
+                for command, target, outcome, seconds in slowest
+            ) or 'none',
+            extra={
+                'route': route,
+                'duration_ms': elapsed * 1000,
+                'phases_ms': {phase: seconds * 1000 for phase, seconds in metrics.phases.items()},
+                'commands': [
+                    {'command': command, 'collection': target, 'outcome': outcome, 'ms': seconds * 1000}
+                    for command, target, outcome, seconds in metrics.commands
+                ],
+            },
+        )
+
+
+def metrics_view(request):
+    """Every histogram in the Prometheus text exposition format."""
+    allowed = request.META.get('REMOTE_ADDR') in settings.OCTOFIT_METRICS_ALLOWED_IPS
+    if not allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    cache_stats = sorted(objectcache.stats().items())
+    for key, name, kind, documentation in OBJECT_CACHE_SERIES:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        for collection, counters in cache_stats:
+            lines.append(f'{name}{{collection="{collection}"}} {counters[key]}')
+    return HttpResponse('\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
+
+
+def reset():
+    """Drop every recorded series (used by tests)."""
+    for histogram in HISTOGRAMS:
+        histogram.clear()
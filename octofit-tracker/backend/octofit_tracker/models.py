@@ -1,5 +1,8 @@
+from django.conf import settings
 from djongo import models
 
+from .fields import CodedCharField, FixedPointField, FixedPointValidator, ObjectIdReferenceField
+
 
 class User(models.Model):
     _id = models.ObjectIdField(primary_key=True)
@@ -8,9 +11,15 @@ class User(models.Model):
     password = models.CharField(max_length=255)
     team = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team', '-created_at'], name='users_team'),
+            models.Index(fields=['-created_at'], name='users_created'),
+        ]
     
     def __str__(self):
         return self.name
@@ -21,6 +30,8 @@ class Team(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'teams'
@@ -29,23 +40,90 @@ class Team(models.Model):
         return self.name
 
 
-class Activity(models.Model):
+# Stored codes of ``Activity.activity_type``; append only. Other types are stored as strings.
+ACTIVITY_TYPE_CODES = ('Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'HIIT')
+
+
+class LegacyActivity(models.Model):
+    """
+    One logged activity in the original ``activities`` schema: plain keys
+    and values. ``Activity`` until ``OCTOFIT_COMPACT_ACTIVITIES`` is on.
+    """
     _id = models.ObjectIdField(primary_key=True)
     user_id = models.CharField(max_length=100)
+    # Copied from ``users``; propagate_user and reconcile_users keep it current
     user_name = models.CharField(max_length=100)
     activity_type = models.CharField(max_length=50)
     duration = models.IntegerField()  # in minutes
     calories_burned = models.IntegerField()
-    distance = models.FloatField(null=True, blank=True)  # in km
+    # in km; validated to the metre CompactActivity stores, so the API accepts the same values in both schemas
+    distance = models.FloatField(null=True, blank=True, validators=[FixedPointValidator(1000)])
     date = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'activities'
+        indexes = [
+            # Activity feed keyset pagination
+            models.Index(fields=['-date', '-_id'], name='activities_feed'),
+            # Per-user history and leaderboard lookups, in feed order. The trailing
+            # keys let type, duration and calorie filters skip entries unfetched
+            models.Index(
+                fields=['user_id', '-date', '-_id', 'activity_type', 'duration', 'calories_burned'],
+                name='activities_user_date',
+            ),
+            # Filter by type, in feed order
+            models.Index(fields=['activity_type', '-date', '-_id'], name='activities_type_date'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_name} - {self.activity_type}"
+
+
+class CompactActivity(models.Model):
+    """
+    One logged activity, stored compactly (see ``fields``): short keys, the
+    user id as an ObjectId, known types as integer codes and the distance
+    in whole metres. ``migrate_activities`` copies the legacy collection
+    here before ``OCTOFIT_COMPACT_ACTIVITIES`` makes it ``Activity``.
+    """
+    _id = models.ObjectIdField(primary_key=True)
+    user_id = ObjectIdReferenceField(max_length=100, db_column='u')
+    # Stored rather than joined: user_id need not name a user document. Copied
+    # from ``users`` when it does; propagate_user and reconcile_users keep it current
+    user_name = models.CharField(max_length=100, db_column='n')
+    activity_type = CodedCharField(max_length=50, codes=ACTIVITY_TYPE_CODES, db_column='t')
+    duration = models.IntegerField(db_column='dur')  # in minutes
+    calories_burned = models.IntegerField(db_column='cal')
+    distance = FixedPointField(null=True, blank=True, scale=1000, db_column='m')  # in km, stored in metres
+    date = models.DateTimeField(auto_now_add=True, db_column='d')
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activities_v2'
+        indexes = [
+            # Activity feed keyset pagination
+            models.Index(fields=['-date', '-_id'], name='activities_v2_feed'),
+            # Per-user history and leaderboard lookups, in feed order. The trailing
+            # keys let type, duration and calorie filters skip entries unfetched
+            models.Index(
+                fields=['user_id', '-date', '-_id', 'activity_type', 'duration', 'calories_burned'],
+                name='activities_v2_user_date',
+            ),
+            # Filter by type, in feed order
+            models.Index(fields=['activity_type', '-date', '-_id'], name='activities_v2_type_date'),
+        ]
     
     def __str__(self):
         return f"{self.user_name} - {self.activity_type}"
 
 
+# The schema the API reads and writes (see ``activity_migration``)
+Activity = CompactActivity if settings.OCTOFIT_COMPACT_ACTIVITIES else LegacyActivity
+
+
 class Leaderboard(models.Model):
     _id = models.ObjectIdField(primary_key=True)
     user_id = models.CharField(max_length=100)
@@ -54,10 +132,23 @@ class Leaderboard(models.Model):
     total_calories = models.IntegerField()
     total_activities = models.IntegerField()
     rank = models.IntegerField()
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'leaderboard'
         ordering = ['rank']
+        indexes = [
+            models.Index(fields=['rank'], name='leaderboard_rank'),
+            # Incremental re-ranking compares scores
+            models.Index(fields=['-total_calories', 'rank'], name='leaderboard_score'),
+            # Team aggregates
+            models.Index(fields=['team', '-total_calories'], name='leaderboard_team'),
+        ]
+        constraints = [
+            # apply_activity_delta upserts on it, so concurrent first writes cannot duplicate an entry
+            models.UniqueConstraint(fields=['user_id'], name='leaderboard_user'),
+        ]
     
     def __str__(self):
         return f"{self.rank}. {self.user_name} - {self.total_calories} calories"
@@ -71,9 +162,109 @@ class Workout(models.Model):
     duration = models.IntegerField()  # in minutes
     category = models.CharField(max_length=50)
     recommended_for = models.CharField(max_length=100, null=True, blank=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'workouts'
     
     def __str__(self):
         return self.name
+
+
+class ActivityRollup(models.Model):
+    """Pre-summed activity totals for one user or team over a day or ISO week."""
+    _id = models.ObjectIdField(primary_key=True)
+    scope = models.CharField(max_length=10)  # user, team
+    key = models.CharField(max_length=100)  # user_id or team name
+    period = models.CharField(max_length=10)  # day, week
+    bucket = models.DateTimeField()  # start of the day / ISO week, UTC
+    calories_burned = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)  # in minutes
+    distance = models.FloatField(default=0)  # in km
+    activities = models.IntegerField(default=0)
+    by_type = models.JSONField(default=dict)  # activity_type -> count
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activity_rollups'
+        ordering = ['bucket']
+        indexes = [
+            # Windowed leaderboards scan one period's buckets in a date range
+            models.Index(fields=['scope', 'period', 'bucket'], name='rollups_window'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope', 'key', 'period', 'bucket'], name='rollups_bucket'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} {self.key} - {self.period} of {self.bucket:%Y-%m-%d}"
+
+
+class LeaderboardWindow(models.Model):
+    """A ranked leaderboard entry materialized for a closed week or month."""
+    _id = models.ObjectIdField(primary_key=True)
+    window = models.CharField(max_length=20)  # e.g. week:2024-04-29
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    user_id = models.CharField(max_length=100)
+    user_name = models.CharField(max_length=100)
+    team = models.CharField(max_length=100)
+    total_calories = models.IntegerField()
+    total_activities = models.IntegerField()
+    rank = models.IntegerField()
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'leaderboard_windows'
+        ordering = ['rank']
+        indexes = [
+            models.Index(fields=['window', 'rank'], name='windows_rank'),
+            # Invalidation when an activity lands in a closed window
+            models.Index(fields=['window_start', 'window_end'], name='windows_span'),
+        ]
+        constraints = [
+            # materialize() merges entries on it, so concurrent runs cannot duplicate them
+            models.UniqueConstraint(fields=['window', 'user_id'], name='windows_user'),
+        ]
+    
+    def __str__(self):
+        return f"{self.window} {self.rank}. {self.user_name} - {self.total_calories} calories"
+
+
+class Job(models.Model):
+    """A queued or finished background job; see ``octofit_tracker.jobs``."""
+    _id = models.ObjectIdField(primary_key=True)
+    name = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)  # name plus arguments; pending jobs coalesce on it
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default='pending')  # pending, running, succeeded, failed
+    triggers = models.IntegerField(default=1)  # enqueues coalesced into this run
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField()
+    created_at = models.DateTimeField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'jobs'
+        ordering = ['-created_at']
+        indexes = [
+            # Runners claim the oldest due pending job
+            models.Index(fields=['status', 'run_after'], name='jobs_due'),
+            # enqueue() finds the pending job to coalesce into
+            models.Index(fields=['key', 'status'], name='jobs_key'),
+            models.Index(fields=['-created_at'], name='jobs_recent'),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} ({self.status})"
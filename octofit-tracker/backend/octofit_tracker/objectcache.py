@@ -0,0 +1,148 @@
+"""
+In-process read-through cache of users, teams and workouts by ObjectId.
+
+``get`` and ``get_many`` answer from a per-model LRU holding up to
+``OCTOFIT_OBJECT_CACHE_SIZE`` instances for ``OCTOFIT_OBJECT_CACHE_TTL``
+seconds, and fall back to Mongo for the rest. Saves and deletes through the
+ORM evict the instance in this process (``apps`` connects ``evict`` to
+``post_save``/``post_delete``); other processes and native Mongo writes are
+only seen once the entry expires, so the TTL bounds how stale a lookup can
+be. Callers get a copy and may modify it freely.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+from django.conf import settings
+
+from .models import User, Team, Workout
+
+MODELS = (User, Team, Workout)
+
+
+class LRUCache:
+    """A thread-safe LRU with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, value)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """The cached value for ``key``, or None (counted as a miss)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(model):
+    """``model``'s LRU, created on first use."""
+    cache = _caches.get(model)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(model)
+            if cache is None:
+                cache = _caches[model] = LRUCache(
+                    settings.OCTOFIT_OBJECT_CACHE_SIZE, settings.OCTOFIT_OBJECT_CACHE_TTL
+                )
+    return cache
+
+
+def _object_id(pk):
+    if isinstance(pk, ObjectId):
+        return pk
+    return ObjectId(pk) if ObjectId.is_valid(pk) else None
+
+
+def get(model, pk):
+    """The ``model`` instance with id ``pk``; raise ``model.DoesNotExist`` if none."""
+    object_id = _object_id(pk)
+    if object_id is None:
+        raise model.DoesNotExist(f'{model.__name__} {pk!r} does not exist.')
+    cache = get_cache(model)
+    instance = cache.get(object_id)
+    if instance is None:
+        instance = model.objects.get(pk=object_id)
+        cache.set(object_id, instance)
+    return copy.copy(instance)
+
+
+def get_many(model, pks):
+    """Map each id in ``pks`` that exists (as a string) to its ``model`` instance."""
+    cache = get_cache(model)
+    found, missing = {}, []
+    for pk in set(pks):
+        object_id = _object_id(pk)
+        if object_id is None:
+            continue
+        instance = cache.get(object_id)
+        if instance is None:
+            missing.append(object_id)
+        else:
+            found[str(object_id)] = copy.copy(instance)
+    if missing:
+        for instance in model.objects.filter(pk__in=missing):
+            cache.set(instance.pk, instance)
+            found[str(instance.pk)] = copy.copy(instance)
+    return found
+
+
+def evict(sender, instance, **kwargs):
+    """``post_save``/``post_delete`` receiver dropping a changed instance."""
+    if instance.pk is not None:
+        get_cache(sender).discard(instance.pk)
+
+
+def stats():
+    """Counters of every model's cache, by collection."""
+    return {model._meta.db_table: get_cache(model).stats() for model in MODELS}
+
+
+def clear():
+    """Empty every cache and reset its counters (used by tests)."""
+    for model in MODELS:
+        get_cache(model).clear()
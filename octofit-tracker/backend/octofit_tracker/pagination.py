@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from .models import Activity
+
+
+class ActivityCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the activity feed, newest first.
+
+    Pages are fetched with a range filter on ``date`` (``_id`` breaks ties)
+    instead of skip/limit, and no total ``count()`` is run, so deep pages
+    cost the same as the first one. ``next``/``previous`` are opaque cursors.
+    """
+    ordering = ('-date', '-_id')
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            # Raw documents are keyed by column, not field name
+            name = ordering[0].lstrip('-')
+            return str(instance[Activity._meta.get_field(name).column])
+        return super()._get_position_from_instance(instance, ordering)
+
+
+class RollupPagination(PageNumberPagination):
+    """Large pages so a dashboard series comes back in one request."""
+    page_size = 400
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
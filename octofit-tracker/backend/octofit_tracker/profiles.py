@@ -0,0 +1,109 @@
+"""
+User profile summaries.
+
+``user_summary`` answers everything a profile page shows about a user's
+activity with one aggregation: a ``$match`` on the user's slice of the
+``user_id``/``date`` index feeding a ``$facet`` that computes totals, the
+per-type breakdown, personal bests and the most recent activities side by
+side. The ``$facet`` emits one document even for a user with no
+activities, and an uncorrelated ``$lookup`` on it adds the user's
+leaderboard entry.
+"""
+from .fields import decoded
+from .models import Activity, Leaderboard
+from .serializers import ActivityDocumentSerializer, utc_isoformat
+
+RECENT_ACTIVITIES = 10
+
+
+def _sums():
+    return {
+        'activities': {'$sum': 1},
+        'calories_burned': {'$sum': decoded(Activity, 'calories_burned')},
+        'duration': {'$sum': decoded(Activity, 'duration')},
+        'distance': {'$sum': decoded(Activity, 'distance')},
+    }
+
+
+def _best(name):
+    """Facet yielding the activity with the highest ``name``, if any has one."""
+    column = Activity._meta.get_field(name).column
+    return [
+        {'$match': {column: {'$ne': None}}},
+        {'$sort': {column: -1, '_id': -1}},
+        {'$limit': 1},
+        {'$project': ActivityDocumentSerializer.projection()},
+    ]
+
+
+def summary_pipeline(user_id, recent=RECENT_ACTIVITIES):
+    user_field = Activity._meta.get_field('user_id')
+    date = Activity._meta.get_field('date').column
+    return [
+        {'$match': {user_field.column: user_field.get_prep_value(user_id)}},
+        {'$facet': {
+            'totals': [
+                {'$group': dict(
+                    _sums(),
+                    _id=None,
+                    first_activity={'$min': decoded(Activity, 'date')},
+                    last_activity={'$max': decoded(Activity, 'date')},
+                )},
+            ],
+            'by_type': [
+                {'$group': dict(_sums(), _id=decoded(Activity, 'activity_type'))},
+                {'$sort': {'activities': -1, '_id': 1}},
+            ],
+            'longest_distance': _best('distance'),
+            'most_calories': _best('calories_burned'),
+            'recent_activities': [
+                {'$sort': {date: -1, '_id': -1}},
+                {'$limit': recent},
+                {'$project': ActivityDocumentSerializer.projection()},
+            ],
+        }},
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'pipeline': [
+                {'$match': {'user_id': user_id}},
+                {'$project': {'_id': 0, 'rank': 1, 'total_calories': 1, 'total_activities': 1}},
+            ],
+            'as': 'leaderboard',
+        }},
+    ]
+
+
+def _totals(group):
+    return {
+        'activities': group['activities'],
+        'calories_burned': group['calories_burned'],
+        'duration': group['duration'],
+        'distance': round(group['distance'], 3),
+    }
+
+
+def user_summary(user_id, recent=RECENT_ACTIVITIES):
+    """Totals, per-type breakdown, personal bests, recent activities and rank for one user."""
+    result = next(Activity.objects.mongo_aggregate(summary_pipeline(user_id, recent)))
+    serializer = ActivityDocumentSerializer()
+
+    def best(documents):
+        return serializer.to_representation(documents[0]) if documents else None
+
+    totals = {'activities': 0, 'calories_burned': 0, 'duration': 0, 'distance': 0.0,
+              'first_activity': None, 'last_activity': None}
+    if result['totals']:
+        group = result['totals'][0]
+        totals.update(_totals(group))
+        totals['first_activity'] = utc_isoformat(group['first_activity'])
+        totals['last_activity'] = utc_isoformat(group['last_activity'])
+    return {
+        'totals': totals,
+        'by_type': [dict(activity_type=group['_id'], **_totals(group)) for group in result['by_type']],
+        'personal_bests': {
+            'longest_distance': best(result['longest_distance']),
+            'most_calories': best(result['most_calories']),
+        },
+        'recent_activities': [serializer.to_representation(document) for document in result['recent_activities']],
+        'leaderboard': result['leaderboard'][0] if result['leaderboard'] else None,
+    }
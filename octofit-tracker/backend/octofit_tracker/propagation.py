@@ -0,0 +1,124 @@
+"""
+Propagation of denormalized user fields.
+
+Activities copy their user's name, and leaderboard entries (all-time and
+materialized windows) copy name and team, so reads need no join. When a
+user is renamed or changes team, ``UserViewSet`` enqueues a
+``propagate_user`` job instead of rewriting the copies in the request; the
+job reads the user's current values, so coalesced triggers converge on the
+latest ones. ``reconcile_users`` finds and repairs drift for every user in
+batches, and in the team rollups, which credit each user's current team.
+Until the compact activity schema is switched on, the compact copies
+``migrate_activities`` made are kept current as well.
+"""
+from bson import ObjectId
+from pymongo import UpdateMany
+
+from .cache import bump_version
+from .fields import decoded
+from .models import (
+    User, Activity, ActivityRollup, CompactActivity, LegacyActivity, Leaderboard, LeaderboardWindow,
+)
+from .rollups import all_teams, repair_team_rollups
+
+# model -> the user fields it copies, by field name
+COPIES = (
+    (Activity, {'user_name': 'name'}),
+    (Leaderboard, {'user_name': 'name', 'team': 'team'}),
+    (LeaderboardWindow, {'user_name': 'name', 'team': 'team'}),
+)
+# Legacy activity writes are mirrored to activities_v2; so are these rewrites
+COMPACT_ACTIVITY_COPIES = ((CompactActivity, {'user_name': 'name'}),)
+if Activity is LegacyActivity:
+    COPIES += COMPACT_ACTIVITY_COPIES
+
+
+def expected_values(model, user, copied):
+    """The values, by column, ``model``'s ``copied`` fields should hold for ``user``."""
+    values = {}
+    for name, user_field in copied.items():
+        values[model._meta.get_field(name).column] = user.get(user_field) or ''
+    return values
+
+
+def _drift_filter(model, user_id, values):
+    field = model._meta.get_field('user_id')
+    return {
+        field.column: field.get_prep_value(user_id),
+        '$or': [{column: {'$ne': value}} for column, value in values.items()],
+    }
+
+
+def propagate_user(user_id):
+    """Rewrite every stale copy of one user's fields; return the counts."""
+    user = User.objects.mongo_find_one({'_id': ObjectId(user_id)}, {'name': 1, 'team': 1})
+    if user is None:
+        return {}
+    counts = {}
+    for model, copied in COPIES:
+        values = expected_values(model, user, copied)
+        result = model.objects.mongo_update_many(_drift_filter(model, user_id, values), {'$set': values})
+        counts[model._meta.db_table] = result.modified_count
+        if result.modified_count:
+            bump_version(model)
+    return counts
+
+
+def find_drift(model, copied, users):
+    """
+    Map each user id in ``users`` (id -> user document) whose copies in
+    ``model`` are stale to the number of stale documents, with one
+    aggregation.
+    """
+    user_field = model._meta.get_field('user_id')
+    group_id = {'user_id': decoded(model, 'user_id')}
+    group_id.update({model._meta.get_field(name).column: decoded(model, name) for name in copied})
+    stale = {}
+    rows = model.objects.mongo_aggregate([
+        {'$match': {user_field.column: {'$in': [user_field.get_prep_value(user_id) for user_id in users]}}},
+        {'$group': {'_id': group_id, 'documents': {'$sum': 1}}},
+    ])
+    for row in rows:
+        user_id = row['_id']['user_id']
+        values = expected_values(model, users[user_id], copied)
+        if any(row['_id'].get(column) != value for column, value in values.items()):
+            stale[user_id] = stale.get(user_id, 0) + row['documents']
+    return stale
+
+
+def reconcile_users(batch_size=1000, dry_run=False, copies=COPIES, team_rollups=True):
+    """
+    Compare every copy (by default, in all of ``COPIES``) with its user, a
+    batch of users at a time, and repair the stale ones with one unordered
+    ``bulk_write`` of ``update_many`` calls per collection and batch. With
+    ``team_rollups``, team buckets that no longer sum their members' user
+    buckets are repaired too (see ``rollups.repair_team_rollups``).
+    Returns the number of stale documents found per collection.
+    """
+    totals = {model._meta.db_table: 0 for model, _ in copies}
+    cursor = User.objects.mongo_find({}, {'name': 1, 'team': 1}).sort('_id', 1).batch_size(batch_size)
+    batch = {}
+    for user in cursor:
+        batch[str(user['_id'])] = user
+        if len(batch) >= batch_size:
+            _reconcile_batch(batch, totals, dry_run, copies)
+            batch = {}
+    if batch:
+        _reconcile_batch(batch, totals, dry_run, copies)
+    if team_rollups:
+        totals[ActivityRollup._meta.db_table] = repair_team_rollups(all_teams(), dry_run=dry_run)
+    return totals
+
+
+def _reconcile_batch(users, totals, dry_run, copies):
+    for model, copied in copies:
+        stale = find_drift(model, copied, users)
+        totals[model._meta.db_table] += sum(stale.values())
+        if not stale or dry_run:
+            continue
+        operations = []
+        for user_id in stale:
+            values = expected_values(model, users[user_id], copied)
+            operations.append(UpdateMany(_drift_filter(model, user_id, values), {'$set': values}))
+        model.objects.mongo_bulk_write(operations, ordered=False)
+        bump_version(model)
@@ -0,0 +1,302 @@
+"""
+Daily and weekly activity rollups.
+
+Each activity contributes to four ``activity_rollups`` documents: its user's
+and its team's bucket for the day and for the ISO week. Writes fold a batch
+of activities into one ``$inc`` upsert per bucket, sent in a single
+``bulk_write``. ``rebuild_rollups`` recomputes the collection from scratch
+with one aggregation.
+
+A rebuild's ``$out`` would drop a ``$inc`` made while it runs, or count a
+write twice, so it holds the ``rollups:rebuild`` lease (see ``locks``)
+throughout, as does a team repair. Writes check the lease before and after
+their ``$inc``: one that finds it held leaves its buckets to a follow-up
+``rebuild_rollups`` job, which recomputes them from the activities either
+way.
+
+Both paths credit team buckets to the user's current team, read from
+``users``. When a user changes team, ``UserViewSet`` enqueues a
+``repair_team_rollups`` job for the old and new team, which recomputes
+their buckets from their current members' user buckets, as a rebuild
+would, and rewrites the ones that differ. ``reconcile_users`` runs the same
+repair over every team.
+"""
+import datetime
+from collections import defaultdict
+
+from bson import ObjectId
+from django.utils import timezone
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from .cache import bump_version
+from .fields import decoded
+from .locks import held, lease
+from .models import User, Activity, ActivityRollup
+
+PERIODS = ('day', 'week')
+SCOPES = ('user', 'team')
+TOTALS = ('calories_burned', 'duration', 'distance', 'activities')
+REBUILD_LOCK = 'rollups:rebuild'
+REBUILD_LOCK_WAIT_SECONDS = 60
+REBUILD_DELAY_SECONDS = 5
+
+
+def bucket_start(moment, period):
+    """Start of the UTC day or ISO week (Monday) containing ``moment``."""
+    if timezone.is_aware(moment):
+        moment = timezone.make_naive(moment, datetime.timezone.utc)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+
+def type_key(activity_type):
+    """Make an activity type safe to use as a sub-document key."""
+    return activity_type.replace('.', '_').lstrip('$') or '_'
+
+
+def type_key_expression(activity_type):
+    """``type_key`` as an aggregation expression on ``activity_type``."""
+    return {'$let': {
+        'vars': {'key': {'$ltrim': {
+            'input': {'$replaceAll': {'input': activity_type, 'find': '.', 'replacement': '_'}},
+            'chars': {'$literal': '$'},
+        }}},
+        'in': {'$cond': [{'$eq': ['$$key', '']}, '_', '$$key']},
+    }}
+
+
+def _schedule_rebuild():
+    """Run ``rebuild_rollups`` again once the running rebuild is done."""
+    from .jobs import enqueue  # jobs imports this module
+
+    enqueue('rebuild_rollups', delay=REBUILD_DELAY_SECONDS)
+
+
+def user_teams(user_ids):
+    """
+    Map each user id to its current team with one query on ``users``, the
+    source ``rebuild_rollups`` joins, rather than through the possibly stale
+    ``objectcache``.
+    """
+    ids = [ObjectId(user_id) for user_id in set(user_ids) if ObjectId.is_valid(user_id)]
+    if not ids:
+        return {}
+    users = User.objects.mongo_find({'_id': {'$in': ids}}, {'team': 1})
+    return {str(user['_id']): user.get('team') for user in users}
+
+
+def apply_rollup_deltas(changes):
+    """
+    Fold ``(activity, sign)`` pairs into the rollup buckets they touch and
+    write them with one unordered ``bulk_write``.
+    """
+    if not changes:
+        return
+    if held(REBUILD_LOCK):
+        _schedule_rebuild()
+        return
+    teams = user_teams(activity.user_id for activity, _ in changes)
+    buckets = defaultdict(lambda: defaultdict(float))
+    for activity, sign in changes:
+        keys = [('user', activity.user_id)]
+        if teams.get(activity.user_id):
+            keys.append(('team', teams[activity.user_id]))
+        for scope, key in keys:
+            for period in PERIODS:
+                totals = buckets[(scope, key, period, bucket_start(activity.date, period))]
+                totals['calories_burned'] += sign * activity.calories_burned
+                totals['duration'] += sign * activity.duration
+                totals['distance'] += sign * (activity.distance or 0)
+                totals['activities'] += sign
+                totals[f'by_type.{type_key(activity.activity_type)}'] += sign
+
+    operations = []
+    for (scope, key, period, bucket), totals in buckets.items():
+        increments = {
+            field: value if field == 'distance' else int(value)
+            for field, value in totals.items() if value
+        }
+        if increments:
+            operations.append(UpdateOne(
+                {'scope': scope, 'key': key, 'period': period, 'bucket': bucket},
+                {'$inc': increments},
+                upsert=True,
+            ))
+    if operations:
+        ActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+        if held(REBUILD_LOCK):
+            # A rebuild started meanwhile may have dropped or also counted these
+            _schedule_rebuild()
+        bump_version(ActivityRollup)
+
+
+def team_buckets(team):
+    """
+    ``team``'s buckets as the user buckets of its current members sum up,
+    keyed by ``(period, bucket)``.
+    """
+    members = [str(user['_id']) for user in User.objects.mongo_find({'team': team}, {'_id': 1})]
+    buckets = defaultdict(lambda: {**dict.fromkeys(TOTALS, 0), 'by_type': defaultdict(int)})
+    if not members:
+        return buckets
+    for rollup in ActivityRollup.objects.mongo_find({'scope': 'user', 'key': {'$in': members}}):
+        totals = buckets[(rollup['period'], rollup['bucket'])]
+        for field in TOTALS:
+            totals[field] += rollup.get(field) or 0
+        for activity_type, count in (rollup.get('by_type') or {}).items():
+            totals['by_type'][activity_type] += count
+    return buckets
+
+
+def _summary(rollup):
+    """The totals of a rollup document, comparable whatever their history."""
+    return (
+        *(round(rollup.get(field) or 0, 6) for field in TOTALS),
+        {activity_type: count for activity_type, count in (rollup.get('by_type') or {}).items() if count},
+    )
+
+
+def _team_repairs(team):
+    """The writes that bring ``team``'s stored buckets in line with ``team_buckets``."""
+    expected = team_buckets(team)
+    empty = _summary({})
+    operations = []
+    for rollup in ActivityRollup.objects.mongo_find({'scope': 'team', 'key': team}):
+        totals = expected.pop((rollup['period'], rollup['bucket']), None)
+        if totals is None:
+            # No current member has activities in this bucket
+            operations.append(DeleteOne({'_id': rollup['_id']}))
+        elif _summary(rollup) != _summary(totals):
+            operations.append(ReplaceOne({'_id': rollup['_id']}, _team_document(team, rollup, totals)))
+    for (period, bucket), totals in expected.items():
+        if _summary(totals) != empty:
+            key = {'scope': 'team', 'key': team, 'period': period, 'bucket': bucket}
+            operations.append(ReplaceOne(key, _team_document(team, key, totals), upsert=True))
+    return operations
+
+
+def _team_document(team, rollup, totals):
+    return {
+        'scope': 'team',
+        'key': team,
+        'period': rollup['period'],
+        'bucket': rollup['bucket'],
+        **{field: totals[field] for field in TOTALS},
+        'by_type': {activity_type: count for activity_type, count in totals['by_type'].items() if count},
+    }
+
+
+def repair_team_rollups(teams, dry_run=False):
+    """
+    Recompute the buckets of each of ``teams`` from its current members'
+    user buckets and rewrite, add or delete the ones that differ, under the
+    rebuild lease. Returns the number of stale buckets; a dry run only
+    counts them.
+    """
+    if dry_run:
+        return sum(len(_team_repairs(team)) for team in teams)
+    repaired = 0
+    with lease(REBUILD_LOCK, REBUILD_LOCK_WAIT_SECONDS, renew=True) as locked:
+        if not locked:
+            raise RuntimeError('The rollup rebuild lock is busy')
+        for team in teams:
+            operations = _team_repairs(team)
+            if operations:
+                ActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+                repaired += len(operations)
+    if repaired:
+        bump_version(ActivityRollup)
+    return repaired
+
+
+def all_teams():
+    """Every team a user is on or a team bucket is kept for."""
+    teams = set(User.objects.mongo_distinct('team'))
+    teams.update(ActivityRollup.objects.mongo_distinct('key', {'scope': 'team'}))
+    return sorted(team for team in teams if team)
+
+
+def _rollup_stages(scope, period):
+    """Aggregation stages producing the ``scope``/``period`` rollups."""
+    date = decoded(Activity, 'date')
+    unit = {'date': date, 'unit': 'day'}
+    if period == 'week':
+        unit = {'date': date, 'unit': 'week', 'startOfWeek': 'monday'}
+    stages = []
+    if scope == 'team':
+        stages += [
+            {'$addFields': {'user_oid': {
+                '$convert': {
+                    'input': decoded(Activity, 'user_id'), 'to': 'objectId', 'onError': None, 'onNull': None,
+                },
+            }}},
+            {'$lookup': {
+                'from': User._meta.db_table,
+                'localField': 'user_oid',
+                'foreignField': '_id',
+                'as': 'user',
+            }},
+            {'$addFields': {'team': {'$arrayElemAt': ['$user.team', 0]}}},
+            {'$match': {'team': {'$nin': [None, '']}}},
+        ]
+    stages += [
+        {'$group': {
+            '_id': {
+                'key': decoded(Activity, 'user_id') if scope == 'user' else '$team',
+                'bucket': {'$dateTrunc': unit},
+                'type': type_key_expression(decoded(Activity, 'activity_type')),
+            },
+            'calories_burned': {'$sum': decoded(Activity, 'calories_burned')},
+            'duration': {'$sum': decoded(Activity, 'duration')},
+            'distance': {'$sum': {'$ifNull': [decoded(Activity, 'distance'), 0]}},
+            'activities': {'$sum': 1},
+        }},
+        {'$group': {
+            '_id': {'key': '$_id.key', 'bucket': '$_id.bucket'},
+            'calories_burned': {'$sum': '$calories_burned'},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': '$distance'},
+            'activities': {'$sum': '$activities'},
+            'by_type': {'$push': {'k': '$_id.type', 'v': '$activities'}},
+        }},
+        {'$project': {
+            '_id': 0,
+            'scope': {'$literal': scope},
+            'key': '$_id.key',
+            'period': {'$literal': period},
+            'bucket': '$_id.bucket',
+            'calories_burned': 1,
+            'duration': 1,
+            'distance': 1,
+            'activities': 1,
+            'by_type': {'$arrayToObject': '$by_type'},
+        }},
+    ]
+    return stages
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup from ``activities`` and return the document count.
+
+    All four scope/period groupings are unioned into one pipeline whose
+    ``$out`` atomically replaces the collection, keeping its indexes. Runs
+    under the rebuild lease; raises ``RuntimeError`` if another rebuild
+    holds it for longer than ``REBUILD_LOCK_WAIT_SECONDS``.
+    """
+    combos = [(scope, period) for scope in SCOPES for period in PERIODS]
+    pipeline = _rollup_stages(*combos[0])
+    for scope, period in combos[1:]:
+        pipeline.append({'$unionWith': {
+            'coll': Activity._meta.db_table,
+            'pipeline': _rollup_stages(scope, period),
+        }})
+    pipeline.append({'$out': ActivityRollup._meta.db_table})
+    with lease(REBUILD_LOCK, REBUILD_LOCK_WAIT_SECONDS, renew=True) as locked:
+        if not locked:
+            raise RuntimeError('The rollup rebuild lock is busy')
+        Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+    bump_version(ActivityRollup)
+    return ActivityRollup.objects.mongo_estimated_document_count()
@@ -1,5 +1,11 @@
-from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+import datetime
+
+from django.conf import settings
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .fields import EncodedField
+from .metrics import timed
+from .models import User, Team, Activity, Leaderboard, Workout, ActivityRollup, LeaderboardWindow, Job
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -59,3 +65,225 @@ class WorkoutSerializer(serializers.ModelSerializer):
     
     def get_id(self, obj):
         return str(obj._id)
+
+
+class ActivityRollupSerializer(serializers.ModelSerializer):
+    id = serializers.SerializerMethodField()
+    by_type = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    
+    class Meta:
+        model = ActivityRollup
+        fields = ['id', 'scope', 'key', 'period', 'bucket', 'calories_burned',
+                  'duration', 'distance', 'activities', 'by_type']
+    
+    def get_id(self, obj):
+        return str(obj._id)
+
+
+class LeaderboardWindowSerializer(serializers.ModelSerializer):
+    
+    class Meta:
+        model = LeaderboardWindow
+        fields = ['user_id', 'user_name', 'team', 'total_calories',
+                  'total_activities', 'rank']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    id = serializers.SerializerMethodField()
+    args = serializers.JSONField(read_only=True)
+    result = serializers.JSONField(read_only=True)
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'args', 'status', 'triggers', 'attempts', 'run_after',
+                  'created_at', 'started_at', 'finished_at', 'worker', 'result', 'error']
+    
+    def get_id(self, obj):
+        return str(obj._id)
+
+
+# DRF field types whose to_representation is a plain type cast. Compiled
+# serializers call the cast directly instead of going through the field.
+FIELD_CASTS = {
+    serializers.CharField: str,
+    serializers.EmailField: str,
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+}
+
+
+def utc_isoformat(value):
+    """DRF's ISO 8601 rendering of a datetime, specialised for a UTC site."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    else:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.isoformat()[:-6] + 'Z'
+
+
+def field_converter(field):
+    """Return the cheapest callable equivalent to ``field.to_representation``."""
+    if type(field) in FIELD_CASTS:
+        return FIELD_CASTS[type(field)]
+    if (
+        isinstance(field, serializers.DateTimeField)
+        and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+        and getattr(field, 'timezone', None) is None
+        and settings.USE_TZ and settings.TIME_ZONE == 'UTC'
+    ):
+        return utc_isoformat
+    return field.to_representation
+
+
+def check_fields(names, available):
+    """Raise a 400 naming any of ``names`` not in ``available``."""
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise serializers.ValidationError({'fields': [
+            f'Unknown field(s): {", ".join(unknown)}. Available: {", ".join(available)}.'
+        ]})
+
+
+class MeasuredListSerializer(serializers.ListSerializer):
+    """Counts building ``.data`` towards the request's serialization time."""
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+
+class CompiledSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer compiled from ``model_serializer``.
+
+    The readable fields are resolved once per class into ``(name, key,
+    convert)`` steps, so rendering a row is a loop of lookups and casts
+    instead of DRF's per-field machinery. Output is identical to
+    ``model_serializer``.
+    """
+    model_serializer = None
+
+    class Meta:
+        list_serializer_class = MeasuredListSerializer
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+    @classmethod
+    def field_plan(cls):
+        """Return ``(name, key, convert)`` for every readable field, once per class."""
+        plan = cls.__dict__.get('_field_plan')
+        if plan is None:
+            plan = []
+            for name, field in cls.model_serializer().fields.items():
+                if field.write_only:
+                    continue
+                plan.append(cls.compile_field(name, field))
+            cls._field_plan = plan
+        return plan
+
+    @classmethod
+    def for_fields(cls, names):
+        """
+        A subclass rendering only ``names``, in declaration order. Its
+        ``projection()`` narrows to match. Subclasses are cached per set.
+        """
+        plan = cls.field_plan()
+        check_fields(names, [name for name, _, _ in plan])
+        subsets = cls.__dict__.get('_subsets')
+        if subsets is None:
+            subsets = cls._subsets = {}
+        selected = frozenset(names)
+        subset = subsets.get(selected)
+        if subset is None:
+            subset = subsets[selected] = type(cls.__name__, (cls,), {
+                '_field_plan': [step for step in plan if step[0] in selected],
+            })
+        return subset
+
+    @classmethod
+    def compile_field(cls, name, field):
+        model = cls.model_serializer.Meta.model
+        if name == 'id':
+            return name, cls.field_key(model._meta.pk), str
+        return name, cls.field_key(model._meta.get_field(field.source)), field_converter(field)
+
+    @classmethod
+    def field_key(cls, model_field):
+        return model_field.attname
+
+    def read(self, obj, key):
+        return getattr(obj, key)
+
+    def to_representation(self, obj):
+        data = {}
+        read = self.read
+        for name, key, convert in self.field_plan():
+            value = read(obj, key)
+            data[name] = None if value is None else convert(value)
+        return data
+
+
+class DocumentSerializer(CompiledSerializer):
+    """
+    Compiled serializer for raw Mongo documents.
+
+    Renders a document exactly as ``model_serializer`` renders the matching
+    model instance, decoding the values of compactly stored fields.
+    """
+
+    @classmethod
+    def compile_field(cls, name, field):
+        name, key, convert = super().compile_field(name, field)
+        if name != 'id':
+            model_field = cls.model_serializer.Meta.model._meta.get_field(field.source)
+            if isinstance(model_field, EncodedField):
+                decode = model_field.decode
+                return name, key, lambda value: convert(decode(value))
+        return name, key, convert
+
+    @classmethod
+    def field_key(cls, model_field):
+        return model_field.column
+
+    @classmethod
+    def projection(cls):
+        return {key: 1 for _, key, _ in cls.field_plan()}
+
+    def read(self, obj, key):
+        return obj.get(key)
+
+
+class UserCompiledSerializer(CompiledSerializer):
+    model_serializer = UserSerializer
+
+
+class TeamCompiledSerializer(CompiledSerializer):
+    model_serializer = TeamSerializer
+
+
+class WorkoutCompiledSerializer(CompiledSerializer):
+    model_serializer = WorkoutSerializer
+
+
+class ActivityDocumentSerializer(DocumentSerializer):
+    model_serializer = ActivitySerializer
+
+
+class LeaderboardDocumentSerializer(DocumentSerializer):
+    model_serializer = LeaderboardSerializer
+
+
+class ActivityRollupDocumentSerializer(DocumentSerializer):
+    model_serializer = ActivityRollupSerializer
+
+
+class LeaderboardWindowDocumentSerializer(DocumentSerializer):
+    model_serializer = LeaderboardWindowSerializer
+
+
+class JobDocumentSerializer(DocumentSerializer):
+    model_serializer = JobSerializer
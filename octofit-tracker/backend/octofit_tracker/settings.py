@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -93,6 +94,8 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+# Requires MongoDB 5.0 or later ($setWindowFields, $unionWith, $merge);
+# "manage.py check --database default" verifies the server version.
 
 DATABASES = {
     'default': {
@@ -106,6 +109,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local memory by default; point BACKEND at Redis/Memcached to share the
+# response cache between processes. Either way cached responses are keyed by
+# version stamps kept in Mongo (octofit_tracker.cache), so a write in one
+# process invalidates them in all, within OCTOFIT_CACHE_VERSION_TIMEOUT.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit',
+    }
+}
+
+# Seconds a cached API response may be served before it is rebuilt, even
+# without a write to the underlying model.
+OCTOFIT_RESPONSE_CACHE_TIMEOUT = 300
+
+# Seconds a process reuses a model's version stamp from the cache above
+# before reading it from Mongo again. With a shared cache backend bumps are
+# seen at once; with a per-process one this bounds how long another
+# process may serve responses built before a write.
+OCTOFIT_CACHE_VERSION_TIMEOUT = 2
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -176,4 +204,69 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
+
+# Render list/retrieve responses with the compiled read-only serializers
+# instead of DRF's per-field ModelSerializer machinery.
+OCTOFIT_FAST_SERIALIZATION = True
+
+# Log requests slower than this (in milliseconds) with their Mongo command
+# breakdown to the "octofit_tracker.slow_requests" logger; None disables.
+OCTOFIT_SLOW_REQUEST_MS = 500
+
+# Client addresses (REMOTE_ADDR) allowed to scrape /metrics; staff users
+# always are. Behind a proxy, list the address it connects from.
+OCTOFIT_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Threads serving the blocking part of the async read endpoints
+# (/api/async/...). Each holds one MongoClient.
+OCTOFIT_ASYNC_READ_THREADS = 32
+
+# Seconds an activity write waits for the leaderboard re-ranking lock before
+# it only updates totals and leaves the ranks to a rerank_leaderboard job.
+OCTOFIT_RANK_LOCK_WAIT_SECONDS = 2.0
+
+# Background jobs (octofit_tracker.jobs). With OCTOFIT_JOBS_IN_PROCESS each
+# web process runs due jobs on a small thread pool; turn it off to leave
+# them to a dedicated "manage.py jobs --work" process.
+OCTOFIT_JOBS_IN_PROCESS = True
+OCTOFIT_JOB_WORKERS = 2
+OCTOFIT_JOB_POLL_SECONDS = 1.0
+# Triggers within this many seconds of the first coalesce into one run
+OCTOFIT_JOB_DEBOUNCE_SECONDS = 1.0
+OCTOFIT_JOB_MAX_ATTEMPTS = 3
+OCTOFIT_JOB_TIMEOUT_SECONDS = 600
+
+# Buffered activity ingestion (octofit_tracker.buffer). When on, POST
+# /api/activities/ answers 202 and activities are written with insert_many
+# every OCTOFIT_INGEST_BATCH_SIZE activities or OCTOFIT_INGEST_FLUSH_MS.
+OCTOFIT_INGEST_BUFFERED = False
+OCTOFIT_INGEST_BATCH_SIZE = 500
+OCTOFIT_INGEST_FLUSH_MS = 50
+# Backpressure: a POST that finds OCTOFIT_INGEST_MAX_PENDING activities
+# buffered waits OCTOFIT_INGEST_BLOCK_SECONDS for room, then gets a 429.
+OCTOFIT_INGEST_MAX_PENDING = 10000
+OCTOFIT_INGEST_BLOCK_SECONDS = 1.0
+# A batch whose insert fails is requeued and retried after
+# OCTOFIT_INGEST_RETRY_SECONDS, doubling up to OCTOFIT_INGEST_RETRY_MAX_SECONDS.
+# On exit, what is still unwritten after OCTOFIT_INGEST_EXIT_RETRY_SECONDS is
+# spilled as Extended JSON to OCTOFIT_INGEST_SPILL_DIR for mongoimport.
+OCTOFIT_INGEST_RETRY_SECONDS = 0.5
+OCTOFIT_INGEST_RETRY_MAX_SECONDS = 30
+OCTOFIT_INGEST_EXIT_RETRY_SECONDS = 10
+OCTOFIT_INGEST_SPILL_DIR = BASE_DIR / 'ingest-spill'
+
+# In-process cache of users, teams and workouts by id (octofit_tracker.objectcache):
+# entries per model, and seconds before an entry is re-read from Mongo.
+OCTOFIT_OBJECT_CACHE_SIZE = 10000
+OCTOFIT_OBJECT_CACHE_TTL = 30
+
+# Store activities in the compact activities_v2 schema (octofit_tracker.activity_migration).
+# Until it is on, activities live in the legacy collection and every write is
+# mirrored to activities_v2. Turn it on everywhere only once
+# "manage.py migrate_activities" has finished.
+OCTOFIT_COMPACT_ACTIVITIES = False
@@ -0,0 +1,137 @@
+"""
+Deterministic synthetic data for load and performance testing.
+
+Every generator takes a ``random.Random``, so a seed and a fixed ``now``
+reproduce the same dataset, ids included. Documents have the shape djongo
+stores (activities in the schema ``Activity`` uses). Generators are lazy;
+``insert_batched`` streams them into Mongo with ``insert_many`` so memory is
+bounded by the batch size, not the dataset. ``insert_activities_batched``
+does the same through ``ingest.write_documents``, which keeps the compact
+activity mirror current.
+"""
+import datetime
+import itertools
+import math
+
+from bson import ObjectId
+
+from .fields import EncodedField, encode_document
+from .ingest import write_documents
+from .models import Activity
+
+FIRST_NAMES = [
+    'Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie',
+    'Avery', 'Quinn', 'Harper', 'Rowan', 'Skyler', 'Emerson', 'Dakota', 'Reese',
+]
+LAST_NAMES = [
+    'Stark', 'Rogers', 'Banner', 'Romanoff', 'Kent', 'Wayne', 'Prince', 'Allen',
+    'Curry', 'Parker', 'Strange', 'Maximoff', 'Jordan', 'Queen', 'Lance', 'Stone',
+]
+
+# activity_type: (relative frequency, median minutes, kcal per minute, km/h or None)
+ACTIVITY_PROFILES = {
+    'Running': (30, 40, 11.0, 10.0),
+    'Cycling': (20, 60, 8.0, 22.0),
+    'Swimming': (8, 35, 9.0, 2.5),
+    'Weightlifting': (16, 50, 6.0, None),
+    'Yoga': (12, 45, 3.5, None),
+    'Boxing': (6, 45, 10.0, None),
+    'HIIT': (8, 25, 12.5, None),
+}
+ACTIVITY_TYPES = list(ACTIVITY_PROFILES)
+ACTIVITY_WEIGHTS = list(itertools.accumulate(p[0] for p in ACTIVITY_PROFILES.values()))
+
+
+def object_id(rng):
+    """An ObjectId drawn from ``rng`` so ids are reproducible too."""
+    return ObjectId(rng.randbytes(12))
+
+
+def generate_teams(rng, count):
+    for i in range(count):
+        yield {
+            '_id': object_id(rng),
+            'name': f'Team {i + 1:03d}',
+            'description': f'Synthetic team #{i + 1}',
+            'created_at': datetime.datetime(2024, 1, 1),
+        }
+
+
+def generate_users(rng, count, teams, now):
+    """Users spread over teams with a long tail of unaffiliated users."""
+    for i in range(count):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        yield {
+            '_id': object_id(rng),
+            'name': name,
+            'email': f'user{i}@octofit.example',
+            'password': 'synthetic',
+            'team': rng.choice(teams) if teams and rng.random() < 0.9 else None,
+            'created_at': now - datetime.timedelta(seconds=rng.randint(0, 365 * 86400)),
+        }
+
+
+def generate_activities(rng, user, mean_count, now, days=365):
+    """
+    A user's activities over the last ``days``: a skewed per-user count
+    around ``mean_count``, log-normal durations and type-dependent calories
+    and distances.
+    """
+    count = max(0, int(rng.lognormvariate(math.log(max(mean_count, 1)), 0.5)))
+    user_id, user_name = str(user['_id']), user['name']
+    for _ in range(count):
+        activity_type = rng.choices(ACTIVITY_TYPES, cum_weights=ACTIVITY_WEIGHTS)[0]
+        _, median, kcal_per_minute, speed = ACTIVITY_PROFILES[activity_type]
+        duration = max(5, min(240, int(rng.lognormvariate(math.log(median), 0.35))))
+        calories = int(duration * kcal_per_minute * rng.uniform(0.8, 1.2))
+        distance = None
+        if speed is not None:
+            distance = round(duration / 60 * speed * rng.uniform(0.8, 1.2), 2)
+        moment = now - datetime.timedelta(seconds=rng.randint(0, days * 86400))
+        yield encode_document(Activity, {
+            '_id': object_id(rng),
+            'user_id': user_id,
+            'user_name': user_name,
+            'activity_type': activity_type,
+            'duration': duration,
+            'calories_burned': calories,
+            'distance': distance,
+            'date': moment.replace(microsecond=moment.microsecond // 1000 * 1000),
+        })
+
+
+def insert_batched(model, documents, batch_size):
+    """Insert ``documents`` lazily in ``insert_many`` batches; return the count."""
+    inserted = 0
+    documents = iter(documents)
+    while True:
+        batch = list(itertools.islice(documents, batch_size))
+        if not batch:
+            return inserted
+        model.objects.mongo_insert_many(batch, ordered=False)
+        inserted += len(batch)
+
+
+def instance_of(model, document):
+    """The unsaved ``model`` instance a stored ``document`` holds."""
+    values = {}
+    for field in model._meta.concrete_fields:
+        value = document.get(field.column)
+        values[field.attname] = field.decode(value) if isinstance(field, EncodedField) else value
+    return model(**values)
+
+
+def insert_activities_batched(documents, batch_size):
+    """
+    Insert activity ``documents`` in batches with ``write_documents``, so
+    legacy writes are mirrored, without touching the aggregates. Returns
+    the count inserted.
+    """
+    inserted = 0
+    documents = iter(documents)
+    while True:
+        batch = list(itertools.islice(documents, batch_size))
+        if not batch:
+            return inserted
+        written, _ = write_documents([instance_of(Activity, document) for document in batch], batch)
+        inserted += len(written)
@@ -0,0 +1,89 @@
+"""
+Team aggregates.
+
+Teams are the free-text ``team`` on users and leaderboard entries. A single
+aggregation over ``leaderboard`` sums each team's calories and activities.
+It is unioned with a member count from ``users``, so a team's totals and
+size come back in one round trip. Both sides filter on the indexed ``team``
+field: one team is a point range, all teams the range of non-empty
+strings, which skips users and entries without a team but still reads
+every one that has one.
+"""
+from .models import User, Leaderboard
+
+# Every non-empty string, as one index range; excludes null, missing and ''
+HAS_TEAM = {'$gt': ''}
+
+
+def _team_pipeline(team=None):
+    match = {'team': team if team is not None else HAS_TEAM}
+    return [
+        {'$match': match},
+        {'$group': {
+            '_id': '$team',
+            'members': {'$sum': 0},
+            'total_calories': {'$sum': '$total_calories'},
+            'total_activities': {'$sum': '$total_activities'},
+        }},
+        {'$unionWith': {
+            'coll': User._meta.db_table,
+            'pipeline': [
+                {'$match': match},
+                {'$group': {
+                    '_id': '$team',
+                    'members': {'$sum': 1},
+                    'total_calories': {'$sum': 0},
+                    'total_activities': {'$sum': 0},
+                }},
+            ],
+        }},
+        {'$group': {
+            '_id': '$_id',
+            'members': {'$sum': '$members'},
+            'total_calories': {'$sum': '$total_calories'},
+            'total_activities': {'$sum': '$total_activities'},
+        }},
+    ]
+
+
+def _project(extra=None):
+    projection = {
+        '_id': 0,
+        'team': '$_id',
+        'members': 1,
+        'total_calories': 1,
+        'average_calories': {'$cond': [
+            {'$gt': ['$members', 0]},
+            {'$round': [{'$divide': ['$total_calories', '$members']}, 1]},
+            0,
+        ]},
+        'total_activities': 1,
+    }
+    projection.update(extra or {})
+    return {'$project': projection}
+
+
+def team_leaderboard():
+    """Every team with its totals, ranked by total calories."""
+    pipeline = _team_pipeline() + [
+        {'$setWindowFields': {
+            'sortBy': {'total_calories': -1, '_id': 1},
+            'output': {'rank': {'$documentNumber': {}}},
+        }},
+        _project({'rank': 1}),
+    ]
+    return list(Leaderboard.objects.mongo_aggregate(pipeline))
+
+
+def team_aggregate(team):
+    """Totals for one team; zeros if nobody is in it yet."""
+    result = list(Leaderboard.objects.mongo_aggregate(_team_pipeline(team) + [_project()]))
+    if result:
+        return result[0]
+    return {
+        'team': team,
+        'members': 0,
+        'total_calories': 0,
+        'average_calories': 0,
+        'total_activities': 0,
+    }
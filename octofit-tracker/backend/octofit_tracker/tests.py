@@ -1,7 +1,38 @@
-from django.test import TestCase
+import json
+import datetime
+import itertools
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from bson import ObjectId
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
+from .admin import ActivityAdmin
+from . import activity_migration, buffer, leaderboard, locks, metrics, objectcache, rollups, teams, windows
+from .buffer import get_buffer
+from .cache import bump_version, get_version
+from .checks import check_mongodb_version
+from .documents import DocumentQuery, database
+from .fields import encode_document
+from .filters import activity_lookups
+from . import jobs
+from .models import (
+    User, Team, Activity, CompactActivity, LegacyActivity, Leaderboard, Workout, ActivityRollup,
+    LeaderboardWindow, Job,
+)
+from .serializers import ActivitySerializer, ActivityDocumentSerializer, LeaderboardSerializer
 
 
 class UserModelTest(TestCase):
@@ -177,6 +208,52 @@ class ActivityAPITest(APITestCase):
         url = '/api/activities/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_list_activities_cursor_pagination(self):
+        """Test activities are paged by cursor without a total count"""
+        for i in range(15):
+            Activity.objects.create(
+                user_id="123",
+                user_name="Test User",
+                activity_type="Running",
+                duration=30,
+                calories_burned=100 + i
+            )
+        first = self.client.get('/api/activities/')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', first.data)
+        self.assertEqual(len(first.data['results']), 10)
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 5)
+        self.assertIsNone(second.data['next'])
+        ids = {a['id'] for a in first.data['results'] + second.data['results']}
+        self.assertEqual(len(ids), 15)
+    
+    def test_bulk_create_activities(self):
+        """Test bulk creation inserts valid items and reports invalid ones"""
+        url = '/api/activities/bulk/'
+        item = {
+            'user_id': '123',
+            'user_name': 'Test User',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300
+        }
+        data = [item, {'user_id': '123'}, dict(item, calories_burned=200)]
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1])
+        self.assertIn('duration', response.data['errors'][0]['errors'])
+        self.assertEqual(Activity.objects.count(), 2)
+        entry = Leaderboard.objects.get(user_id='123')
+        self.assertEqual((entry.total_calories, entry.total_activities), (500, 2))
+    
+    def test_bulk_create_requires_list(self):
+        """Test bulk creation rejects a non-list payload"""
+        response = self.client.post('/api/activities/bulk/', {'user_id': '123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class LeaderboardAPITest(APITestCase):
@@ -224,3 +301,1642 @@ class WorkoutAPITest(APITestCase):
         url = '/api/workouts/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class LeaderboardMaintenanceTest(APITestCase):
+    """Test cases for incremental leaderboard updates on activity writes"""
+    
+    def post_activity(self, user_id, calories):
+        data = {
+            'user_id': user_id,
+            'user_name': f'User {user_id}',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories,
+        }
+        return self.client.post('/api/activities/', data, format='json')
+    
+    def ranks(self):
+        return {e.user_id: e.rank for e in Leaderboard.objects.all()}
+    
+    def test_create_inserts_and_ranks_entries(self):
+        """Test creating activities builds ranked leaderboard entries"""
+        self.post_activity('a', 300)
+        self.post_activity('b', 500)
+        self.post_activity('a', 100)
+        entry = Leaderboard.objects.get(user_id='a')
+        self.assertEqual(entry.total_calories, 400)
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(self.ranks(), {'b': 1, 'a': 2})
+    
+    def test_update_moves_entry_past_neighbours(self):
+        """Test updating calories re-ranks only the crossed entries"""
+        self.post_activity('a', 100)
+        self.post_activity('b', 200)
+        self.post_activity('c', 300)
+        activity_id = self.post_activity('a', 50).data['id']
+        response = self.client.patch(
+            f'/api/activities/{activity_id}/', {'calories_burned': 450}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_id='a').total_calories, 550)
+        self.assertEqual(self.ranks(), {'a': 1, 'c': 2, 'b': 3})
+    
+    def test_delete_retracts_activity(self):
+        """Test deleting an activity lowers totals and rank"""
+        activity_id = self.post_activity('a', 500).data['id']
+        self.post_activity('a', 100)
+        self.post_activity('b', 300)
+        response = self.client.delete(f'/api/activities/{activity_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        entry = Leaderboard.objects.get(user_id='a')
+        self.assertEqual(entry.total_calories, 100)
+        self.assertEqual(entry.total_activities, 1)
+        self.assertEqual(self.ranks(), {'b': 1, 'a': 2})
+    
+    def test_concurrent_first_write_joins_the_entry(self):
+        """Test a first write that loses the upsert race adds to the entry the other inserted"""
+        self.post_activity('a', 100)
+        upsert = Leaderboard.objects.mongo_find_one_and_update
+        
+        def racing_upsert(query, update, **kwargs):
+            if kwargs.get('upsert'):
+                Leaderboard.objects.mongo_insert_one({
+                    'user_id': 'b', 'user_name': 'User b', 'team': '',
+                    'total_calories': 200, 'total_activities': 1, 'rank': 0,
+                })
+                raise DuplicateKeyError('E11000 duplicate key error')
+            return upsert(query, update, **kwargs)
+        
+        with mock.patch.object(Leaderboard.objects, 'mongo_find_one_and_update', racing_upsert):
+            self.post_activity('b', 300)
+        entry = Leaderboard.objects.get(user_id='b')
+        self.assertEqual((entry.total_calories, entry.total_activities), (500, 2))
+        self.assertEqual(self.ranks(), {'b': 1, 'a': 2})
+    
+    def test_unplaced_entries_keep_rank_zero(self):
+        """Test incremental re-ranks leave entries awaiting a re-rank unplaced"""
+        self.post_activity('a', 300)
+        Leaderboard.objects.mongo_insert_one({
+            'user_id': 'u', 'user_name': 'User u', 'team': '',
+            'total_calories': 100, 'total_activities': 1, 'rank': 0,
+        })
+        self.post_activity('b', 200)
+        self.post_activity('b', 200)
+        self.assertEqual(self.ranks(), {'b': 1, 'a': 2, 'u': 0})
+    
+    def test_rank_lock_lease_is_renewed_while_held(self):
+        """Test a renewing holder keeps the rank lock past the lease length"""
+        with mock.patch.object(leaderboard, 'RANK_LOCK_LEASE_SECONDS', 0.3):
+            with leaderboard.rank_lock(renew=True) as locked:
+                self.assertTrue(locked)
+                time.sleep(0.6)
+                with leaderboard.rank_lock(wait=0) as other:
+                    self.assertFalse(other)
+            with leaderboard.rank_lock(wait=0) as locked:
+                self.assertTrue(locked)
+    
+    @override_settings(OCTOFIT_RANK_LOCK_WAIT_SECONDS=0, OCTOFIT_JOBS_IN_PROCESS=False)
+    def test_write_during_rebuild_is_left_to_a_follow_up(self):
+        """Test a write that times out behind a rebuild leaves its totals to the next run"""
+        self.post_activity('a', 100)
+        with leaderboard.rank_lock(purpose=leaderboard.REBUILD) as locked:
+            self.assertTrue(locked)
+            self.post_activity('a', 200)
+        self.assertEqual(Leaderboard.objects.get(user_id='a').total_calories, 100)
+        self.assertTrue(Job.objects.filter(name='rebuild_leaderboard', status='pending').exists())
+        leaderboard.rebuild_leaderboard()
+        self.assertEqual(Leaderboard.objects.get(user_id='a').total_calories, 300)
+    
+    @override_settings(OCTOFIT_RANK_LOCK_WAIT_SECONDS=0, OCTOFIT_JOBS_IN_PROCESS=False)
+    def test_locked_rank_defers_to_rerank(self):
+        """Test a write that cannot take the rank lock updates totals and schedules a re-rank"""
+        self.post_activity('a', 100)
+        entry_id = Leaderboard.objects.get(user_id='a')._id
+        with leaderboard.rank_lock() as locked:
+            self.assertTrue(locked)
+            self.post_activity('b', 200)
+        self.assertEqual(Leaderboard.objects.get(user_id='b').total_calories, 200)
+        self.assertTrue(Job.objects.filter(name='rerank_leaderboard', status='pending').exists())
+        self.assertFalse(Job.objects.filter(name='rebuild_leaderboard').exists())
+        leaderboard.rerank_leaderboard()
+        self.assertEqual(self.ranks(), {'b': 1, 'a': 2})
+        self.assertEqual(Leaderboard.objects.get(user_id='a')._id, entry_id)
+
+
+class ActivityAdminTest(TestCase):
+    """Test cases for activity writes through the admin"""
+    
+    def test_admin_writes_update_aggregates(self):
+        """Test admin saves and deletes update the leaderboard and rollups"""
+        model_admin = ActivityAdmin(Activity, admin.site)
+        activity = Activity(
+            user_id='a', user_name='User a', activity_type='Running', duration=30, calories_burned=300
+        )
+        model_admin.save_model(None, activity, None, False)
+        activity.calories_burned = 500
+        model_admin.save_model(None, activity, None, True)
+        entry = Leaderboard.objects.get(user_id='a')
+        self.assertEqual((entry.total_calories, entry.total_activities), (500, 1))
+        self.assertEqual(ActivityRollup.objects.get(scope='user', key='a', period='day').calories_burned, 500)
+        model_admin.delete_queryset(None, Activity.objects.filter(user_id='a'))
+        entry = Leaderboard.objects.get(user_id='a')
+        self.assertEqual((entry.total_calories, entry.total_activities), (0, 0))
+
+
+class RecomputeLeaderboardTest(TestCase):
+    """Test cases for the recompute_leaderboard command"""
+    
+    def setUp(self):
+        self.user = User.objects.create(
+            name="Ranked User",
+            email="ranked@example.com",
+            password="testpass123",
+            team="Test Team"
+        )
+        for user_id, user_name, calories in [
+            (str(self.user._id), "Stale Name", 300),
+            (str(self.user._id), "Stale Name", 400),
+            ("456", "Other User", 500),
+        ]:
+            Activity.objects.create(
+                user_id=user_id,
+                user_name=user_name,
+                activity_type="Running",
+                duration=30,
+                calories_burned=calories
+            )
+    
+    def test_recompute_builds_ranked_entries(self):
+        """Test the aggregation totals, ranks and joins user details"""
+        out = StringIO()
+        call_command('recompute_leaderboard', stdout=out)
+        self.assertIn('Wrote 2 leaderboard entries', out.getvalue())
+        first, second = Leaderboard.objects.all()
+        self.assertEqual((first.user_name, first.team), ("Ranked User", "Test Team"))
+        self.assertEqual((first.total_calories, first.total_activities, first.rank), (700, 2, 1))
+        self.assertEqual((second.user_name, second.team, second.rank), ("Other User", "", 2))
+    
+    def test_recompute_keeps_entry_ids_and_api_entries(self):
+        """Test a rebuild updates entries in place and keeps ones without activities"""
+        call_command('recompute_leaderboard', stdout=StringIO())
+        ids = {e.user_id: e._id for e in Leaderboard.objects.all()}
+        Leaderboard.objects.create(
+            user_id="789", user_name="Manual Entry", team="", total_calories=600,
+            total_activities=0, rank=0
+        )
+        Activity.objects.create(
+            user_id="456", user_name="Other User", activity_type="Running",
+            duration=30, calories_burned=400
+        )
+        call_command('recompute_leaderboard', stdout=StringIO())
+        entries = {e.user_id: e for e in Leaderboard.objects.all()}
+        self.assertEqual(entries["456"]._id, ids["456"])
+        self.assertEqual(entries[str(self.user._id)]._id, ids[str(self.user._id)])
+        self.assertEqual(
+            [(e.user_id, e.rank) for e in Leaderboard.objects.all()],
+            [("456", 1), (str(self.user._id), 2), ("789", 3)],
+        )
+    
+    def test_dry_run_does_not_write(self):
+        """Test a dry run reports the entry count only"""
+        out = StringIO()
+        call_command('recompute_leaderboard', '--dry-run', stdout=out)
+        self.assertIn('Would write 2 leaderboard entries', out.getvalue())
+        self.assertEqual(Leaderboard.objects.count(), 0)
+
+
+class EnsureIndexesTest(TestCase):
+    """Test cases for the ensure_indexes command"""
+    
+    def test_creates_declared_indexes_idempotently(self):
+        """Test indexes are created once and then verified"""
+        call_command('ensure_indexes', stdout=StringIO())
+        names = Activity.objects.mongo_index_information().keys()
+        for index in Activity._meta.indexes:
+            self.assertIn(index.name, names)
+        out = StringIO()
+        call_command('ensure_indexes', '--check', stdout=out)
+        self.assertNotIn('created', out.getvalue())
+    
+    def test_check_reports_missing_index(self):
+        """Test --check fails when a declared index is missing"""
+        call_command('ensure_indexes', stdout=StringIO())
+        Leaderboard.objects.mongo_drop_index('leaderboard_rank')
+        with self.assertRaises(CommandError):
+            call_command('ensure_indexes', '--check', stdout=StringIO())
+
+
+class MongoVersionCheckTest(TestCase):
+    """Test cases for the MongoDB server version check"""
+    
+    def test_supported_server_passes(self):
+        """Test the check accepts the server the tests run against"""
+        self.assertEqual(check_mongodb_version(None, databases=['default']), [])
+
+
+class ResponseCacheTest(APITestCase):
+    """Test cases for cached read endpoints"""
+    
+    def setUp(self):
+        cache.clear()
+        Workout.objects.create(
+            name="Morning Run",
+            description="A refreshing morning run",
+            difficulty="Medium",
+            duration=30,
+            category="Cardio"
+        )
+    
+    def test_conditional_get_returns_not_modified(self):
+        """Test a matching If-None-Match is answered with 304"""
+        response = self.client.get('/api/workouts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+        cached = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_write_invalidates_cached_response(self):
+        """Test writing through the API serves fresh data"""
+        response = self.client.get('/api/workouts/')
+        self.client.post('/api/workouts/', {
+            'name': 'Evening Swim',
+            'description': 'Laps in the pool',
+            'difficulty': 'Easy',
+            'duration': 45,
+            'category': 'Swimming'
+        }, format='json')
+        fresh = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, status.HTTP_200_OK)
+        self.assertEqual(fresh.json()['count'], 2)
+    
+    def test_activity_write_invalidates_leaderboard(self):
+        """Test activity writes bump the cached leaderboard"""
+        self.assertEqual(self.client.get('/api/leaderboard/').json()['count'], 0)
+        self.client.post('/api/activities/', {
+            'user_id': '123',
+            'user_name': 'Test User',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300
+        }, format='json')
+        self.assertEqual(self.client.get('/api/leaderboard/').json()['count'], 1)
+    
+    def test_cache_hit_skips_the_database(self):
+        """Test a cached response is served with the version stamps from the cache"""
+        response = self.client.get('/api/workouts/')
+        with mock.patch('octofit_tracker.cache.database', side_effect=AssertionError):
+            cached = self.client.get('/api/workouts/')
+        self.assertEqual(cached.content, response.content)
+    
+    def test_browsable_api_is_not_cached(self):
+        """Test HTML pages, which embed the signed-in user, are rendered per request"""
+        user_model = get_user_model()
+        self.client.force_authenticate(user_model(username='alice'))
+        first = self.client.get('/api/workouts/', HTTP_ACCEPT='text/html')
+        self.assertIn(b'alice', first.content)
+        self.client.force_authenticate(user_model(username='bob'))
+        second = self.client.get('/api/workouts/', HTTP_ACCEPT='text/html')
+        self.assertIn(b'bob', second.content)
+        self.assertNotIn(b'alice', second.content)
+    
+    def test_only_cached_models_bump_versions(self):
+        """Test job saves leave cached responses valid and every cached viewset's models bump"""
+        from .cache import CACHED_MODELS, CachedResponseMixin
+        from . import views
+        for viewset in vars(views).values():
+            if isinstance(viewset, type) and issubclass(viewset, CachedResponseMixin):
+                self.assertLessEqual(set(viewset().get_cache_models()), set(CACHED_MODELS))
+        before = get_version(Leaderboard)
+        Job.objects.create(name='rebuild_leaderboard', key='rebuild_leaderboard {}',
+                           run_after=timezone.now(), created_at=timezone.now())
+        self.assertEqual(get_version(Leaderboard), before)
+    
+    def test_version_stamps_are_shared(self):
+        """Test version stamps live in Mongo, not in the per-process cache"""
+        before = get_version(Workout)
+        cache.clear()
+        self.assertEqual(get_version(Workout), before)
+        bump_version(Workout)
+        self.assertEqual(get_version(Workout)[0], before[0] + 1)
+
+
+class DocumentReadPathTest(APITestCase):
+    """Test cases for the native pymongo list/retrieve path"""
+    
+    def setUp(self):
+        cache.clear()
+        self.activity = Activity.objects.create(
+            user_id="123",
+            user_name="Test User",
+            activity_type="Running",
+            duration=30,
+            calories_burned=300,
+            distance=5.0
+        )
+        self.entry = Leaderboard.objects.create(
+            user_id="123",
+            user_name="Test User",
+            team="Test Team",
+            total_calories=300,
+            total_activities=1,
+            rank=1
+        )
+    
+    def test_activity_documents_match_model_serializer(self):
+        """Test raw documents render exactly like model instances"""
+        activity = Activity.objects.get(pk=self.activity._id)
+        response = self.client.get(f'/api/activities/{activity._id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ActivitySerializer(activity).data)
+        listed = self.client.get('/api/activities/').json()['results']
+        self.assertEqual(listed, [ActivitySerializer(activity).data])
+    
+    def test_leaderboard_documents_match_model_serializer(self):
+        """Test leaderboard list is rendered from documents"""
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response.json()['results'], [LeaderboardSerializer(self.entry).data])
+    
+    def test_retrieve_unknown_id_returns_not_found(self):
+        """Test invalid and unknown ids return 404"""
+        self.assertEqual(self.client.get('/api/activities/nope/').status_code, status.HTTP_404_NOT_FOUND)
+        missing = '0' * 24
+        self.assertEqual(self.client.get(f'/api/leaderboard/{missing}/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FastSerializationTest(SimpleTestCase):
+    """Test cases for compiled serializers and the orjson renderer"""
+    
+    def test_benchmark_output_is_byte_identical(self):
+        """Test compiled output matches ModelSerializer output for all resources"""
+        out = StringIO()
+        call_command('benchmark_serializers', '--rows', '50', '--repeat', '1', stdout=out)
+        self.assertIn('byte-identical', out.getvalue())
+    
+    def test_fast_renderer_escapes_line_separators(self):
+        """Test the orjson renderer matches JSONRenderer escaping"""
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+        data = {'name': 'caf\u00e9 \u2028 \u2029', 'distance': 5.0, 'items': [1, None]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+    
+    def test_fast_renderer_matches_datetime_format(self):
+        """Test the orjson renderer writes datetimes as JSONRenderer does"""
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+        moment = datetime.datetime(2024, 5, 1, 7, 30, 15, 250000)
+        data = {
+            'utc': moment.replace(tzinfo=datetime.timezone.utc),
+            'offset': moment.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+            'naive': moment,
+            'whole_seconds': moment.replace(microsecond=0, tzinfo=datetime.timezone.utc),
+            'day': moment.date(),
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class ActivityExportTest(APITestCase):
+    """Test cases for streaming activity exports"""
+    
+    def setUp(self):
+        for user_id, calories in [("123", 300), ("123", 400), ("456", 500)]:
+            Activity.objects.create(
+                user_id=user_id,
+                user_name="Test User",
+                activity_type="Running",
+                duration=30,
+                calories_burned=calories
+            )
+    
+    def test_export_ndjson_filtered_by_user(self):
+        """Test NDJSON export streams one object per line"""
+        response = self.client.get('/api/activities/export/', {'user_id': '123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([r['calories_burned'] for r in rows], [300, 400])
+    
+    def test_export_csv(self):
+        """Test CSV export includes a header row"""
+        response = self.client.get('/api/activities/export/', {'output': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,user_id,user_name'))
+        self.assertEqual(len(lines), 4)
+    
+    def test_export_rejects_bad_parameters(self):
+        """Test unknown formats and dates are rejected"""
+        response = self.client.get('/api/activities/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/activities/export/', {'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_export_command(self):
+        """Test the management command writes NDJSON to stdout"""
+        out = StringIO()
+        call_command('export_activities', '--user-id', '456', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['calories_burned'], 500)
+
+
+class ActivityRollupTest(APITestCase):
+    """Test cases for incremental rollups and the stats API"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            name="Rollup User",
+            email="rollup@example.com",
+            password="testpass123",
+            team="Test Team"
+        )
+        self.user_id = str(self.user._id)
+        for activity_type, calories, distance in [
+            ("Running", 300, 5.0), ("Running", 200, 2.5), ("Yoga", 100, None)
+        ]:
+            self.client.post('/api/activities/', {
+                'user_id': self.user_id,
+                'user_name': 'Rollup User',
+                'activity_type': activity_type,
+                'duration': 30,
+                'calories_burned': calories,
+                'distance': distance
+            }, format='json')
+    
+    def test_user_daily_rollup(self):
+        """Test activity writes are summed into the user's day bucket"""
+        response = self.client.get(f'/api/stats/users/{self.user_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        [bucket] = response.json()['results']
+        self.assertEqual(bucket['calories_burned'], 600)
+        self.assertEqual(bucket['duration'], 90)
+        self.assertEqual(bucket['distance'], 7.5)
+        self.assertEqual(bucket['activities'], 3)
+        self.assertEqual(bucket['by_type'], {'Running': 2, 'Yoga': 1})
+    
+    def test_team_weekly_rollup(self):
+        """Test team totals are kept per ISO week"""
+        response = self.client.get('/api/stats/teams/Test Team/', {'period': 'week'})
+        [bucket] = response.json()['results']
+        self.assertEqual(bucket['scope'], 'team')
+        self.assertEqual(bucket['calories_burned'], 600)
+    
+    def test_delete_retracts_from_rollup(self):
+        """Test deleting an activity subtracts it from its buckets"""
+        activity = Activity.objects.filter(activity_type="Yoga").first()
+        self.client.delete(f'/api/activities/{activity._id}/')
+        [bucket] = self.client.get(f'/api/stats/users/{self.user_id}/').json()['results']
+        self.assertEqual(bucket['calories_burned'], 500)
+        self.assertEqual(bucket['by_type'], {'Running': 2, 'Yoga': 0})
+    
+    def test_rebuild_matches_incremental(self):
+        """Test the rebuild command reproduces the incremental totals"""
+        before = self.client.get('/api/stats/', {'scope': 'user'}).json()['results']
+        call_command('rebuild_rollups', stdout=StringIO())
+        cache.clear()
+        after = self.client.get('/api/stats/', {'scope': 'user'}).json()['results']
+        strip = lambda rows: [{k: v for k, v in r.items() if k != 'id'} for r in rows]
+        self.assertEqual(strip(after), strip(before))
+        self.assertEqual(ActivityRollup.objects.count(), 4)
+    
+    def test_rebuild_sanitizes_type_keys(self):
+        """Test the rebuild keys by_type like the incremental path"""
+        for activity_type in ('Tai.Chi', '$Tai_Chi'):
+            self.client.post('/api/activities/', {
+                'user_id': self.user_id,
+                'user_name': 'Rollup User',
+                'activity_type': activity_type,
+                'duration': 30,
+                'calories_burned': 100,
+            }, format='json')
+        call_command('rebuild_rollups', stdout=StringIO())
+        cache.clear()
+        [bucket] = self.client.get(f'/api/stats/users/{self.user_id}/').json()['results']
+        self.assertEqual(bucket['by_type'], {'Running': 2, 'Yoga': 1, 'Tai_Chi': 2})
+    
+    @override_settings(OCTOFIT_JOBS_IN_PROCESS=False)
+    def test_write_during_rebuild_is_left_to_a_follow_up(self):
+        """Test a write while a rebuild holds the lease leaves its buckets to the next run"""
+        with locks.lease(rollups.REBUILD_LOCK, 0) as locked:
+            self.assertTrue(locked)
+            self.client.post('/api/activities/', {
+                'user_id': self.user_id,
+                'user_name': 'Rollup User',
+                'activity_type': 'Yoga',
+                'duration': 30,
+                'calories_burned': 100,
+            }, format='json')
+        rollup = ActivityRollup.objects.get(scope='user', period='day')
+        self.assertEqual(rollup.calories_burned, 600)
+        self.assertTrue(Job.objects.filter(name='rebuild_rollups', status='pending').exists())
+        rollups.rebuild_rollups()
+        rollup = ActivityRollup.objects.get(scope='user', period='day')
+        self.assertEqual(rollup.calories_burned, 700)
+    
+    def test_invalid_period_rejected(self):
+        """Test unknown periods are rejected"""
+        response = self.client.get('/api/stats/', {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WindowedLeaderboardTest(APITestCase):
+    """Test cases for time-windowed leaderboards"""
+    
+    def setUp(self):
+        cache.clear()
+        call_command('ensure_indexes', stdout=StringIO())
+        self.addCleanup(database().drop_collection, windows.MARKER_COLLECTION)
+    
+    def post_activity(self, user_id, calories):
+        self.client.post('/api/activities/', {
+            'user_id': user_id,
+            'user_name': f'User {user_id}',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories
+        }, format='json')
+    
+    def test_current_week_ranks_by_window_totals(self):
+        """Test the open week is ranked live and paged by rank"""
+        for user_id, calories in [('a', 100), ('b', 300), ('c', 200), ('a', 250)]:
+            self.post_activity(user_id, calories)
+        response = self.client.get('/api/leaderboard/', {'window': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertFalse(data['window']['closed'])
+        ranking = [(e['user_id'], e['total_calories'], e['rank']) for e in data['results']]
+        self.assertEqual(ranking, [('a', 350, 1), ('b', 300, 2), ('c', 200, 3)])
+        self.assertEqual(data['results'][0]['user_name'], 'User a')
+    
+    def test_closed_week_is_materialized_once(self):
+        """Test a past week is ranked once and then read from storage"""
+        bucket = datetime.datetime(2024, 4, 29)
+        for key, calories in [('a', 100), ('b', 300)]:
+            ActivityRollup.objects.create(
+                scope='user', key=key, period='week', bucket=bucket,
+                calories_burned=calories, activities=1, by_type={'Running': 1}
+            )
+        params = {'window': 'week', 'start': '2024-05-01'}
+        first = self.client.get('/api/leaderboard/', params).json()
+        self.assertTrue(first['window']['closed'])
+        self.assertEqual([e['user_id'] for e in first['results']], ['b', 'a'])
+        self.assertEqual(LeaderboardWindow.objects.filter(window='week:2024-04-29').count(), 2)
+        ActivityRollup.objects.all().delete()
+        cache.clear()
+        again = self.client.get('/api/leaderboard/', params).json()
+        self.assertEqual(again['results'], first['results'])
+    
+    def test_empty_closed_week_is_marked(self):
+        """Test a past week without activity is materialized once and invalidated by a late write"""
+        week = windows.parse_window('week', '2024-05-01')
+        self.assertEqual(list(windows.window_ranking(week)), [])
+        marker = database()[windows.MARKER_COLLECTION].find_one({'_id': week.key})
+        self.assertTrue(marker['materialized'])
+        windows.invalidate_windows([datetime.datetime(2024, 5, 1)])
+        marker = database()[windows.MARKER_COLLECTION].find_one({'_id': week.key})
+        self.assertEqual((marker['materialized'], marker['generation']), (False, 1))
+        ActivityRollup.objects.create(
+            scope='user', key='a', period='week', bucket=week.start,
+            calories_burned=100, activities=1, by_type={'Running': 1}
+        )
+        self.assertEqual([e['user_id'] for e in windows.window_ranking(week)], ['a'])
+        windows.materialize(week)
+        self.assertEqual(LeaderboardWindow.objects.filter(window=week.key).count(), 1)
+    
+    def test_recent_closed_windows_are_invalidated(self):
+        """Test a write into last week or last month invalidates it even inside the current month"""
+        now = timezone.now()
+        for name, day in [
+            ('week', now - datetime.timedelta(days=7)),
+            ('month', windows.month_start(now) - datetime.timedelta(days=1)),
+        ]:
+            window = windows.parse_window(name, day.date().isoformat(), now=now)
+            self.assertTrue(window.closed)
+            windows.window_ranking(window)
+            windows.invalidate_windows([day])
+            marker = database()[windows.MARKER_COLLECTION].find_one({'_id': window.key})
+            self.assertEqual((marker['materialized'], marker['generation']), (False, 1))
+    
+    def test_invalid_window_rejected(self):
+        """Test unknown windows are rejected"""
+        response = self.client.get('/api/leaderboard/', {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LeaderboardRankLookupTest(APITestCase):
+    """Test cases for single-user rank lookups"""
+    
+    def setUp(self):
+        cache.clear()
+        for rank in range(1, 8):
+            Leaderboard.objects.create(
+                user_id=f"user{rank}",
+                user_name=f"User {rank}",
+                team="Test Team",
+                total_calories=1000 - rank * 100,
+                total_activities=rank,
+                rank=rank
+            )
+    
+    def test_rank_with_neighbours(self):
+        """Test rank, score and neighbours are returned"""
+        response = self.client.get('/api/leaderboard/rank/user4/', {'k': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual((data['rank'], data['total_calories']), (4, 600))
+        self.assertEqual([e['rank'] for e in data['above']], [2, 3])
+        self.assertEqual([e['rank'] for e in data['below']], [5, 6])
+    
+    def test_rank_at_top_has_no_entries_above(self):
+        """Test neighbours are clipped at the edges"""
+        data = self.client.get('/api/leaderboard/rank/user1/').json()
+        self.assertEqual(data['above'], [])
+        self.assertEqual(len(data['below']), 5)
+    
+    def test_unknown_user_returns_not_found(self):
+        """Test users without an entry return 404"""
+        response = self.client.get('/api/leaderboard/rank/nobody/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TeamAggregateTest(APITestCase):
+    """Test cases for team aggregates and the team leaderboard"""
+    
+    def setUp(self):
+        cache.clear()
+        self.marvel = Team.objects.create(name="Team Marvel")
+        Team.objects.create(name="Team DC")
+        for name, team in [("Thor", "Team Marvel"), ("Hulk", "Team Marvel"),
+                           ("Loki", "Team Marvel"), ("Batman", "Team DC")]:
+            User.objects.create(name=name, email=f"{name}@example.com", password="x", team=team)
+        for rank, (name, team, calories, activities) in enumerate([
+            ("Batman", "Team DC", 900, 3), ("Thor", "Team Marvel", 500, 2),
+            ("Hulk", "Team Marvel", 400, 1)
+        ], start=1):
+            Leaderboard.objects.create(
+                user_id=name, user_name=name, team=team, total_calories=calories,
+                total_activities=activities, rank=rank
+            )
+    
+    def test_team_leaderboard(self):
+        """Test teams are ranked by summed calories"""
+        response = self.client.get('/api/teams/leaderboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        marvel, dc = response.json()
+        self.assertEqual((marvel['team'], marvel['rank'], marvel['total_calories']), ("Team Marvel", 1, 900))
+        self.assertEqual((marvel['members'], marvel['total_activities']), (3, 3))
+        self.assertEqual(marvel['average_calories'], 300)
+        self.assertEqual((dc['team'], dc['rank'], dc['members']), ("Team DC", 2, 1))
+    
+    def test_team_aggregate(self):
+        """Test one team's aggregate"""
+        response = self.client.get(f'/api/teams/{self.marvel._id}/aggregate/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['members'], 3)
+        self.assertEqual(response.json()['total_calories'], 900)
+    
+    def test_all_teams_match_uses_team_index(self):
+        """Test teamless users are left out and the all-teams match is an index range"""
+        User.objects.create(name="Nobody", email="nobody@example.com", password="x", team="")
+        names = [team['team'] for team in self.client.get('/api/teams/leaderboard/').json()]
+        self.assertEqual(names, ["Team Marvel", "Team DC"])
+        call_command('ensure_indexes', stdout=StringIO())
+        plan = Leaderboard.objects.mongo_find({'team': teams.HAS_TEAM}).explain()
+        self.assertIn('IXSCAN', plan_stages(plan['queryPlanner']['winningPlan']))
+
+
+class SyntheticPopulateTest(TestCase):
+    """Test cases for the populate_db scale mode"""
+    
+    def test_scale_mode_is_seeded(self):
+        """Test a seeded synthetic load is reproducible and builds aggregates"""
+        markers = database()[windows.MARKER_COLLECTION]
+        self.addCleanup(markers.delete_many, {})
+        markers.insert_one({'_id': 'week:2024-04-29', 'generation': 0, 'materialized': True})
+        states = database()[activity_migration.STATE_COLLECTION]
+        self.addCleanup(states.delete_many, {})
+        states.insert_one({'_id': activity_migration.MIGRATION, 'last_id': ObjectId(), 'copied': 1})
+        snapshots = []
+        for _ in range(2):
+            out = StringIO()
+            call_command(
+                'populate_db', '--users', '30', '--activities-per-user', '5',
+                '--teams', '3', '--batch-size', '7', '--build-leaderboard', stdout=out
+            )
+            self.assertIn('inserts/s', out.getvalue())
+            snapshots.append(sorted(
+                (a.user_id, a.activity_type, a.calories_burned, a.date)
+                for a in Activity.objects.all()
+            ))
+        self.assertEqual(snapshots[0], snapshots[1])
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertEqual(
+            sum(entry.total_activities for entry in Leaderboard.objects.all()),
+            Activity.objects.count()
+        )
+        self.assertTrue(ActivityRollup.objects.exists())
+        self.assertEqual(markers.count_documents({}), 0)
+        self.assertIsNone(states.find_one({'_id': activity_migration.MIGRATION}))
+        # Legacy activities are mirrored to the compact collection
+        self.assertEqual(CompactActivity.objects.mongo_count_documents({}), Activity.objects.count())
+
+
+class BenchmarkAPITest(TestCase):
+    """Test cases for the benchmark_api command"""
+    
+    def test_writes_and_compares_results(self):
+        """Test a small run covers every scenario and diffs against itself"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'bench.json'
+            options = ['--reseed', '--users', '10', '--activities-per-user', '3', '--teams', '2',
+                       '--requests', '3', '--warmup', '1', '--recompute-runs', '1']
+            call_command('benchmark_api', *options, '--output', str(output), stdout=StringIO())
+            results = json.loads(output.read_text())['results']
+            for resource in ('users', 'teams', 'activities', 'leaderboard', 'workouts'):
+                for operation in ('list', 'retrieve', 'create'):
+                    self.assertEqual(results[f'{resource}.{operation}']['requests'], 3)
+            self.assertIn('p95_ms', results['leaderboard.recompute'])
+            
+            out = StringIO()
+            call_command('benchmark_api', *options, '--output', str(Path(directory) / 'next.json'),
+                         '--compare', str(output), '--tolerance', '1000', stdout=out)
+            self.assertIn('No regressions beyond tolerance', out.getvalue())
+
+
+class HistogramTest(SimpleTestCase):
+    """Test cases for the Prometheus histogram exposition"""
+    
+    def test_buckets_are_cumulative(self):
+        """Test bucket counts, sum and count are exposed per label set"""
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('route',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'a"b')
+        histogram.observe(0.5, 'a"b')
+        self.assertEqual(histogram.expose(), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{route="a\\"b",le="1"} 2',
+            'test_seconds_bucket{route="a\\"b",le="+Inf"} 2',
+            'test_seconds_sum{route="a\\"b"} 0.55',
+            'test_seconds_count{route="a\\"b"} 2',
+        ])
+
+
+class MetricsMiddlewareTest(APITestCase):
+    """Test cases for request instrumentation and the metrics endpoint"""
+    
+    def setUp(self):
+        metrics.reset()
+        Activity.objects.create(
+            user_id="123",
+            user_name="Test User",
+            activity_type="Running",
+            duration=30,
+            calories_burned=300
+        )
+    
+    def test_metrics_endpoint_reports_routes_and_commands(self):
+        """Test latency, phases and Mongo commands are recorded per route"""
+        self.client.get('/api/activities/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('octofit_request_duration_seconds_count{route="activity-list",method="GET",status="200"} 1', body)
+        self.assertIn('octofit_request_phase_seconds_count{route="activity-list",phase="serialize"} 1', body)
+        self.assertIn('octofit_mongo_command_duration_seconds_count{route="activity-list",command="find",outcome="ok"}', body)
+    
+    def test_metrics_endpoint_is_restricted(self):
+        """Test clients outside the allow-list are refused"""
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    @override_settings(OCTOFIT_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_commands(self):
+        """Test the slow-request log carries the query breakdown"""
+        with self.assertLogs('octofit_tracker.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/activities/')
+        self.assertIn('/api/activities/ (activity-list) 200', logs.output[0])
+        self.assertIn(f'find {Activity._meta.db_table}', logs.output[0])
+
+
+class AsyncReadPathTest(APITestCase):
+    """Test cases for the async read endpoints"""
+    
+    def setUp(self):
+        self.workout = Workout.objects.create(
+            name="Morning Run",
+            description="A light jog",
+            difficulty="Easy",
+            duration=30,
+            category="Cardio"
+        )
+        Activity.objects.create(
+            user_id="123",
+            user_name="Test User",
+            activity_type="Running",
+            duration=30,
+            calories_burned=300
+        )
+        Leaderboard.objects.create(
+            user_id="123",
+            user_name="Test User",
+            team="Team Marvel",
+            total_calories=300,
+            total_activities=1,
+            rank=1
+        )
+    
+    async def test_async_endpoints_match_sync_ones(self):
+        """Test list and retrieve bodies equal the synchronous endpoints'"""
+        for path in ['leaderboard/', 'activities/', 'workouts/', f'workouts/{self.workout._id}/']:
+            expected = await self.async_client.get(f'/api/{path}')
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), expected.json())
+    
+    async def test_async_endpoints_are_read_only(self):
+        """Test writes are rejected on the async endpoints"""
+        response = await self.async_client.post('/api/async/workouts/', {})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class SparseFieldsetTest(APITestCase):
+    """Test cases for ?fields= sparse fieldsets"""
+    
+    def setUp(self):
+        self.workout = Workout.objects.create(
+            name="Morning Run",
+            description="A light jog " * 50,
+            difficulty="Easy",
+            duration=30,
+            category="Cardio"
+        )
+        for calories in (300, 400):
+            Activity.objects.create(
+                user_id="123",
+                user_name="Test User",
+                activity_type="Running",
+                duration=30,
+                calories_burned=calories
+            )
+        Leaderboard.objects.create(
+            user_id="123",
+            user_name="Test User",
+            team="Team Marvel",
+            total_calories=700,
+            total_activities=2,
+            rank=1
+        )
+    
+    def test_list_returns_only_requested_fields(self):
+        """Test the leaderboard columns the frontend shows"""
+        response = self.client.get('/api/leaderboard/?fields=user_name,total_calories,team')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'user_name': 'Test User', 'team': 'Team Marvel', 'total_calories': 700}
+        ])
+    
+    def test_retrieve_skips_wide_fields(self):
+        """Test a compiled retrieve without the description"""
+        response = self.client.get(f'/api/workouts/{self.workout._id}/?fields=id,name')
+        self.assertEqual(response.data, {'id': str(self.workout._id), 'name': 'Morning Run'})
+    
+    def test_cursor_pagination_keeps_working(self):
+        """Test the keyset cursor is built when the sort key is not selected"""
+        for _ in range(9):
+            Activity.objects.create(
+                user_id="123",
+                user_name="Test User",
+                activity_type="Yoga",
+                duration=30,
+                calories_burned=100
+            )
+        response = self.client.get('/api/activities/?fields=calories_burned')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['next'])
+        self.assertEqual(list(response.data['results'][0]), ['calories_burned'])
+    
+    def test_unknown_fields_are_rejected(self):
+        """Test a field the serializer does not expose is a 400"""
+        response = self.client.get('/api/users/?fields=name,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.data['fields'][0])
+    
+    @override_settings(OCTOFIT_FAST_SERIALIZATION=False)
+    def test_model_serializer_path(self):
+        """Test the fields are narrowed without the compiled serializers"""
+        response = self.client.get('/api/workouts/?fields=name,difficulty')
+        self.assertEqual(response.data['results'], [{'name': 'Morning Run', 'difficulty': 'Easy'}])
+
+
+def plan_stages(plan):
+    """Every stage name in an explain() plan, classic or slot-based."""
+    if isinstance(plan, dict):
+        stages = [plan['stage']] if 'stage' in plan else []
+        for value in plan.values():
+            stages += plan_stages(value)
+        return stages
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in plan_stages(item)]
+    return []
+
+
+class ActivityFilterTest(APITestCase):
+    """Test cases for activity list filters"""
+    
+    FILTERS = [
+        {'user_id': '123'},
+        {'activity_type': 'Running'},
+        {'date_from': '2024-01-01', 'date_to': '2024-02-01'},
+        {'min_duration': '20', 'max_duration': '40'},
+        {'min_calories': '250', 'max_calories': '450'},
+    ]
+    
+    def setUp(self):
+        call_command('ensure_indexes', '--drop-drifted', stdout=StringIO())
+        for user_id, activity_type, duration, calories, day in [
+            ("123", "Running", 30, 300, 5),
+            ("123", "Yoga", 60, 200, 10),
+            ("123", "Running", 45, 500, 40),
+            ("456", "Running", 30, 400, 12),
+        ]:
+            activity = Activity.objects.create(
+                user_id=user_id,
+                user_name=f"User {user_id}",
+                activity_type=activity_type,
+                duration=duration,
+                calories_burned=calories
+            )
+            Activity.objects.mongo_update_one(
+                {'_id': activity._id},
+                {'$set': {'d': datetime.datetime(2024, 1, 1) + datetime.timedelta(days=day)}}
+            )
+    
+    def test_filters_are_combined(self):
+        """Test user, type, date and calorie filters narrow the list together"""
+        response = self.client.get(
+            '/api/activities/?user_id=123&activity_type=Running'
+            '&date_from=2024-01-01&date_to=2024-02-01&min_calories=250'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([a['calories_burned'] for a in response.data['results']], [300])
+    
+    def test_invalid_filters_are_rejected(self):
+        """Test malformed numbers and dates are a 400"""
+        response = self.client.get('/api/activities/?min_duration=long')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('min_duration', response.data)
+        response = self.client.get('/api/activities/?date_from=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_ranges_require_a_user(self):
+        """Test duration and calorie ranges are rejected without user_id"""
+        response = self.client.get('/api/activities/?min_calories=250')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user_id', response.data)
+        response = self.client.get('/api/activities/?user_id=123&max_duration=40')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([a['duration'] for a in response.data['results']], [30])
+    
+    def test_every_filter_combination_uses_an_index(self):
+        """Test no supported combination scans the collection or sorts in memory"""
+        # Enough of another user's runs that reading past them would show
+        Activity.objects.mongo_insert_many([
+            encode_document(Activity, {
+                '_id': ObjectId(),
+                'user_id': '456',
+                'user_name': 'User 456',
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories_burned': 300,
+                'distance': None,
+                'date': datetime.datetime(2024, 1, 1) + datetime.timedelta(days=day),
+            })
+            for day in range(50)
+        ])
+        for size in range(len(self.FILTERS) + 1):
+            for combination in itertools.combinations(self.FILTERS, size):
+                params = {k: v for group in combination for k, v in group.items()}
+                ranged = any(param in params for param in ('min_duration', 'min_calories'))
+                if ranged and 'user_id' not in params:
+                    continue
+                query = DocumentQuery(Activity).filter(**activity_lookups(params))
+                plan = Activity.objects.mongo_find(query.filter_document).sort(
+                    [('d', -1), ('_id', -1)]
+                ).limit(11).explain()
+                stages = plan_stages(plan['queryPlanner']['winningPlan'])
+                stats = plan['executionStats']
+                with self.subTest(params=params):
+                    self.assertIn('IXSCAN', stages)
+                    self.assertNotIn('COLLSCAN', stages)
+                    self.assertNotIn('SORT', stages)
+                    if ranged:
+                        # Bounds are checked on index keys: only matches are
+                        # fetched, and only the user's three entries are read
+                        # (plus the key that ends the scan)
+                        self.assertEqual(stats['totalDocsExamined'], stats['nReturned'])
+                        self.assertLessEqual(stats['totalKeysExamined'], 4)
+
+
+@override_settings(OCTOFIT_JOBS_IN_PROCESS=False)
+class JobQueueTest(APITestCase):
+    """Test cases for the background job queue"""
+    
+    def setUp(self):
+        Activity.objects.create(
+            user_id="123",
+            user_name="Test User",
+            activity_type="Running",
+            duration=30,
+            calories_burned=300
+        )
+    
+    def test_triggers_coalesce_into_one_run(self):
+        """Test a burst of triggers schedules a single job"""
+        for _ in range(500):
+            jobs.enqueue('rebuild_leaderboard', delay=0)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.triggers), ('pending', 500))
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), ('succeeded', 1, 1))
+        self.assertEqual(Leaderboard.objects.get().total_calories, 300)
+    
+    def test_trigger_during_a_run_queues_one_follow_up(self):
+        """Test writes made while a job runs are not lost"""
+        jobs.enqueue('rebuild_leaderboard', delay=0)
+        running = jobs.claim('test')
+        jobs.enqueue('rebuild_leaderboard', delay=0)
+        jobs.enqueue('rebuild_leaderboard', delay=0)
+        self.assertEqual(Job.objects.filter(status='pending').count(), 1)
+        self.assertEqual(Job.objects.get(status='pending').triggers, 2)
+        jobs.execute(running)
+        self.assertEqual(jobs.run_pending(), 1)
+    
+    def test_keys_do_not_collide(self):
+        """Test arguments that would render alike still get distinct keys"""
+        self.assertNotEqual(jobs.job_key('x', {'a': '1 b=2'}), jobs.job_key('x', {'a': '1', 'b': '2'}))
+        self.assertEqual(jobs.job_key('x', {'b': 2, 'a': 1}), jobs.job_key('x', {'a': 1, 'b': 2}))
+    
+    def test_debounced_job_waits(self):
+        """Test a job is not due before its delay has passed"""
+        jobs.enqueue('rebuild_rollups', delay=60)
+        self.assertEqual(jobs.run_pending(), 0)
+    
+    @override_settings(OCTOFIT_JOB_MAX_ATTEMPTS=1)
+    def test_failed_job_records_error(self):
+        """Test a failing handler marks the job failed with its traceback"""
+        def explode():
+            raise RuntimeError('boom')
+        jobs.register('explode', explode)
+        self.addCleanup(jobs.HANDLERS.pop, 'explode')
+        jobs.enqueue('explode', delay=0)
+        jobs.run_pending()
+        job = Job.objects.get()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('RuntimeError: boom', job.error)
+    
+    def test_api_enqueues_and_lists_jobs(self):
+        """Test POST coalesces and the list filters by status"""
+        self.client.force_authenticate(get_user_model()(username='admin', is_staff=True))
+        for _ in range(2):
+            response = self.client.post('/api/jobs/', {'name': 'rebuild_leaderboard'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['triggers'], 2)
+        response = self.client.get('/api/jobs/?status=pending')
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.post('/api/jobs/', {'name': 'nope'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            '/api/jobs/', {'name': 'rebuild_leaderboard', 'args': {'everything': True}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('args', response.data)
+    
+    def test_api_requires_staff(self):
+        """Test anonymous clients can neither list nor enqueue jobs"""
+        response = self.client.post('/api/jobs/', {'name': 'rebuild_leaderboard'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/api/jobs/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Job.objects.exists())
+    
+    def test_command_runs_and_lists_jobs(self):
+        """Test the jobs command enqueues, works and reports"""
+        out = StringIO()
+        call_command('jobs', '--enqueue', 'rebuild_rollups', stdout=out)
+        call_command('jobs', '--work', '--once', stdout=out)
+        call_command('jobs', '--status', 'succeeded', stdout=out)
+        self.assertIn('Ran 1 job(s)', out.getvalue())
+        self.assertIn('rebuild_rollups', out.getvalue().splitlines()[-1])
+
+
+@override_settings(OCTOFIT_JOBS_IN_PROCESS=False, OCTOFIT_JOB_DEBOUNCE_SECONDS=0)
+class UserPropagationTest(APITestCase):
+    """Test cases for propagating user names and teams onto their copies"""
+    
+    def setUp(self):
+        self.user = User.objects.create(
+            name="Tony Stark",
+            email="tony@example.com",
+            password="ironman",
+            team="Avengers"
+        )
+        self.user_id = str(self.user._id)
+        for calories in (300, 200):
+            self.client.post('/api/activities/', {
+                'user_id': self.user_id,
+                'user_name': 'Tony Stark',
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories_burned': calories,
+            }, format='json')
+        LeaderboardWindow.objects.create(
+            window='week:2024-04-29',
+            window_start=datetime.datetime(2024, 4, 29),
+            window_end=datetime.datetime(2024, 5, 6),
+            user_id=self.user_id,
+            user_name='Tony Stark',
+            team='Avengers',
+            total_calories=500,
+            total_activities=2,
+            rank=1
+        )
+    
+    def copies(self):
+        return (
+            set(Activity.objects.values_list('user_name', flat=True)),
+            set(Leaderboard.objects.values_list('user_name', 'team')),
+            set(LeaderboardWindow.objects.values_list('user_name', 'team')),
+        )
+    
+    def test_update_propagates_in_the_background(self):
+        """Test a rename is queued by PATCH and applied by the job"""
+        response = self.client.patch(
+            f'/api/users/{self.user_id}/', {'name': 'Iron Man', 'team': 'Stark'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(Job.objects.values_list('name', flat=True)), {'propagate_user', 'repair_team_rollups'}
+        )
+        self.assertEqual(self.copies()[0], {'Tony Stark'})
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(self.copies(), ({'Iron Man'}, {('Iron Man', 'Stark')}, {('Iron Man', 'Stark')}))
+        # Legacy activities are mirrored to the compact collection until the switch
+        mirrored = {CompactActivity._meta.db_table: 2} if Activity is LegacyActivity else {}
+        self.assertEqual(
+            Job.objects.get(name='propagate_user').result,
+            {Activity._meta.db_table: 2, 'leaderboard': 1, 'leaderboard_windows': 1, **mirrored},
+        )
+    
+    def test_team_change_moves_team_rollups(self):
+        """Test a team change moves the user's history to the new team's rollups in the background"""
+        self.client.patch(f'/api/users/{self.user_id}/', {'team': 'Stark'}, format='json')
+        self.assertFalse(ActivityRollup.objects.filter(scope='team', key='Stark').exists())
+        self.assertEqual(Job.objects.get(name='repair_team_rollups').args, {'teams': ['Avengers', 'Stark']})
+        jobs.run_pending()
+        moved = ActivityRollup.objects.get(scope='team', key='Stark', period='week')
+        self.assertEqual((moved.calories_burned, moved.activities, moved.by_type), (500, 2, {'Running': 2}))
+        self.assertFalse(ActivityRollup.objects.filter(scope='team', key='Avengers').exists())
+        self.client.post('/api/activities/', {
+            'user_id': self.user_id,
+            'user_name': 'Tony Stark',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 100,
+        }, format='json')
+        incremental = {
+            rollup.key: rollup.calories_burned
+            for rollup in ActivityRollup.objects.filter(scope='team', period='day')
+        }
+        self.assertEqual(incremental, {'Stark': 600})
+        call_command('rebuild_rollups', stdout=StringIO())
+        rebuilt = {
+            rollup.key: rollup.calories_burned
+            for rollup in ActivityRollup.objects.filter(scope='team', period='day')
+        }
+        self.assertEqual(rebuilt, incremental)
+    
+    def test_unchanged_fields_queue_nothing(self):
+        """Test an update that keeps name and team does not enqueue"""
+        self.client.patch(f'/api/users/{self.user_id}/', {'password': 'jarvis'}, format='json')
+        self.assertFalse(Job.objects.exists())
+    
+    def test_reconcile_repairs_drift(self):
+        """Test the reconciliation command finds and repairs stale copies"""
+        User.objects.mongo_update_one({'_id': self.user._id}, {'$set': {'name': 'Iron Man'}})
+        stale = 6 if Activity is LegacyActivity else 4  # with the mirrored compact activities
+        out = StringIO()
+        call_command('reconcile_users', '--dry-run', stdout=out)
+        self.assertIn(f'Found {stale} stale documents', out.getvalue())
+        self.assertEqual(self.copies()[0], {'Tony Stark'})
+        call_command('reconcile_users', '--batch-size', '1', stdout=out)
+        self.assertIn(f'Repaired {stale} stale documents', out.getvalue())
+        self.assertEqual(self.copies(), ({'Iron Man'}, {('Iron Man', 'Avengers')}, {('Iron Man', 'Avengers')}))
+        call_command('reconcile_users', '--dry-run', stdout=out)
+        self.assertIn('Found 0 stale documents', out.getvalue())
+    
+    def test_reconcile_repairs_team_rollups(self):
+        """Test the reconciliation command recomputes team buckets that drifted from their members'"""
+        ActivityRollup.objects.mongo_update_many({'scope': 'team'}, {'$inc': {'calories_burned': 50}})
+        ActivityRollup.objects.mongo_insert_one({
+            'scope': 'team', 'key': 'Stark', 'period': 'day', 'bucket': datetime.datetime(2024, 1, 1),
+            'calories_burned': 100, 'duration': 30, 'distance': 0, 'activities': 1, 'by_type': {'Running': 1},
+        })
+        out = StringIO()
+        call_command('reconcile_users', '--dry-run', stdout=out)
+        self.assertIn(f'{ActivityRollup._meta.db_table}: 3 stale', out.getvalue())
+        call_command('reconcile_users', stdout=out)
+        totals = set(ActivityRollup.objects.filter(scope='team').values_list('key', 'calories_burned'))
+        self.assertEqual(totals, {('Avengers', 500)})
+        call_command('reconcile_users', '--dry-run', stdout=out)
+        self.assertIn('Found 0 stale documents', out.getvalue())
+
+
+@override_settings(OCTOFIT_INGEST_BUFFERED=True, OCTOFIT_INGEST_FLUSH_MS=60000)
+class BufferedIngestTest(APITestCase):
+    """Test cases for buffered activity ingestion"""
+    
+    def setUp(self):
+        self.buffer = get_buffer()
+        self.addCleanup(self.buffer.flush)
+    
+    def post(self, calories=300):
+        return self.client.post('/api/activities/', {
+            'user_id': '123',
+            'user_name': 'Test User',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories,
+        }, format='json')
+    
+    def test_posts_are_written_in_one_batch(self):
+        """Test accepted activities are written together with their aggregates"""
+        ids = []
+        for calories in (100, 200, 300):
+            response = self.post(calories)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            ids.append(response.data['id'])
+        self.assertFalse(Activity.objects.exists())
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(
+            sorted(Activity.objects.values_list('_id', flat=True)), sorted(ObjectId(id) for id in ids)
+        )
+        entry = Leaderboard.objects.get(user_id='123')
+        self.assertEqual((entry.total_calories, entry.total_activities), (600, 3))
+    
+    def test_invalid_post_is_rejected_synchronously(self):
+        """Test validation errors are reported before buffering"""
+        response = self.client.post('/api/activities/', {'user_id': '123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.buffer), 0)
+    
+    @override_settings(OCTOFIT_INGEST_MAX_PENDING=2, OCTOFIT_INGEST_BLOCK_SECONDS=0)
+    def test_full_buffer_applies_backpressure(self):
+        """Test a POST is refused with Retry-After while the buffer is full"""
+        self.post()
+        self.post()
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.buffer.flush()
+        self.assertEqual(self.post().status_code, status.HTTP_202_ACCEPTED)
+    
+    @override_settings(OCTOFIT_INGEST_BATCH_SIZE=2)
+    def test_full_batch_is_written_by_the_flusher(self):
+        """Test the background thread writes once a batch is complete"""
+        self.post()
+        self.post()
+        for _ in range(100):
+            if Activity.objects.count() == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(Activity.objects.count(), 2)
+    
+    @override_settings(OCTOFIT_INGEST_RETRY_SECONDS=0)
+    def test_failed_write_is_retried(self):
+        """Test a batch whose insert fails is kept and written on the next attempt"""
+        self.post(300)
+        write_documents = buffer.write_documents
+        attempts = []
+        
+        def flaky(*args, **kwargs):
+            attempts.append(kwargs['retried'])
+            if len(attempts) == 1:
+                raise ConnectionFailure('primary unreachable')
+            return write_documents(*args, **kwargs)
+        
+        with mock.patch.object(buffer, 'write_documents', flaky):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(attempts, [False, True])
+        entry = Leaderboard.objects.get(user_id='123')
+        self.assertEqual((entry.total_calories, entry.total_activities), (300, 1))
+    
+    @override_settings(OCTOFIT_INGEST_RETRY_SECONDS=0, OCTOFIT_INGEST_EXIT_RETRY_SECONDS=0)
+    def test_unwritable_batch_is_spilled(self):
+        """Test activities still unwritten at the exit deadline are saved to a file"""
+        activity_id = self.post(300).data['id']
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(OCTOFIT_INGEST_SPILL_DIR=directory), \
+                    mock.patch.object(buffer, 'write_documents', side_effect=ConnectionFailure('down')):
+                self.assertEqual(self.buffer.flush(), 0)
+            [path] = Path(directory).iterdir()
+            [line] = path.read_text().splitlines()
+        self.assertEqual(json.loads(line)['_id'], {'$oid': activity_id})
+        self.assertEqual(len(self.buffer), 0)
+        self.assertFalse(Activity.objects.exists())
+
+
+class LRUCacheTest(SimpleTestCase):
+    """Test cases for the object cache's LRU"""
+    
+    def test_size_bound_evicts_least_recently_used(self):
+        """Test the oldest untouched entry is evicted first"""
+        lru = objectcache.LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        stats = lru.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses'], stats['evictions']), (2, 3, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.75)
+    
+    def test_expired_entry_is_a_miss(self):
+        """Test entries are dropped once their TTL has passed"""
+        lru = objectcache.LRUCache(maxsize=2, ttl=0)
+        lru.set('a', 1)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.stats()['size'], 0)
+
+
+class ObjectCacheTest(APITestCase):
+    """Test cases for cached user, team and workout lookups"""
+    
+    def setUp(self):
+        objectcache.clear()
+        self.user = User.objects.create(
+            name="Tony Stark",
+            email="tony@example.com",
+            password="ironman",
+            team="Avengers"
+        )
+        self.url = f'/api/users/{self.user._id}/'
+    
+    def test_retrieve_is_served_from_cache(self):
+        """Test repeated retrieves do not see writes that bypass the ORM"""
+        self.assertEqual(self.client.get(self.url).data['name'], 'Tony Stark')
+        User.objects.mongo_update_one({'_id': self.user._id}, {'$set': {'name': 'Iron Man'}})
+        self.assertEqual(self.client.get(self.url).data['name'], 'Tony Stark')
+        stats = objectcache.stats()['users']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_save_and_delete_evict(self):
+        """Test ORM writes are visible to the next lookup"""
+        self.client.get(self.url)
+        self.client.patch(self.url, {'name': 'Iron Man'}, format='json')
+        self.assertEqual(self.client.get(self.url).data['name'], 'Iron Man')
+        self.client.delete(self.url)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_get_many_queries_only_misses(self):
+        """Test batch lookups combine cached and fetched users"""
+        other = User.objects.create(name="Steve Rogers", email="steve@example.com", password="shield")
+        objectcache.get(User, self.user._id)
+        users = objectcache.get_many(User, [str(self.user._id), str(other._id), 'not-an-id'])
+        self.assertEqual(sorted(user.name for user in users.values()), ['Steve Rogers', 'Tony Stark'])
+        stats = objectcache.stats()['users']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+    
+    def test_metrics_expose_cache_counters(self):
+        """Test the Prometheus endpoint reports hit and miss counts"""
+        self.client.get(self.url)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('octofit_object_cache_misses_total{collection="users"} 1', body)
+
+
+class CompactActivityFieldsTest(SimpleTestCase):
+    """Test cases for the compact activity encoding"""
+    
+    def test_values_round_trip(self):
+        """Test known values shrink and unknown ones are kept as they are"""
+        user_id = str(ObjectId())
+        document = encode_document(CompactActivity, {
+            'user_id': user_id, 'activity_type': 'Weightlifting', 'distance': 12.34,
+        })
+        self.assertEqual(document, {'u': ObjectId(user_id), 't': 3, 'm': 12340})
+        fields = {name: CompactActivity._meta.get_field(name) for name in ('user_id', 'activity_type', 'distance')}
+        self.assertEqual(fields['user_id'].decode(document['u']), user_id)
+        self.assertEqual(fields['activity_type'].decode(document['t']), 'Weightlifting')
+        self.assertEqual(fields['distance'].decode(document['m']), 12.34)
+        self.assertEqual(
+            encode_document(CompactActivity, {'user_id': '123', 'activity_type': 'Climbing', 'distance': None}),
+            {'u': '123', 't': 'Climbing', 'm': None}
+        )
+    
+    def test_unknown_code_is_a_clear_error(self):
+        """Test decoding a code outside the table names the field"""
+        with self.assertRaisesRegex(ValueError, 'Unknown activity_type code 99'):
+            CompactActivity._meta.get_field('activity_type').decode(99)
+    
+    def test_distance_precision_is_validated(self):
+        """Test distances finer than the stored metre are rejected in both schemas"""
+        data = {'user_id': '123', 'user_name': 'Test User', 'activity_type': 'Running',
+                'duration': 30, 'calories_burned': 300}
+        for model in (CompactActivity, LegacyActivity):
+            field = model._meta.get_field('distance')
+            field.run_validators(5.123)
+            with self.assertRaises(ValidationError):
+                field.run_validators(5.1234)
+        self.assertTrue(ActivitySerializer(data=dict(data, distance=5.123)).is_valid())
+        self.assertFalse(ActivitySerializer(data=dict(data, distance=5.1234)).is_valid())
+    
+    def test_documents_render_like_instances(self):
+        """Test the API shape is unchanged for compact documents"""
+        activity = Activity(
+            _id=ObjectId(), user_id=str(ObjectId()), user_name='Test User', activity_type='Yoga',
+            duration=45, calories_burned=160, distance=1.5, date=datetime.datetime(2024, 5, 1, 7, 30)
+        )
+        document = encode_document(Activity, {
+            field.name: getattr(activity, field.attname) for field in Activity._meta.concrete_fields
+        })
+        self.assertEqual(ActivityDocumentSerializer(document).data, ActivitySerializer(activity).data)
+    
+    def test_admin_searches_encoded_fields_exactly(self):
+        """Test admin search matches compact user ids and types by value"""
+        self.assertEqual(
+            ActivityAdmin(CompactActivity, admin.site).get_search_fields(None),
+            ('user_name', 'activity_type__exact', 'user_id__exact'),
+        )
+        self.assertEqual(
+            ActivityAdmin(LegacyActivity, admin.site).get_search_fields(None),
+            ('user_name', 'activity_type', 'user_id'),
+        )
+
+
+class ActivityMigrationTest(APITestCase):
+    """Test cases for migrating legacy activities to the compact schema"""
+    
+    def setUp(self):
+        self.db = activity_migration.database()
+        self.addCleanup(self.db.drop_collection, activity_migration.LEGACY_COLLECTION)
+        self.addCleanup(self.db.drop_collection, activity_migration.STATE_COLLECTION)
+        self.user_id = str(ObjectId())
+        self.legacy = [
+            {
+                '_id': ObjectId(),
+                'user_id': self.user_id,
+                'user_name': 'Legacy User',
+                'activity_type': activity_type,
+                'duration': 30,
+                'calories_burned': 100 * (i + 1),
+                'distance': 5.0 if activity_type == 'Running' else None,
+                'date': datetime.datetime(2024, 1, 1 + i),
+            }
+            for i, activity_type in enumerate(['Running', 'Yoga', 'Climbing', 'Running', 'HIIT'])
+        ]
+        self.db[activity_migration.LEGACY_COLLECTION].insert_many(self.legacy)
+    
+    def test_migration_resumes_and_keeps_the_api_shape(self):
+        """Test an interrupted migration resumes and the copies read back unchanged"""
+        state = activity_migration.migrate(batch_size=2, max_batches=1)
+        self.assertEqual((state['copied'], state['finished_at']), (2, None))
+        # A replayed batch only hits duplicate keys
+        self.db[activity_migration.STATE_COLLECTION].update_one(
+            {'_id': activity_migration.MIGRATION}, {'$set': {'last_id': None}}
+        )
+        out = StringIO()
+        call_command('migrate_activities', '--batch-size', '2', stdout=out)
+        self.assertIn('Migration finished: 5 activities copied', out.getvalue())
+        self.assertIn('Compact format saves', out.getvalue())
+        
+        response = self.client.get(f'/api/activities/?user_id={self.user_id}')
+        self.assertEqual(
+            [(a['activity_type'], a['calories_burned'], a['distance']) for a in response.data['results']],
+            [('HIIT', 500, None), ('Running', 400, 5.0), ('Climbing', 300, None),
+             ('Yoga', 200, None), ('Running', 100, 5.0)]
+        )
+        stored = CompactActivity.objects.mongo_find_one({'_id': self.legacy[0]['_id']})
+        self.assertEqual((stored['u'], stored['t'], stored['m']), (ObjectId(self.user_id), 0, 5000))
+        report = activity_migration.storage_report()
+        self.assertLess(report['compact']['per_document']['data_bytes'],
+                        report['legacy']['per_document']['data_bytes'])
+    
+    def test_delete_during_a_batch_is_not_resurrected(self):
+        """Test a legacy document deleted while its batch is copied does not come back"""
+        deleted = self.legacy[1]['_id']
+        insert_many = CompactActivity.objects.mongo_insert_many
+        
+        def insert_after_delete(documents, **kwargs):
+            self.db[activity_migration.LEGACY_COLLECTION].delete_one({'_id': deleted})
+            activity_migration.mirror(deleted=[LegacyActivity(_id=deleted)])
+            return insert_many(documents, **kwargs)
+        
+        with mock.patch.object(CompactActivity.objects, 'mongo_insert_many', insert_after_delete):
+            activity_migration.migrate(batch_size=2, max_batches=1)
+        self.assertIsNone(CompactActivity.objects.mongo_find_one({'_id': deleted}))
+        self.assertIsNotNone(CompactActivity.objects.mongo_find_one({'_id': self.legacy[0]['_id']}))
+    
+    def test_finished_migration_reconciles_user_names(self):
+        """Test a rename that raced the copy is applied before the migration is reported finished"""
+        user = User.objects.create(name='Renamed User', email='renamed@example.com', password='secret')
+        self.db[activity_migration.LEGACY_COLLECTION].update_many({}, {'$set': {'user_id': str(user._id)}})
+        state = activity_migration.migrate(batch_size=2)
+        self.assertIsNotNone(state['finished_at'])
+        names = {document['n'] for document in CompactActivity.objects.mongo_find({}, {'n': 1})}
+        self.assertEqual(names, {'Renamed User'})
+    
+    def test_legacy_collection_is_kept_until_finished(self):
+        """Test --drop-legacy refuses to run before the migration completes"""
+        activity_migration.migrate(batch_size=2, max_batches=1)
+        with self.assertRaises(CommandError):
+            call_command('migrate_activities', '--drop-legacy', stdout=StringIO())
+        activity_migration.migrate(batch_size=2)
+        with override_settings(OCTOFIT_COMPACT_ACTIVITIES=False), self.assertRaises(CommandError):
+            call_command('migrate_activities', '--drop-legacy', stdout=StringIO())
+        with override_settings(OCTOFIT_COMPACT_ACTIVITIES=True):
+            call_command('migrate_activities', '--drop-legacy', stdout=StringIO())
+        self.assertIsNone(activity_migration.storage_report()['legacy'])
+    
+    @override_settings(OCTOFIT_COMPACT_ACTIVITIES=False)
+    def test_legacy_writes_are_mirrored(self):
+        """Test activity writes reach the compact collection before the switch"""
+        item = {'user_id': self.user_id, 'user_name': 'Legacy User', 'activity_type': 'Yoga',
+                'duration': 20, 'calories_burned': 90}
+        created = self.client.post('/api/activities/', item, format='json').data
+        self.client.post('/api/activities/bulk/', [dict(item, activity_type='Boxing')], format='json')
+        compact = CompactActivity.objects.mongo_find({'u': ObjectId(self.user_id)}, {'t': 1})
+        self.assertEqual(sorted(document['t'] for document in compact), [4, 5])
+        self.client.delete(f'/api/activities/{created["id"]}/')
+        self.assertIsNone(CompactActivity.objects.mongo_find_one({'_id': ObjectId(created['id'])}))
+
+
+class UserSummaryTest(APITestCase):
+    """Test cases for the user profile summary"""
+    
+    def setUp(self):
+        self.user = User.objects.create(
+            name="Tony Stark",
+            email="tony@example.com",
+            password="ironman",
+            team="Avengers"
+        )
+        self.url = f'/api/users/{self.user._id}/summary/'
+    
+    def log(self, activity_type, calories, distance=None):
+        self.client.post('/api/activities/', {
+            'user_id': str(self.user._id),
+            'user_name': 'Tony Stark',
+            'activity_type': activity_type,
+            'duration': 30,
+            'calories_burned': calories,
+            'distance': distance,
+        }, format='json')
+    
+    def test_summary_from_one_aggregation(self):
+        """Test totals, breakdown, bests, recent activities and rank come back together"""
+        self.log('Running', 300, 5.0)
+        self.log('Cycling', 500, 20.5)
+        self.log('Running', 250, 4.2)
+        self.log('Yoga', 120)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual(data['user']['name'], 'Tony Stark')
+        self.assertEqual(
+            {key: data['totals'][key] for key in ('activities', 'calories_burned', 'duration', 'distance')},
+            {'activities': 4, 'calories_burned': 1170, 'duration': 120, 'distance': 29.7}
+        )
+        self.assertEqual(
+            [(t['activity_type'], t['activities'], t['calories_burned']) for t in data['by_type']],
+            [('Running', 2, 550), ('Cycling', 1, 500), ('Yoga', 1, 120)]
+        )
+        self.assertEqual(data['personal_bests']['longest_distance']['distance'], 20.5)
+        self.assertEqual(data['personal_bests']['most_calories']['activity_type'], 'Cycling')
+        self.assertEqual([a['activity_type'] for a in data['recent_activities']],
+                         ['Yoga', 'Running', 'Cycling', 'Running'])
+        self.assertEqual(data['leaderboard'], {'rank': 1, 'total_calories': 1170, 'total_activities': 4})
+    
+    def test_summary_without_activities(self):
+        """Test a new user gets empty totals and no rank"""
+        data = self.client.get(self.url).data
+        self.assertEqual(data['totals']['activities'], 0)
+        self.assertEqual((data['by_type'], data['recent_activities'], data['leaderboard']), ([], [], None))
+        self.assertIsNone(data['personal_bests']['longest_distance'])
+    
+    def test_rank_without_current_activities(self):
+        """Test a ranked user whose activities are not in the collection still gets their entry"""
+        Leaderboard.objects.create(
+            user_id=str(self.user._id), user_name='Tony Stark', team='Avengers',
+            total_calories=900, total_activities=3, rank=1
+        )
+        data = self.client.get(self.url).data
+        self.assertEqual(data['totals']['activities'], 0)
+        self.assertEqual(data['leaderboard'], {'rank': 1, 'total_calories': 900, 'total_activities': 3})
+    
+    def test_unknown_user_is_404(self):
+        """Test the summary of a missing user is a 404"""
+        response = self.client.get(f'/api/users/{ObjectId()}/summary/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -22,9 +22,11 @@ import os
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
+from .async_views import async_read_view
+from .metrics import metrics_view
 from .views import (
     api_root, UserViewSet, TeamViewSet, ActivityViewSet,
-    LeaderboardViewSet, WorkoutViewSet
+    LeaderboardViewSet, WorkoutViewSet, StatsViewSet, JobViewSet
 )
 
 # Configure base URL for Codespaces environment
@@ -41,9 +43,25 @@ router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'jobs', JobViewSet, basename='job')
+
+# Async list/retrieve for the read-heavy resources; see async_views
+async_urls = []
+for prefix, viewset, basename in [
+    ('leaderboard', LeaderboardViewSet, 'leaderboard'),
+    ('activities', ActivityViewSet, 'activity'),
+    ('workouts', WorkoutViewSet, 'workout'),
+]:
+    async_urls += [
+        path(f'{prefix}/', async_read_view(viewset, 'list'), name=f'async-{basename}-list'),
+        path(f'{prefix}/<str:pk>/', async_read_view(viewset, 'retrieve'), name=f'async-{basename}-detail'),
+    ]
 
 urlpatterns = [
     path('', api_root, name='api-root'),
     path('admin/', admin.site.urls),
+    path('api/async/', include(async_urls)),
     path('api/', include(router.urls)),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,11 +1,35 @@
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
+import copy
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, StreamingHttpResponse
+from rest_framework import status, viewsets
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
+from .buffer import get_buffer
+from . import objectcache
+from .cache import CachedResponseMixin
+from .documents import DocumentReadMixin
+from .export import CONTENT_TYPES, EXPORT_FORMATS, export_query, iter_export
+from .filters import activity_lookups
+from .jobs import STATUSES, enqueue
+from .ingest import apply_activity_changes, insert_activities
+from .leaderboard import rank_with_neighbours
+from .models import User, Team, Activity, Leaderboard, Workout, ActivityRollup, Job
+from .pagination import ActivityCursorPagination, RollupPagination
+from .profiles import user_summary
+from .rollups import PERIODS, SCOPES
+from .teams import team_aggregate, team_leaderboard
+from .windows import parse_window, window_ranking
 from .serializers import (
-    UserSerializer, TeamSerializer, ActivitySerializer,
-    LeaderboardSerializer, WorkoutSerializer
+    check_fields, UserSerializer, TeamSerializer, ActivitySerializer,
+    LeaderboardSerializer, WorkoutSerializer, ActivityRollupSerializer, JobSerializer,
+    UserCompiledSerializer, TeamCompiledSerializer, WorkoutCompiledSerializer,
+    ActivityDocumentSerializer, LeaderboardDocumentSerializer,
+    ActivityRollupDocumentSerializer, LeaderboardWindowDocumentSerializer, JobDocumentSerializer
 )
 
 
@@ -20,44 +44,409 @@ def api_root(request, format=None):
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
+        'stats': reverse('stats-list', request=request, format=format),
+        'jobs': reverse('job-list', request=request, format=format),
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class SparseFieldsMixin:
+    """
+    ``?fields=a,b`` narrows ``GET`` responses to those fields. Compiled and
+    document serializers are narrowed as classes, so the Mongo projection
+    (or ``only()`` on the queryset) shrinks with them; the model serializer
+    path drops the other fields from its output.
+    """
+    fields_param = 'fields'
+
+    def get_sparse_fields(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        value = self.request.query_params.get(self.fields_param, '')
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        return list(dict.fromkeys(names)) or None
+
+    def narrow(self, serializer_class):
+        """``serializer_class`` restricted to the requested fields, if any."""
+        names = self.get_sparse_fields()
+        return serializer_class.for_fields(names) if names else serializer_class
+
+    def get_compiled_serializer_class(self):
+        return self.narrow(super().get_compiled_serializer_class())
+
+    def get_document_serializer_class(self):
+        return self.narrow(super().get_document_serializer_class())
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        names = self.get_sparse_fields()
+        if names and self.action in ('list', 'retrieve'):
+            model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+            selected = [name for name in names if name in model_fields]
+            if selected:
+                queryset = queryset.only(*selected)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        names = self.get_sparse_fields()
+        if names:
+            fields = getattr(serializer, 'child', serializer).fields
+            check_fields(names, [name for name, field in fields.items() if not field.write_only])
+            for name in [name for name in fields if name not in names]:
+                fields.pop(name)
+        return serializer
+
+
+class CompiledReadMixin:
+    """
+    Render ``list`` and ``retrieve`` with ``compiled_serializer_class`` when
+    ``OCTOFIT_FAST_SERIALIZATION`` is on. Writes and forms keep using
+    ``serializer_class``.
+    """
+    compiled_serializer_class = None
+
+    def get_compiled_serializer_class(self):
+        return self.compiled_serializer_class
+
+    def list(self, request, *args, **kwargs):
+        if not settings.OCTOFIT_FAST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        serializer_class = self.get_compiled_serializer_class()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = serializer_class(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer_class(queryset, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.OCTOFIT_FAST_SERIALIZATION:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_compiled_serializer_class()(self.get_object()).data)
+
+
+class CachedObjectMixin:
+    """Look up the object for ``cached_actions`` in ``objectcache`` instead of Mongo."""
+    cached_actions = ('retrieve',)
+
+    def get_object(self):
+        if self.action not in self.cached_actions:
+            return super().get_object()
+        model = self.get_queryset().model
+        try:
+            instance = objectcache.get(model, self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except model.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+
+class UserViewSet(SparseFieldsMixin, CachedObjectMixin, CompiledReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing users.
+
+    ``<id>/summary/`` returns a profile's activity totals, per-type
+    breakdown, personal bests, recent activities and leaderboard entry,
+    computed by a single aggregation.
+
+    Renaming a user or moving them to another team queues a
+    ``propagate_user`` job that updates the activities and leaderboard
+    entries carrying the old values; a team change also queues a
+    ``repair_team_rollups`` job that moves their history to the new team's
+    rollups.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    compiled_serializer_class = UserCompiledSerializer
+    cached_actions = ('retrieve', 'summary')
+
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        user = self.get_object()
+        return Response(dict(user=UserCompiledSerializer(user).data, **user_summary(str(user._id))))
 
+    def perform_update(self, serializer):
+        before = (serializer.instance.name, serializer.instance.team)
+        user = serializer.save()
+        if (user.name, user.team) != before:
+            # Activities and leaderboard rows copy these; rewrite them in the background.
+            enqueue('propagate_user', {'user_id': str(user._id)})
+        if user.team != before[1]:
+            # Team rollups credit the user's current team, for past activities too.
+            teams = sorted(team for team in (before[1], user.team) if team)
+            enqueue('repair_team_rollups', {'teams': teams})
 
-class TeamViewSet(viewsets.ModelViewSet):
+
+class TeamViewSet(CachedResponseMixin, SparseFieldsMixin, CachedObjectMixin, CompiledReadMixin,
+                  viewsets.ModelViewSet):
     """
-    API endpoint for viewing and editing teams.
+    API endpoint for viewing and editing teams. Reads are cached.
+
+    ``leaderboard/`` ranks every team by total calories and ``<id>/aggregate/``
+    returns one team's totals, average calories and member count.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    compiled_serializer_class = TeamCompiledSerializer
+    cache_models = (Team, User, Leaderboard)
 
+    @action(detail=False)
+    def leaderboard(self, request):
+        return Response(team_leaderboard())
 
-class ActivityViewSet(viewsets.ModelViewSet):
+    @action(detail=True)
+    def aggregate(self, request, pk=None):
+        return Response(team_aggregate(self.get_object().name))
+
+
+class ActivityViewSet(SparseFieldsMixin, DocumentReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing activities.
+
+    Listed newest first with cursor pagination straight from Mongo; every
+    write is mirrored onto the leaderboard and rollups incrementally.
+    Filter with ``user_id``, ``activity_type``, ``date_from`` (inclusive),
+    ``date_to`` (exclusive), and with ``user_id`` also
+    ``min_duration``/``max_duration`` and ``min_calories``/``max_calories``.
+
+    With ``OCTOFIT_INGEST_BUFFERED`` a POST is validated, queued for a
+    batched insert and answered with 202 (see ``buffer``).
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    document_serializer_class = ActivityDocumentSerializer
+    pagination_class = ActivityCursorPagination
+
+    def get_document_query(self):
+        query = super().get_document_query()
+        if self.action != 'list':
+            return query
+        try:
+            return query.filter(**activity_lookups(self.request.query_params))
+        except DjangoValidationError as exc:
+            raise ValidationError({'date': exc.messages})
+
+    def create(self, request, *args, **kwargs):
+        if not settings.OCTOFIT_INGEST_BUFFERED:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        activity = Activity(**serializer.validated_data)
+        get_buffer().add(activity)
+        return Response(ActivitySerializer(activity).data, status=status.HTTP_202_ACCEPTED)
+
+    def perform_create(self, serializer):
+        apply_activity_changes(added=[serializer.save()])
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        activity = serializer.save()
+        apply_activity_changes(added=[activity], removed=[previous])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        apply_activity_changes(removed=[instance])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create a batch of activities with a single ``insert_many``.
+
+        Each item is validated on its own; invalid or rejected items are
+        reported under ``errors`` by index and do not block the rest.
+        """
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of activities.']})
+        serializer = self.get_serializer(data=request.data, many=True)
+        valid, errors = [], []
+        for index, item in enumerate(request.data):
+            try:
+                valid.append((index, serializer.child.run_validation(item)))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        inserted, failures = insert_activities(
+            [Activity(**validated_data) for _, validated_data in valid]
+        )
+        for position, message in failures.items():
+            errors.append({'index': valid[position][0], 'errors': {'non_field_errors': [message]}})
+        errors.sort(key=lambda error: error['index'])
+        return Response(
+            {'created': ActivitySerializer(inserted, many=True).data, 'errors': errors},
+            status=status.HTTP_400_BAD_REQUEST if errors and not inserted else status.HTTP_201_CREATED,
+        )
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream every matching activity as NDJSON (default) or CSV.
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+        Query parameters: ``output`` (``ndjson`` or ``csv``), ``user_id``,
+        ``date_from`` (inclusive) and ``date_to`` (exclusive).
+        """
+        params = request.query_params
+        output = params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': [f'Must be one of: {", ".join(EXPORT_FORMATS)}.']})
+        try:
+            documents = export_query(
+                params.get('user_id'), params.get('date_from'), params.get('date_to')
+            )
+        except ValueError as exc:
+            raise ValidationError({'date': [str(exc)]})
+        response = StreamingHttpResponse(
+            iter_export(output, documents), content_type=CONTENT_TYPES[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
+
+
+class LeaderboardViewSet(CachedResponseMixin, SparseFieldsMixin, DocumentReadMixin, viewsets.ModelViewSet):
     """
-    API endpoint for viewing and editing leaderboard entries.
+    API endpoint for viewing and editing leaderboard entries. Reads are cached.
+
+    ``?window=week``, ``?window=month`` or ``?window=<N>d`` ranks activity in
+    that window instead of all time; ``start`` selects a past week or month.
+    ``rank/<user_id>/`` looks up one user's position and neighbours.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    document_serializer_class = LeaderboardDocumentSerializer
+    cache_models = (Leaderboard, ActivityRollup)
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if 'window' not in params:
+            return super().list(request, *args, **kwargs)
+        try:
+            window = parse_window(params['window'], params.get('start'))
+        except ValueError as exc:
+            raise ValidationError({'window': [str(exc)]})
+        page = self.paginate_queryset(window_ranking(window))
+        response = self.get_paginated_response(
+            self.narrow(LeaderboardWindowDocumentSerializer)(page, many=True).data
+        )
+        response.data['window'] = {
+            'key': window.key,
+            'start': window.start.date().isoformat(),
+            'end': window.end.date().isoformat(),
+            'closed': window.closed,
+        }
+        return response
 
+    @action(detail=False, url_path=r'rank/(?P<user_id>[^/.]+)')
+    def rank(self, request, user_id):
+        """
+        A user's rank and score with up to ``k`` (default 5, max 50)
+        neighbours above and below.
+        """
+        try:
+            k = min(max(int(request.query_params.get('k', 5)), 0), 50)
+        except ValueError:
+            raise ValidationError({'k': ['A valid integer is required.']})
+        result = rank_with_neighbours(user_id, k)
+        if result is None:
+            raise Http404
+        entry, above, below = result
+        data = LeaderboardDocumentSerializer(entry).data
+        data['above'] = LeaderboardDocumentSerializer(above, many=True).data
+        data['below'] = LeaderboardDocumentSerializer(below, many=True).data
+        return Response(data)
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+
+class WorkoutViewSet(CachedResponseMixin, SparseFieldsMixin, CachedObjectMixin, CompiledReadMixin,
+                     viewsets.ModelViewSet):
     """
-    API endpoint for viewing and editing workouts.
+    API endpoint for viewing and editing workouts. Reads are cached.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    compiled_serializer_class = WorkoutCompiledSerializer
+
+
+class StatsViewSet(SparseFieldsMixin, DocumentReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for pre-aggregated daily and weekly activity totals.
+
+    Filter with ``scope`` (user or team), ``key`` (user id or team name),
+    ``period`` (day or week, default day), ``date_from`` (inclusive) and
+    ``date_to`` (exclusive). ``users/<user_id>/`` and ``teams/<team>/`` are
+    shortcuts for one user's or team's series.
+    """
+    queryset = ActivityRollup.objects.all()
+    serializer_class = ActivityRollupSerializer
+    document_serializer_class = ActivityRollupDocumentSerializer
+    pagination_class = RollupPagination
+
+    def get_document_query(self):
+        if self.action == 'retrieve':
+            return super().get_document_query()
+        params = self.request.query_params
+        scope = self.kwargs.get('scope', params.get('scope'))
+        key = self.kwargs.get('key', params.get('key'))
+        period = params.get('period', 'day')
+        if period not in PERIODS:
+            raise ValidationError({'period': [f'Must be one of: {", ".join(PERIODS)}.']})
+        if scope is not None and scope not in SCOPES:
+            raise ValidationError({'scope': [f'Must be one of: {", ".join(SCOPES)}.']})
+
+        lookups = {'period': period}
+        if scope:
+            lookups['scope'] = scope
+        if key:
+            lookups['key'] = key
+        if params.get('date_from'):
+            lookups['bucket__gte'] = params['date_from']
+        if params.get('date_to'):
+            lookups['bucket__lt'] = params['date_to']
+        try:
+            return super().get_document_query().filter(**lookups)
+        except DjangoValidationError as exc:
+            raise ValidationError({'date': exc.messages})
+
+    @action(detail=False, url_path=r'users/(?P<user_id>[^/.]+)')
+    def user(self, request, user_id):
+        self.kwargs.update(scope='user', key=user_id)
+        return self.list(request)
+
+    @action(detail=False, url_path=r'teams/(?P<team>[^/]+)')
+    def team(self, request, team):
+        self.kwargs.update(scope='team', key=team)
+        return self.list(request)
+
+
+class JobViewSet(SparseFieldsMixin, DocumentReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for background job status, newest first.
+
+    Filter with ``status`` and ``name``. ``POST {"name": ..., "args": {...}}``
+    enqueues a job, coalescing into its pending run if there is one, and
+    answers 202 with that job. Staff only: jobs run full rebuilds and carry
+    internal tracebacks.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    document_serializer_class = JobDocumentSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_document_query(self):
+        query = super().get_document_query()
+        if self.action != 'list':
+            return query
+        params = self.request.query_params
+        if params.get('status') and params['status'] not in STATUSES:
+            raise ValidationError({'status': [f'Must be one of: {", ".join(STATUSES)}.']})
+        lookups = {name: params[name] for name in ('status', 'name') if params.get(name)}
+        return query.filter(**lookups)
+
+    def create(self, request, *args, **kwargs):
+        name = request.data.get('name')
+        job_args = request.data.get('args') or {}
+        if not isinstance(job_args, dict):
+            raise ValidationError({'args': ['Must be an object.']})
+        try:
+            document = enqueue(name, job_args)
+        except ValueError as exc:
+            raise ValidationError({'name': [str(exc)]})
+        except TypeError as exc:
+            raise ValidationError({'args': [str(exc)]})
+        return Response(self.get_document_serializer_class()(document).data, status=status.HTTP_202_ACCEPTED)
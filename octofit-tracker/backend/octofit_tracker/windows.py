@@ -0,0 +1,225 @@
+"""
+Time-windowed leaderboards.
+
+Rankings for a week, a calendar month or the last N days are summed from the
+per-user rollups in the window's date range, which the ``rollups_window``
+index bounds. Only the requested page is selected: ``$sort`` followed by
+``$limit`` runs as a top-K sort on the server, and names are joined for
+those K entries only. Closed weeks and months are ranked once and
+materialized into ``leaderboard_windows``, so past windows are never
+recomputed unless an activity is later written into them.
+
+Each materialized window, empty ones included, has a marker in
+``materialized_windows``. Invalidation bumps the marker's generation, and
+``materialize`` only marks the window done if the generation it started
+from is still current. Entries are merged on the unique
+``(window, user_id)`` key, so concurrent first requests cannot duplicate
+them; ``ensure_indexes`` creates that ``windows_user`` index.
+"""
+import datetime
+import re
+
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from .documents import DocumentQuery, database
+from .models import ActivityRollup, Leaderboard, LeaderboardWindow
+from .rollups import bucket_start
+from .serializers import LeaderboardWindowDocumentSerializer
+
+WINDOW_PATTERN = re.compile(r'^(?:(week|month)|(\d{1,3})d)$')
+MAX_ROLLING_DAYS = 366
+MARKER_COLLECTION = 'materialized_windows'
+
+
+def month_start(moment):
+    return bucket_start(moment, 'day').replace(day=1)
+
+
+def next_month(start):
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+class Window:
+    """A date range to rank over and the rollup period that covers it."""
+
+    def __init__(self, kind, start, end, period, now):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.period = period
+        self.closed = kind in ('week', 'month') and end <= now
+
+    @property
+    def key(self):
+        return f'{self.kind}:{self.start:%Y-%m-%d}'
+
+
+def parse_window(name, start=None, now=None):
+    """
+    Build a ``Window`` from ``week``, ``month`` or ``<N>d``. ``start`` picks
+    a past week/month (any date inside it); rolling windows end today.
+    Raises ``ValueError`` for anything else.
+    """
+    match = WINDOW_PATTERN.match(name or '')
+    if not match:
+        raise ValueError('Window must be "week", "month" or "<days>d".')
+    now = timezone.make_naive(now or timezone.now(), datetime.timezone.utc)
+    kind, days = match.groups()
+
+    if days is not None:
+        days = int(days)
+        if not 1 <= days <= MAX_ROLLING_DAYS:
+            raise ValueError(f'Rolling windows must span 1 to {MAX_ROLLING_DAYS} days.')
+        end = bucket_start(now, 'day') + datetime.timedelta(days=1)
+        return Window(f'{days}d', end - datetime.timedelta(days=days), end, 'day', now)
+
+    anchor = now
+    if start:
+        try:
+            anchor = datetime.datetime.fromisoformat(start)
+        except ValueError:
+            raise ValueError('Start must be an ISO 8601 date.')
+    if kind == 'week':
+        begin = bucket_start(anchor, 'week')
+        return Window(kind, begin, begin + datetime.timedelta(days=7), 'week', now)
+    begin = month_start(anchor)
+    return Window(kind, begin, next_month(begin), 'day', now)
+
+
+def _totals_pipeline(window):
+    return [
+        {'$match': {
+            'scope': 'user',
+            'period': window.period,
+            'bucket': {'$gte': window.start, '$lt': window.end},
+        }},
+        {'$group': {
+            '_id': '$key',
+            'total_calories': {'$sum': '$calories_burned'},
+            'total_activities': {'$sum': '$activities'},
+        }},
+        {'$match': {'total_activities': {'$gt': 0}}},
+    ]
+
+
+def _names_stages():
+    """Join the current name/team from the all-time leaderboard entry."""
+    return [
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'localField': '_id',
+            'foreignField': 'user_id',
+            'as': 'entry',
+        }},
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id',
+            'user_name': {'$ifNull': [{'$arrayElemAt': ['$entry.user_name', 0]}, '']},
+            'team': {'$ifNull': [{'$arrayElemAt': ['$entry.team', 0]}, '']},
+            'total_calories': 1,
+            'total_activities': 1,
+            'rank': 1,
+        }},
+    ]
+
+
+class WindowRanking:
+    """
+    Live ranking of an open window. Supports ``count()`` and slicing so
+    DRF's page-number paginator pages it by rank.
+    """
+    ordered = True
+
+    def __init__(self, window):
+        self.window = window
+
+    def count(self):
+        result = list(ActivityRollup.objects.mongo_aggregate(
+            _totals_pipeline(self.window) + [{'$count': 'entries'}]
+        ))
+        return result[0]['entries'] if result else 0
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        start = key.start or 0
+        pipeline = _totals_pipeline(self.window) + [
+            {'$sort': {'total_calories': -1, '_id': 1}},
+            {'$skip': start},
+        ]
+        if key.stop is not None:
+            pipeline.append({'$limit': max(key.stop - start, 0)})
+        entries = list(ActivityRollup.objects.mongo_aggregate(pipeline + _names_stages()))
+        for offset, entry in enumerate(entries):
+            entry['rank'] = start + offset + 1
+        return entries
+
+
+def _span(day):
+    return {'window_start': {'$lte': day}, 'window_end': {'$gt': day}}
+
+
+def materialize(window):
+    """Rank a closed window and store every entry, then mark it materialized."""
+    markers = database()[MARKER_COLLECTION]
+    marker = markers.find_one_and_update(
+        {'_id': window.key},
+        {'$setOnInsert': {
+            'window_start': window.start, 'window_end': window.end, 'generation': 0, 'materialized': False,
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    LeaderboardWindow.objects.mongo_delete_many({'window': window.key})
+    pipeline = _totals_pipeline(window) + [
+        {'$setWindowFields': {
+            'sortBy': {'total_calories': -1, '_id': 1},
+            'output': {'rank': {'$documentNumber': {}}},
+        }},
+    ] + _names_stages() + [
+        {'$addFields': {
+            'window': window.key,
+            'window_start': window.start,
+            'window_end': window.end,
+        }},
+        {'$merge': {
+            'into': LeaderboardWindow._meta.db_table,
+            'on': ['window', 'user_id'],
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert',
+        }},
+    ]
+    ActivityRollup.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+    # An invalidation since we started bumped the generation; leave the window unmarked
+    markers.update_one(
+        {'_id': window.key, 'generation': marker['generation']},
+        {'$set': {'materialized': True}},
+    )
+
+
+def window_ranking(window):
+    """Return a paginatable ranking of raw entries for ``window``."""
+    if not window.closed:
+        return WindowRanking(window)
+    query = DocumentQuery(
+        LeaderboardWindow, projection=LeaderboardWindowDocumentSerializer.projection()
+    ).filter(window=window.key)
+    if not database()[MARKER_COLLECTION].find_one({'_id': window.key, 'materialized': True}, {'_id': 1}):
+        materialize(window)
+    return query
+
+
+def invalidate_windows(dates):
+    """
+    Drop materialized windows that an activity written on ``dates`` changes.
+    Only materialized windows have markers, so open ones are never matched.
+    """
+    days = {bucket_start(date, 'day') for date in dates}
+    if days:
+        spans = {'$or': [_span(day) for day in days]}
+        database()[MARKER_COLLECTION].update_many(
+            spans, {'$inc': {'generation': 1}, '$set': {'materialized': False}}
+        )
+        LeaderboardWindow.objects.mongo_delete_many(spans)